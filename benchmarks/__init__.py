@@ -0,0 +1 @@
+"""Offline benchmarks of pyclowder, see run.py."""
@@ -0,0 +1,181 @@
+"""Fake Broker
+
+An in-process stand-in for the parts of pika's BlockingConnection used by the RabbitMQConnector, to benchmark
+extractors without a RabbitMQ server. Messages published to a queue are delivered to the consumers of that queue from
+process_data_events, limited by the prefetch count of the channel. The broker remembers when each message was
+published and acknowledged. disconnect drops all connections, like a restart of RabbitMQ, and delivers their
+unacknowledged messages again.
+"""
+
+import collections
+import itertools
+import threading
+import time
+
+import pika
+
+
+class FakeBroker(object):
+    """Queues and the connections to them, use connect as replacement of pika.BlockingConnection."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queues = collections.defaultdict(collections.deque)
+        self.exchanges = collections.Counter()
+        self.connections = []
+        self.published = dict()
+        self.acked = dict()
+        self.delivery_tags = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    def connect(self, parameters=None):
+        connection = FakeConnection(self)
+        with self.condition:
+            self.connections.append(connection)
+        return connection
+
+    def disconnect(self):
+        """Drop all connections, their unacknowledged messages are delivered again."""
+        with self.condition:
+            for connection in self.connections:
+                connection.lost()
+            self.connections = []
+            self.condition.notify_all()
+
+    def publish(self, routing_key, body, properties=None, exchange=''):
+        """Publish a message, returns the id used for published and acked."""
+        with self.condition:
+            if exchange:
+                self.exchanges[exchange] += 1
+                return None
+            message_id = next(self.message_ids)
+            self.published[message_id] = time.time()
+            self.queues[routing_key].append((message_id, properties or pika.BasicProperties(), body, False))
+            self.condition.notify_all()
+            return message_id
+
+    def ack(self, message_id):
+        with self.condition:
+            self.acked[message_id] = time.time()
+            self.condition.notify_all()
+
+    def wait_acked(self, count, timeout=None):
+        """Wait until count messages are acknowledged, returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while len(self.acked) < count:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+class FakeConnection(object):
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.callbacks = []
+        self.channels = []
+
+    def channel(self, on_open_callback=None):
+        channel = FakeChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        with self.broker.condition:
+            self.callbacks.append(callback)
+            self.broker.condition.notify_all()
+
+    def process_data_events(self, time_limit=0):
+        """Deliver waiting messages and run callbacks, waits up to time_limit seconds for something to do."""
+        with self.broker.condition:
+            (callbacks, deliveries) = self._collect()
+            if not callbacks and not deliveries and time_limit:
+                self.broker.condition.wait(time_limit)
+                (callbacks, deliveries) = self._collect()
+            if not self.is_open:
+                raise pika.exceptions.StreamLostError('Stream connection lost')
+        for callback in callbacks:
+            callback()
+        for (channel, callback, method, properties, body) in deliveries:
+            callback(channel, method, properties, body)
+
+    def _collect(self):
+        (callbacks, self.callbacks) = (self.callbacks, [])
+        deliveries = []
+        for channel in self.channels:
+            for (tag, (queue, callback)) in list(channel.consumers.items()):
+                messages = self.broker.queues[queue]
+                while messages and (channel.prefetch_count == 0 or len(channel.unacked) < channel.prefetch_count):
+                    (message_id, properties, body, redelivered) = messages.popleft()
+                    delivery_tag = next(self.broker.delivery_tags)
+                    channel.unacked[delivery_tag] = (queue, message_id, properties, body)
+                    method = pika.spec.Basic.Deliver(consumer_tag=tag, delivery_tag=delivery_tag,
+                                                     redelivered=redelivered, routing_key=queue)
+                    deliveries.append((channel, callback, method, properties, body))
+        return callbacks, deliveries
+
+    def lost(self):
+        """Close the connection and put its unacknowledged messages back in their queues."""
+        with self.broker.condition:
+            for channel in self.channels:
+                for (queue, message_id, properties, body) in reversed(list(channel.unacked.values())):
+                    self.broker.queues[queue].appendleft((message_id, properties, body, True))
+                channel.unacked.clear()
+                channel.consumers.clear()
+                channel.is_open = False
+            self.is_open = False
+
+    def close(self):
+        self.lost()
+
+
+class FakeChannel(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_open = True
+        self.prefetch_count = 0
+        self.consumers = dict()
+        self.unacked = dict()
+
+    @property
+    def _consumer_infos(self):
+        return self.consumers
+
+    def basic_qos(self, prefetch_count=0, callback=None):
+        self.prefetch_count = prefetch_count
+
+    def queue_declare(self, queue, durable=False, callback=None):
+        pass
+
+    def exchange_declare(self, exchange, exchange_type=None, durable=False, callback=None):
+        pass
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        tag = 'ctag%d' % (len(self.consumers) + 1)
+        self.consumers[tag] = (queue, on_message_callback)
+        return tag
+
+    def stop_consuming(self, consumer_tag=None):
+        with self.connection.broker.condition:
+            if consumer_tag:
+                self.consumers.pop(consumer_tag, None)
+            else:
+                self.consumers.clear()
+            self.connection.broker.condition.notify_all()
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if not self.is_open:
+            raise pika.exceptions.ChannelWrongStateError('Channel is closed.')
+        self.connection.broker.publish(routing_key, body, properties, exchange)
+
+    def basic_ack(self, delivery_tag):
+        if not self.is_open:
+            raise pika.exceptions.ChannelWrongStateError('Channel is closed.')
+        message_id = self.unacked.pop(delivery_tag)[1]
+        self.connection.broker.ack(message_id)
+
+    def close(self):
+        self.is_open = False
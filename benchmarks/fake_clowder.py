@@ -0,0 +1,122 @@
+"""Fake Clowder
+
+A local stand-in for the parts of the Clowder v1 and v2 API used by pyclowder, to benchmark extractors without a
+Clowder instance. Every file has the same synthetic content of file_size bytes, downloads support range requests.
+Any other GET returns an empty JSON object (or list for metadata), and any other POST, PUT or DELETE reads the body
+and returns a new id. The server counts the bytes send and received.
+"""
+
+import json
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+_file_blob = re.compile(r'^/api(/v2)?/files/([^/]+)(/blob)?$')
+_file_info = re.compile(r'^/api(/v2)?/files/([^/]+)/(metadata|summary)$')
+_range = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+class _ClowderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        match = _file_blob.match(path)
+        if match:
+            return self._send_file()
+        match = _file_info.match(path)
+        if match:
+            fileid = match.group(2)
+            return self._reply({'id': fileid, 'filename': fileid + '.bin', 'name': fileid + '.bin',
+                                'size': self.server.file_size, 'bytes': self.server.file_size,
+                                'content-type': 'application/octet-stream'})
+        if path.endswith('/metadata.jsonld') or path.endswith('/metadata') or path.endswith('/files'):
+            return self._reply([])
+        self._reply({})
+
+    def do_POST(self):
+        self._read_body()
+        self._reply({'id': uuid.uuid4().hex[:24]})
+
+    do_PUT = do_POST
+    do_PATCH = do_POST
+
+    def do_DELETE(self):
+        self._read_body()
+        self._reply({'status': 'success'})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        remaining = length
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        self.server.count('received', length)
+
+    def _send_file(self):
+        data = self.server.data
+        (start, end) = (0, len(data) - 1)
+        match = _range.match(self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        view = memoryview(data)
+        for offset in range(start, end + 1, 1024 * 1024):
+            self.wfile.write(view[offset:min(offset + 1024 * 1024, end + 1)])
+        self.server.count('send', end - start + 1)
+        self.server.count('requests', 1)
+
+    def _reply(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count('requests', 1)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeClowder(ThreadingMixIn, HTTPServer):
+    """Local Clowder stand-in, serving on a free port of 127.0.0.1 until stop is called."""
+
+    daemon_threads = True
+
+    def __init__(self, file_size=1024 * 1024, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), _ClowderHandler)
+        self.file_size = int(file_size)
+        self.data = bytes(bytearray(i % 251 for i in range(min(self.file_size, 251)))) * \
+            (self.file_size // 251 + 1)
+        self.data = self.data[:self.file_size]
+        self.counters = {'send': 0, 'received': 0, 'requests': 0}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self.server_port
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] += value
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="FakeClowder")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
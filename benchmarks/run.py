@@ -0,0 +1,164 @@
+"""Benchmark
+
+Runs a RabbitMQConnector end-to-end against a FakeClowder server and a FakeBroker, and reports the messages processed
+per second, the latency from publishing a message until it is acknowledged, and the bytes per second downloaded from
+and uploaded to clowder. Nothing outside this process is needed, so the numbers can be compared between versions of
+pyclowder:
+
+    python -m benchmarks.run --messages 500 --file-size 1048576 --workers 4
+    python -m benchmarks.run --clowder-version 2 --upload-size 1048576 --json
+
+The Clowder API version is selected using CLOWDER_VERSION, like it is for extractors, --clowder-version sets it before
+pyclowder is imported.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    # nearest rank
+    index = min(len(values) - 1, max(0, int(math.ceil(percent / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+def run_benchmark(messages=100, file_size=1024 * 1024, upload_size=0, workers=1, processes=0, resource='file',
+                  timeout=600, **connector_args):
+    """Process messages synthetic messages and return the statistics of the run.
+
+    Each message is a new file (or dataset) of file_size bytes that is downloaded by the connector. process_message
+    reads the downloaded file and, if upload_size is set, uploads a file of upload_size bytes to the dataset.
+
+    Keyword arguments:
+    messages -- number of messages to process
+    file_size -- size of the files downloaded
+    upload_size -- size of the file uploaded for each message, 0 does not upload
+    workers -- number of messages processed concurrently, see RabbitMQConnector
+    processes -- number of worker processes, see RabbitMQConnector
+    resource -- 'file' or 'dataset' messages
+    timeout -- seconds to wait for all messages to be processed
+    connector_args -- other arguments of the RabbitMQConnector
+    """
+    import pyclowder.files
+    from pyclowder.connectors import RabbitMQConnector
+    from benchmarks.fake_broker import FakeBroker
+    from benchmarks.fake_clowder import FakeClowder
+
+    upload_file = None
+    if upload_size:
+        (fd, upload_file) = tempfile.mkstemp(suffix='.bin')
+        with os.fdopen(fd, 'wb') as output:
+            output.write(b'\0' * upload_size)
+
+    def process_message(connector, host, secret_key, resource, parameters):
+        for path in resource.get('local_paths', []):
+            if os.path.isfile(path):
+                with open(path, 'rb') as inputfile:
+                    while inputfile.read(1024 * 1024):
+                        pass
+        if upload_file:
+            pyclowder.files.upload_to_dataset(connector, host, secret_key, parameters['datasetId'], upload_file)
+
+    clowder = FakeClowder(file_size=file_size).start()
+    broker = FakeBroker()
+    queue = 'benchmark'
+    extractor_info = {'name': queue, 'version': '1.0', 'description': 'benchmark', 'process': {resource: []}}
+    connector = RabbitMQConnector(queue, extractor_info, 'amqp://benchmark', process_message=process_message,
+                                  workers=workers, processes=processes, heartbeat=3600, **connector_args)
+    try:
+        with mock.patch('pika.BlockingConnection', broker.connect):
+            connector.connect()
+            listener = threading.Thread(target=connector.listen, name="RabbitMQConnector")
+            listener.daemon = True
+            listener.start()
+
+            started = time.time()
+            message_ids = []
+            for i in range(messages):
+                fileid = '%024x' % (i + 1)
+                body = {'id': fileid, 'datasetId': 'ds%021x' % (i + 1), 'host': clowder.url, 'secretKey': 'key',
+                        'routing_key': 'clowder.%s.benchmark' % resource, 'filename': fileid + '.bin'}
+                properties = mock.Mock(reply_to='clowder.reply', correlation_id=str(i), timestamp=int(time.time()))
+                message_ids.append(broker.publish(queue, json.dumps(body).encode('utf-8'), properties))
+            finished = broker.wait_acked(messages, timeout)
+            elapsed = time.time() - started
+
+            connector.stop()
+            listener.join(10)
+    finally:
+        clowder.stop()
+        if connector.process_pool:
+            connector.process_pool.shutdown()
+        if upload_file:
+            os.remove(upload_file)
+
+    latencies = [broker.acked[m] - broker.published[m] for m in message_ids if m in broker.acked]
+    return {
+        'messages': len(latencies),
+        'complete': finished,
+        'errors': len(broker.queues['error.' + queue]),
+        'seconds': elapsed,
+        'messages_per_second': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50': _percentile(latencies, 50),
+        'latency_p99': _percentile(latencies, 99),
+        'download_bytes_per_second': clowder.counters['send'] / elapsed if elapsed > 0 else 0.0,
+        'upload_bytes_per_second': clowder.counters['received'] / elapsed if elapsed > 0 else 0.0,
+        'http_requests': clowder.counters['requests'],
+        'status_messages': len(broker.queues['clowder.reply']),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pyclowder using a fake clowder server and broker.')
+    parser.add_argument('--messages', type=int, default=100, help='number of messages to process (default=100)')
+    parser.add_argument('--file-size', dest='file_size', type=int, default=1024 * 1024,
+                        help='bytes downloaded for each message (default=1048576)')
+    parser.add_argument('--upload-size', dest='upload_size', type=int, default=0,
+                        help='bytes uploaded for each message (default=0)')
+    parser.add_argument('--resource', choices=['file', 'dataset'], default='file',
+                        help='type of message to send (default=file)')
+    parser.add_argument('--workers', type=int, default=1, help='messages processed concurrently (default=1)')
+    parser.add_argument('--processes', type=int, default=0, help='worker processes (default=0)')
+    parser.add_argument('--download-segments', dest='download_segments', type=int, default=4,
+                        help='concurrent range requests for large downloads (default=4)')
+    parser.add_argument('--status-interval', dest='status_interval', type=float, default=0,
+                        help='seconds between PROCESSING status updates (default=0)')
+    parser.add_argument('--clowder-version', dest='clowder_version', choices=['1', '2'],
+                        default=os.getenv('CLOWDER_VERSION', '1'), help='clowder API version (default=1)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    # the API version is selected when pyclowder is imported
+    os.environ['CLOWDER_VERSION'] = args.clowder_version
+    logging.basicConfig(level=logging.WARNING)
+
+    results = run_benchmark(messages=args.messages, file_size=args.file_size, upload_size=args.upload_size,
+                            workers=args.workers, processes=args.processes, resource=args.resource,
+                            download_segments=args.download_segments, status_interval=args.status_interval)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("messages          : %d in %.2fs (%d errors)" % (results['messages'], results['seconds'],
+                                                               results['errors']))
+        print("throughput        : %.1f messages/s" % results['messages_per_second'])
+        print("latency           : p50 %.1fms, p99 %.1fms" % (results['latency_p50'] * 1000,
+                                                             results['latency_p99'] * 1000))
+        print("download          : %.1f MB/s" % (results['download_bytes_per_second'] / 1e6))
+        print("upload            : %.1f MB/s" % (results['upload_bytes_per_second'] / 1e6))
+        print("http requests     : %d" % results['http_requests'])
+    return 0 if results['complete'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
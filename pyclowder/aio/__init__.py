@@ -0,0 +1,24 @@
+"""Clowder API for asyncio
+
+The modules in this package provide coroutine versions of the pyclowder files and datasets
+API, to be used from a coroutine process_message with the AsyncRabbitMQConnector. The calls
+to clowder are made using the pooled session of the connector, in the io_executor thread pool of
+the connector (or the default thread pool of the event loop), so they do not block the event loop.
+"""
+
+import asyncio
+import functools
+
+import pyclowder.tracing
+
+
+async def run(connector, func, *args, **kwargs):
+    """Run func(*args, **kwargs) in the io thread pool of the connector and return the result.
+
+    Keyword arguments:
+    connector -- connector information, if it has an io_executor this is used to run func
+    func -- the blocking function to call
+    """
+    loop = asyncio.get_event_loop()
+    executor = getattr(connector, 'io_executor', None)
+    return await loop.run_in_executor(executor, pyclowder.tracing.wrap(functools.partial(func, *args, **kwargs)))
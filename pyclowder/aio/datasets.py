@@ -0,0 +1,107 @@
+"""Clowder API for asyncio
+
+This module provides coroutine wrappers around the clowder Datasets API, see pyclowder.datasets
+"""
+
+import pyclowder.datasets
+from pyclowder.aio import run
+
+
+async def download(connector, host, key, datasetid):
+    """Download dataset to be processed from Clowder as zip file.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the file that is currently being processed
+    """
+    return await run(connector, pyclowder.datasets.download, connector, host, key, datasetid)
+
+
+async def download_and_extract(connector, host, key, datasetid, output_folder):
+    """Download dataset to be processed from Clowder and extract it without storing the zip file.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the file that is currently being processed
+    output_folder -- folder to extract the contents of the dataset into
+    """
+    return await run(connector, pyclowder.datasets.download_and_extract, connector, host, key, datasetid,
+                     output_folder)
+
+
+async def download_metadata(connector, host, key, datasetid, extractor=None):
+    """Download dataset JSON-LD metadata from Clowder.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the dataset to fetch metadata of
+    extractor -- extractor name to filter results (if only one extractor's metadata is desired)
+    """
+    return await run(connector, pyclowder.datasets.download_metadata, connector, host, key, datasetid, extractor)
+
+
+async def get_info(connector, host, key, datasetid):
+    """Get basic dataset information from UUID.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the dataset to get info of
+    """
+    return await run(connector, pyclowder.datasets.get_info, connector, host, key, datasetid)
+
+
+async def get_file_list(connector, host, key, datasetid):
+    """Get list of files in a dataset as JSON object.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the dataset to get filelist of
+    """
+    return await run(connector, pyclowder.datasets.get_file_list, connector, host, key, datasetid)
+
+
+async def upload_metadata(connector, host, key, datasetid, metadata):
+    """Upload dataset JSON-LD metadata to Clowder.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the dataset that is currently being processed
+    metadata -- the metadata to be uploaded
+    """
+    return await run(connector, pyclowder.datasets.upload_metadata, connector, host, key, datasetid, metadata)
+
+
+# pylint: disable=too-many-arguments
+async def upload_preview(connector, host, key, datasetid, previewfile, previewmetadata=None, preview_mimetype=None,
+                         visualization_name=None, visualization_description=None, visualization_config_data=None,
+                         visualization_component_id=None):
+    """Upload preview to Clowder.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the dataset that is currently being processed
+    previewfile -- the file containing the preview
+    previewmetadata -- any metadata to be associated with preview, can contain a section_id
+                    to indicate the section this preview should be associated with.
+    preview_mimetype -- (optional) MIME type of the preview file. By default, this is obtained from the
+                    file itself and this parameter can be ignored. E.g. 'application/vnd.clowder+custom+xml'
+    """
+    return await run(connector, pyclowder.datasets.upload_preview, connector, host, key, datasetid, previewfile,
+                     previewmetadata, preview_mimetype, visualization_name=visualization_name,
+                     visualization_description=visualization_description,
+                     visualization_config_data=visualization_config_data,
+                     visualization_component_id=visualization_component_id)
@@ -0,0 +1,119 @@
+"""Clowder API for asyncio
+
+This module provides coroutine wrappers around the clowder Files API, see pyclowder.files
+"""
+
+import pyclowder.files
+from pyclowder.aio import run
+
+
+async def download(connector, host, key, fileid, intermediatefileid=None, ext="", tracking=True):
+    """Download file to be processed from Clowder.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    fileid -- the file that is currently being processed
+    intermediatefileid -- either same as fileid, or the intermediate file to be used
+    ext -- the file extension, the downloaded file will end with this extension
+    tracking -- should the download action be tracked
+    """
+    return await run(connector, pyclowder.files.download, connector, host, key, fileid, intermediatefileid, ext,
+                     tracking)
+
+
+async def download_info(connector, host, key, fileid):
+    """Download file summary metadata from Clowder.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    fileid -- the file to fetch metadata of
+    """
+    return await run(connector, pyclowder.files.download_info, connector, host, key, fileid)
+
+
+async def download_metadata(connector, host, key, fileid, extractor=None):
+    """Download file JSON-LD metadata from Clowder.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    fileid -- the file to fetch metadata of
+    extractor -- extractor name to filter results (if only one extractor's metadata is desired)
+    """
+    return await run(connector, pyclowder.files.download_metadata, connector, host, key, fileid, extractor)
+
+
+async def upload_metadata(connector, host, key, fileid, metadata):
+    """Upload file JSON-LD metadata to Clowder.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    fileid -- the file that is currently being processed
+    metadata -- the metadata to be uploaded
+    """
+    return await run(connector, pyclowder.files.upload_metadata, connector, host, key, fileid, metadata)
+
+
+# pylint: disable=too-many-arguments
+async def upload_preview(connector, host, key, fileid, previewfile, previewmetadata=None, preview_mimetype=None,
+                         visualization_name=None, visualization_description=None, visualization_config_data=None,
+                         visualization_component_id=None):
+    """Upload preview to Clowder.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    fileid -- the file that is currently being processed
+    previewfile -- the file containing the preview
+    previewmetadata -- any metadata to be associated with preview, can contain a section_id
+                    to indicate the section this preview should be associated with.
+    preview_mimetype -- (optional) MIME type of the preview file. By default, this is obtained from the
+                    file itself and this parameter can be ignored. E.g. 'application/vnd.clowder+custom+xml'
+    """
+    return await run(connector, pyclowder.files.upload_preview, connector, host, key, fileid, previewfile,
+                     previewmetadata, preview_mimetype, visualization_name=visualization_name,
+                     visualization_description=visualization_description,
+                     visualization_config_data=visualization_config_data,
+                     visualization_component_id=visualization_component_id)
+
+
+async def upload_to_dataset(connector, host, key, datasetid, filepath, check_duplicate=False, folder_id=None):
+    """Upload file to existing Clowder dataset.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the dataset that the file should be associated with
+    filepath -- path to file
+    check_duplicate -- check if filename already exists in dataset and skip upload if so
+    folder_id -- the folder that the file should be associated with
+    """
+    return await run(connector, pyclowder.files.upload_to_dataset, connector, host, key, datasetid, filepath,
+                     check_duplicate, folder_id)
+
+
+async def upload_many_to_dataset(connector, host, key, datasetid, filepaths, check_duplicate=False, folder_id=None,
+                                 max_workers=4):
+    """Upload many files to existing Clowder dataset, see pyclowder.files.upload_many_to_dataset.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the dataset that the files should be associated with
+    filepaths -- list of paths of files to upload
+    check_duplicate -- skip files of which the filename already exists in dataset, or earlier in filepaths
+    folder_id -- the folder that the files should be associated with
+    max_workers -- maximum number of files uploaded at the same time
+    """
+    return await run(connector, pyclowder.files.upload_many_to_dataset, connector, host, key, datasetid, filepaths,
+                     check_duplicate, folder_id, max_workers)
@@ -3,10 +3,9 @@ import logging
 import os
 import tempfile
 import posixpath
-import requests
 from pyclowder.client import ClowderClient
 from pyclowder.collections import get_datasets, get_child_collections, delete as delete_collection
-from pyclowder.utils import StatusMessage
+from pyclowder.utils import StatusMessage, extract_zip_stream
 
 
 def create_empty(connector, client, datasetname, description, parentid=None, spaceid=None):
@@ -26,25 +25,25 @@ def create_empty(connector, client, datasetname, description, parentid=None, spa
 
     if parentid:
         if spaceid:
-            result = requests.post(url, headers={"Content-Type": "application/json"},
-                                   data=json.dumps({"name": datasetname, "description": description,
-                                                    "collection": [parentid], "space": [spaceid]}),
-                                   verify=connector.ssl_verify if connector else True)
+            result = connector.post(url, headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"name": datasetname, "description": description,
+                                                     "collection": [parentid], "space": [spaceid]}),
+                                    verify=connector.ssl_verify)
         else:
-            result = requests.post(url, headers={"Content-Type": "application/json"},
-                                   data=json.dumps({"name": datasetname, "description": description,
-                                                    "collection": [parentid]}),
-                                   verify=connector.ssl_verify if connector else True)
+            result = connector.post(url, headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"name": datasetname, "description": description,
+                                                     "collection": [parentid]}),
+                                    verify=connector.ssl_verify)
     else:
         if spaceid:
-            result = requests.post(url, headers={"Content-Type": "application/json"},
-                                   data=json.dumps({"name": datasetname, "description": description,
-                                                    "space": [spaceid]}),
-                                   verify=connector.ssl_verify if connector else True)
+            result = connector.post(url, headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"name": datasetname, "description": description,
+                                                     "space": [spaceid]}),
+                                    verify=connector.ssl_verify)
         else:
-            result = requests.post(url, headers={"Content-Type": "application/json"},
-                                   data=json.dumps({"name": datasetname, "description": description}),
-                                   verify=connector.ssl_verify if connector else True)
+            result = connector.post(url, headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"name": datasetname, "description": description}),
+                                    verify=connector.ssl_verify)
 
     result.raise_for_status()
 
@@ -63,7 +62,7 @@ def delete(connector, client, datasetid):
     """
     url = posixpath.join(client.host, "api/datasets/%s?key=%s" % (datasetid, client.key))
 
-    result = requests.delete(url, verify=connector.ssl_verify if connector else True)
+    result = connector.delete(url, verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
@@ -102,9 +101,9 @@ def download(connector, client, datasetid):
     connector.message_process({"type": "dataset", "id": datasetid}, "Downloading dataset.")
 
     # fetch dataset zipfile
-    url = posixpath.join(client.host, 'api/datasets/%s/download?key=%s' % datasetid,client.key)
-    result = requests.get(url, stream=True,
-                          verify=connector.ssl_verify if connector else True)
+    url = posixpath.join(client.host, 'api/datasets/%s/download?key=%s' % (datasetid, client.key))
+    result = connector.get(url, stream=True,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     (filedescriptor, zipfile) = tempfile.mkstemp(suffix=".zip")
@@ -114,6 +113,29 @@ def download(connector, client, datasetid):
 
     return zipfile
 
+def download_and_extract(connector, client, datasetid, output_folder):
+    """Download dataset to be processed from Clowder and extract the zip file while it is being downloaded.
+
+    Raises zipfile.BadZipFile if the zip file can not be extracted while streaming, use download instead.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    client -- ClowderClient containing authentication credentials
+    datasetid -- the file that is currently being processed
+    output_folder -- folder to extract the contents of the dataset into
+    """
+    connector.message_process({"type": "dataset", "id": datasetid}, "Downloading dataset.")
+
+    # fetch dataset zipfile
+    url = posixpath.join(client.host, 'api/datasets/%s/download?key=%s' % (datasetid, client.key))
+    result = connector.get(url, stream=True,
+                           verify=connector.ssl_verify)
+    try:
+        result.raw.decode_content = True
+        return extract_zip_stream(result.raw, output_folder)
+    finally:
+        result.close()
+
 def download_metadata(connector, client, datasetid, extractor=None):
     """Download dataset JSON-LD metadata from Clowder.
 
@@ -127,8 +149,8 @@ def download_metadata(connector, client, datasetid, extractor=None):
     url = posixpath.join(client.host, 'api/datasets/%s/metadata.jsonld?key=%s' % (datasetid, client.key + filterstring))
 
     # fetch data
-    result = requests.get(url, stream=True,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, stream=True,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     return result.json()
@@ -144,7 +166,7 @@ def get_info(connector, client, datasetid):
 
     url = posixpath.join(client.host, "api/datasets/%s?key=%s" % (datasetid, client.key))
 
-    result = requests.get(url, verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
@@ -159,7 +181,7 @@ def get_file_list(connector, client, datasetid):
     """
     url = posixpath.join(client.host, "api/datasets/%s/files?key=%s" % (datasetid, client.key))
 
-    result = requests.get(url, verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
@@ -178,7 +200,7 @@ def remove_metadata(connector, client, datasetid, extractor=None):
     url = posixpath.join(client.host, 'api/datasets/%s/metadata.jsonld?key=%s' % (datasetid, client.key))
 
     # fetch data
-    result = requests.delete(url, stream=True, verify=connector.ssl_verify if connector else True)
+    result = connector.delete(url, stream=True, verify=connector.ssl_verify)
     result.raise_for_status()
 
 def submit_extraction(connector, client, datasetid, extractorname):
@@ -194,10 +216,10 @@ def submit_extraction(connector, client, datasetid, extractorname):
 
     url = posixpath.join(client.host, "api/datasets/%s/extractions?key=%s" % (datasetid, client.key))
 
-    result = requests.post(url,
-                           headers=headers,
-                           data=json.dumps({"extractor": extractorname}),
-                           verify=connector.ssl_verify if connector else True)
+    result = connector.post(url,
+                            headers=headers,
+                            data=json.dumps({"extractor": extractorname}),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
 
     return result.status_code
@@ -240,7 +262,7 @@ def upload_tags(connector, client, datasetid, tags):
     headers = {'Content-Type': 'application/json'}
     url = posixpath.join(client.host, 'api/datasets/%s/tags?key=%s' % (datasetid, client.key))
     result = connector.post(url, headers=headers, data=json.dumps(tags),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
 
 
 def upload_metadata(connector, client, datasetid, metadata):
@@ -256,8 +278,8 @@ def upload_metadata(connector, client, datasetid, metadata):
     connector.message_process({"type": "dataset", "id": datasetid}, "Uploading dataset metadata.")
 
     url = posixpath.join(client.host, 'api/datasets/%s/metadata.jsonld?key=%s' % (datasetid, client.key))
-    result = requests.post(url, headers=headers, data=json.dumps(metadata),
-                           verify=connector.ssl_verify if connector else True)
+    result = connector.post(url, headers=headers, data=json.dumps(metadata),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
 
 def upload_thumbnail(connector, host, key, datasetid, thumbnail):
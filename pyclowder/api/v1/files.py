@@ -9,11 +9,10 @@ import os
 import tempfile
 import posixpath
 import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 
-from pyclowder.client import ClowderClient
 from pyclowder.collections import get_datasets, get_child_collections
 from pyclowder.datasets import get_file_list
+from pyclowder.utils import download_file, upload_file
 
 # Some sources of urllib3 support warning suppression, but not all
 try:
@@ -66,14 +65,13 @@ def download(connector, client, fileid, intermediatefileid=None, ext=""):
         intermediatefileid = fileid
 
     url = posixpath.join(client.host, 'api/files/%s?key=%s' % (intermediatefileid, client.key))
-    result = connector.get(url, stream=True, verify=connector.ssl_verify if connector else True)
 
     (inputfile, inputfilename) = tempfile.mkstemp(suffix=ext)
+    os.close(inputfile)
 
     try:
-        with os.fdopen(inputfile, "wb") as outputfile:
-            for chunk in result.iter_content(chunk_size=10 * 1024):
-                outputfile.write(chunk)
+        download_file(connector, url, inputfilename, segments=connector.download_segments,
+                      chunk_size=connector.download_chunk_size, max_retries=connector.http_max_retries)
         return inputfilename
     except Exception:
         os.remove(inputfilename)
@@ -92,22 +90,19 @@ def download_info(connector, client, fileid):
     url = posixpath.join(client.host, 'api/files/%s/metadata?key=%s' % (fileid, client.key))
 
     # fetch data
-    result = connector.get(url, stream=True, verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, stream=True, verify=connector.ssl_verify)
 
     return result
 
-def download_summary(connector, host, key, fileid):
+def download_summary(connector, client, fileid):
     """Download file summary  from Clowder. It's the same as download_info. We have different names for the
     same functionality for v2. To be consistent, we are keeping this method in v1,
     Keyword arguments:
     connector -- connector information, used to get missing parameters and send status updates
-    host -- the clowder host, including http and port, should end with a /
-    key -- the secret key to login to clowder
+    client -- ClowderClient containing authentication credentials
     fileid -- the file to fetch metadata of
     """
-    client = ClowderClient(host=host, key=key)
-    result = download_info(connector, client, fileid)
-    return result.json()
+    return download_info(connector, client, fileid)
 
 
 def download_metadata(connector, client, fileid, extractor=None):
@@ -124,7 +119,7 @@ def download_metadata(connector, client, fileid, extractor=None):
     url = posixpath.join(client.host, 'api/files/%s/metadata.jsonld?key=%s%s' % (fileid, client.key, filterstring))
 
     # fetch data
-    result = connector.get(url, stream=True, verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, stream=True, verify=connector.ssl_verify)
 
     return result
 
@@ -139,7 +134,7 @@ def delete(connector, client, fileid):
     """
     url = posixpath.join(client.host, "api/files/%s?key=%s" % (fileid, client.key))
 
-    result = requests.delete(url, verify=connector.ssl_verify if connector else True)
+    result = connector.delete(url, verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
@@ -160,7 +155,7 @@ def submit_extraction(connector, client, fileid, extractorname):
     result = connector.post(url,
                             headers={'Content-Type': 'application/json'},
                             data=json.dumps({"extractor": extractorname}),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
 
     return result
 
@@ -231,7 +226,7 @@ def upload_metadata(connector, client, fileid, metadata):
     headers = {'Content-Type': 'application/json'}
     url = posixpath.join(client.host, 'api/files/%s/metadata.jsonld?key=%s' % (fileid, client.key))
     result = connector.post(url, headers=headers, data=json.dumps(metadata),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
 
 
 # pylint: disable=too-many-arguments
@@ -256,13 +251,8 @@ def upload_preview(connector, client, fileid, previewfile, previewmetadata=None,
 
     # upload preview
     url = posixpath.join(client.host, 'api/previews?key=%s' % client.key)
-    with open(previewfile, 'rb') as filebytes:
-        # If a custom preview file MIME type is provided, use it to generate the preview file object.
-        if preview_mimetype is not None:
-            result = connector.post(url, files={"File": (os.path.basename(previewfile), filebytes, preview_mimetype)},
-                                    verify=connector.ssl_verify if connector else True)
-        else:
-            result = connector.post(url, files={"File": filebytes}, verify=connector.ssl_verify if connector else True)
+    # If a custom preview file MIME type is provided, use it to generate the preview file object.
+    result = upload_file(connector, url, previewfile, field="File", mimetype=preview_mimetype)
 
     previewid = result.json()['id']
     logger.debug("preview id = [%s]", previewid)
@@ -271,13 +261,13 @@ def upload_preview(connector, client, fileid, previewfile, previewmetadata=None,
     if fileid and not (previewmetadata and 'section_id' in previewmetadata and previewmetadata['section_id']):
         url = posixpath.join(client.host, 'api/files/%s/previews/%s?key=%s' % (fileid, previewid, client.key))
         result = connector.post(url, headers=headers, data=json.dumps({}),
-                                verify=connector.ssl_verify if connector else True)
+                                verify=connector.ssl_verify)
 
     # associate metadata with preview
     if previewmetadata is not None:
         url = posixpath.join(client.host, 'api/previews/%s/metadata?key=%s' % (previewid, client.key))
         result = connector.post(url, headers=headers, data=json.dumps(previewmetadata),
-                                verify=connector.ssl_verify if connector else True)
+                                verify=connector.ssl_verify)
 
     return previewid
 
@@ -297,7 +287,7 @@ def upload_tags(connector, client, fileid, tags):
     headers = {'Content-Type': 'application/json'}
     url = posixpath.join(client.host, 'api/files/%s/tags?key=%s' % (fileid, client.key))
     result = connector.post(url, headers=headers, data=json.dumps(tags),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
 
 
 def upload_thumbnail(connector, client, fileid, thumbnail):
@@ -314,8 +304,7 @@ def upload_thumbnail(connector, client, fileid, thumbnail):
     url = posixpath.join(client.host, 'api/fileThumbnail?key=%s' % client.key)
 
     # upload preview
-    with open(thumbnail, 'rb') as inputfile:
-        result = connector.post(url, files={"File": inputfile}, verify=connector.ssl_verify if connector else True)
+    result = upload_file(connector, url, thumbnail, field="File")
     thumbnailid = result.json()['id']
     logger.debug("thumbnail id = [%s]", thumbnailid)
 
@@ -323,7 +312,7 @@ def upload_thumbnail(connector, client, fileid, thumbnail):
     if fileid:
         headers = {'Content-Type': 'application/json'}
         url = posixpath.join(client.host, 'api/files/%s/thumbnails/%s?key=%s' % (fileid, thumbnailid, client.key))
-        connector.post(url, headers=headers, data=json.dumps({}), verify=connector.ssl_verify if connector else True)
+        connector.post(url, headers=headers, data=json.dumps({}), verify=connector.ssl_verify)
 
     return thumbnailid
 
@@ -355,12 +344,7 @@ def upload_to_dataset(connector, client, datasetid, filepath, check_duplicate=Fa
     url = posixpath.join(client.host, 'api/uploadToDataset/%s?key=%s' % (datasetid, client.key))
 
     if os.path.exists(filepath):
-        filename = os.path.basename(filepath)
-        m = MultipartEncoder(
-            fields={'file': (filename, open(filepath, 'rb'))}
-        )
-        result = connector.post(url, data=m, headers={'Content-Type': m.content_type},
-                                verify=connector.ssl_verify if connector else True)
+        result = upload_file(connector, url, filepath)
 
         uploadedfileid = result.json()['id']
         logger.debug("uploaded file id = [%s]", uploadedfileid)
@@ -391,12 +375,7 @@ def _upload_to_dataset_local(connector, client, datasetid, filepath):
                                             source_path)
                 break
 
-        filename = os.path.basename(filepath)
-        m = MultipartEncoder(
-            fields={'file': (filename, open(filepath, 'rb'))}
-        )
-        result = connector.post(url, data=m, headers={'Content-Type': m.content_type},
-                                verify=connector.ssl_verify if connector else True)
+        result = upload_file(connector, url, filepath)
 
         uploadedfileid = result.json()['id']
         logger.debug("uploaded file id = [%s]", uploadedfileid)
@@ -8,10 +8,9 @@ import logging
 import os
 import tempfile
 import posixpath
-import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from pyclowder.collections import get_datasets, get_child_collections, delete as delete_collection
+from pyclowder.utils import extract_zip_stream, upload_file
 
 
 def create_empty(connector, client, datasetname, description, parentid=None, spaceid=None):
@@ -31,9 +30,9 @@ def create_empty(connector, client, datasetname, description, parentid=None, spa
     url = posixpath.join(client.host, 'api/v2/datasets')
     headers = {"Content-Type": "application/json",
                "X-API-KEY": client.key}
-    result = requests.post(url, headers=headers,
-                           data=json.dumps({"name": datasetname, "description": description}),
-                           verify=connector.ssl_verify if connector else True)
+    result = connector.post(url, headers=headers,
+                            data=json.dumps({"name": datasetname, "description": description}),
+                            verify=connector.ssl_verify)
 
     result.raise_for_status()
 
@@ -54,7 +53,7 @@ def delete(connector, client , datasetid):
     headers = {"X-API-KEY": client.key}
     url = posixpath.join(client.host, "api/v2/datasets/%s" % datasetid)
 
-    result = requests.delete(url, headers=headers, verify=connector.ssl_verify if connector else True)
+    result = connector.delete(url, headers=headers, verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
@@ -98,8 +97,8 @@ def download(connector, client, datasetid):
     headers = {"X-API-KEY": client.key}
     # fetch dataset zipfile
     url = posixpath.join(client.host, 'api/v2/datasets/%s/download' % datasetid)
-    result = requests.get(url, stream=True, headers=headers,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, stream=True, headers=headers,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     (filedescriptor, zipfile) = tempfile.mkstemp(suffix=".zip")
@@ -110,6 +109,32 @@ def download(connector, client, datasetid):
     return zipfile
 
 
+def download_and_extract(connector, client, datasetid, output_folder):
+    """Download dataset to be processed from Clowder and extract the zip file while it is being downloaded.
+
+    Raises zipfile.BadZipFile if the zip file can not be extracted while streaming, use download instead.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    client -- ClowderClient containing authentication credentials
+    datasetid -- the file that is currently being processed
+    output_folder -- folder to extract the contents of the dataset into
+    """
+
+    connector.message_process({"type": "dataset", "id": datasetid}, "Downloading dataset.")
+
+    headers = {"X-API-KEY": client.key}
+    # fetch dataset zipfile
+    url = posixpath.join(client.host, 'api/v2/datasets/%s/download' % datasetid)
+    result = connector.get(url, stream=True, headers=headers,
+                           verify=connector.ssl_verify)
+    try:
+        result.raw.decode_content = True
+        return extract_zip_stream(result.raw, output_folder)
+    finally:
+        result.close()
+
+
 def download_metadata(connector, client, datasetid, extractor=None):
     """Download dataset JSON-LD metadata from Clowder.
 
@@ -125,8 +150,8 @@ def download_metadata(connector, client, datasetid, extractor=None):
     url = posixpath.join(client.host, 'api/v2/datasets/%s/metadata' % datasetid)
 
     # fetch data
-    result = requests.get(url, stream=True, headers=headers,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, stream=True, headers=headers,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     return result.json()
@@ -144,8 +169,8 @@ def get_info(connector, client, datasetid):
 
     url = posixpath.join(client.host, "api/v2/datasets/%s" % datasetid)
 
-    result = requests.get(url, headers=headers,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, headers=headers,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
@@ -163,7 +188,7 @@ def get_file_list(connector, client, datasetid):
 
     url = posixpath.join(client.host, "api/v2/datasets/%s/files" % datasetid)
 
-    result = requests.get(url, headers=headers, verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, headers=headers, verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)['data']
@@ -185,8 +210,8 @@ def remove_metadata(connector, client, datasetid, extractor=None):
     url = posixpath.join(client.host, 'api/v2/datasets/%s/metadata' % datasetid)
 
     # fetch data
-    result = requests.delete(url, stream=True, headers=headers,
-                             verify=connector.ssl_verify if connector else True)
+    result = connector.delete(url, stream=True, headers=headers,
+                              verify=connector.ssl_verify)
     result.raise_for_status()
 
 
@@ -204,10 +229,10 @@ def submit_extraction(connector, client, datasetid, extractorname):
 
     url = posixpath.join(client.host, "api/v2/datasets/%s/extractions" % datasetid)
 
-    result = requests.post(url,
-                           headers=headers,
-                           data=json.dumps({"extractor": extractorname}),
-                           verify=connector.ssl_verify if connector else True)
+    result = connector.post(url,
+                            headers=headers,
+                            data=json.dumps({"extractor": extractorname}),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
 
     return result.status_code
@@ -228,8 +253,8 @@ def upload_metadata(connector, client, datasetid, metadata):
 
 
     url = posixpath.join(client.host, 'api/v2/datasets/%s/metadata' % datasetid)
-    result = requests.post(url, headers=headers, data=json.dumps(metadata),
-                           verify=connector.ssl_verify if connector else True)
+    result = connector.post(url, headers=headers, data=json.dumps(metadata),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
 
 def upload_preview(connector, client, datasetid, previewfile, previewmetadata=None, preview_mimetype=None,
@@ -279,7 +304,7 @@ def upload_preview(connector, client, datasetid, previewfile, previewmetadata=No
         }
 
         response = connector.post(visualization_config_url, headers=headers, data=payload,
-                                  verify=connector.ssl_verify if connector else True)
+                                  verify=connector.ssl_verify)
 
         if response.status_code == 200:
             visualization_config_id = response.json()['id']
@@ -293,16 +318,9 @@ def upload_preview(connector, client, datasetid, previewfile, previewmetadata=No
             visualization_url = posixpath.join(client.host, 'api/v2/visualizations?name=%s&description=%s&config=%s' % (
                 visualization_name, visualization_description, visualization_config_id))
 
-            filename = os.path.basename(previewfile)
-            if preview_mimetype is not None:
-                multipart_encoder_object = MultipartEncoder(
-                    fields={'file': (filename, open(previewfile, 'rb'), preview_mimetype)})
-            else:
-                multipart_encoder_object = MultipartEncoder(fields={'file': (filename, open(previewfile, 'rb'))})
-            headers = {'X-API-KEY': client.key,
-                       'Content-Type': multipart_encoder_object.content_type}
-            response = connector.post(visualization_url, data=multipart_encoder_object, headers=headers,
-                                      verify=connector.ssl_verify if connector else True)
+            headers = {'X-API-KEY': client.key}
+            response = upload_file(connector, visualization_url, previewfile, mimetype=preview_mimetype,
+                                   headers=headers)
 
             if response.status_code == 200:
                 preview_id = response.json()['id']
@@ -332,10 +350,8 @@ def upload_thumbnail(connector, client, datasetid, thumbnail):
     url = posixpath.join(client.host, 'api/v2/thumbnails')
 
     if os.path.exists(thumbnail):
-        file_data = {"file": open(thumbnail, 'rb')}
         headers = {"X-API-KEY": client.key}
-        result = connector.post(url, files=file_data, headers=headers,
-                                verify=connector.ssl_verify if connector else True)
+        result = upload_file(connector, url, thumbnail, headers=headers)
 
         thumbnailid = result.json()['id']
         logger.debug("uploaded thumbnail id = [%s]", thumbnailid)
@@ -345,7 +361,7 @@ def upload_thumbnail(connector, client, datasetid, thumbnail):
                    'X-API-KEY': client.key}
         url = posixpath.join(client.host, 'api/v2/datasets/%s/thumbnail/%s' % (datasetid, thumbnailid))
         result = connector.patch(url, headers=headers,
-                                 verify=connector.ssl_verify if connector else True)
+                                 verify=connector.ssl_verify)
         return result.json()["thumbnail_id"]
     else:
         logger.error("unable to upload thumbnail %s to dataset %s", thumbnail, datasetid)
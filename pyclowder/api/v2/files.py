@@ -9,9 +9,9 @@ import os
 import tempfile
 import posixpath
 import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from pyclowder.datasets import get_file_list
+from pyclowder.utils import download_file, upload_file
 
 # Some sources of urllib3 support warning suppression, but not all
 try:
@@ -64,14 +64,13 @@ def download(connector, client, fileid, intermediatefileid=None, ext=""):
 
     url = posixpath.join(client.host, 'api/v2/files/%s' % intermediatefileid)
     headers = {"X-API-KEY": client.key}
-    result = connector.get(url, stream=True, verify=connector.ssl_verify if connector else True, headers=headers)
 
     (inputfile, inputfilename) = tempfile.mkstemp(suffix=ext)
+    os.close(inputfile)
 
     try:
-        with os.fdopen(inputfile, "wb") as outputfile:
-            for chunk in result.iter_content(chunk_size=10 * 1024):
-                outputfile.write(chunk)
+        download_file(connector, url, inputfilename, headers=headers, segments=connector.download_segments,
+                      chunk_size=connector.download_chunk_size, max_retries=connector.http_max_retries)
         return inputfilename
     except Exception:
         os.remove(inputfilename)
@@ -90,7 +89,7 @@ def download_info(connector, client, fileid):
     url = posixpath.join(client.host, 'api/v2/files/%s/metadata' % fileid)
     headers = {"X-API-KEY": client.key}
     # fetch data
-    result = connector.get(url, stream=True, verify=connector.ssl_verify if connector else True, headers=headers)
+    result = connector.get(url, stream=True, verify=connector.ssl_verify, headers=headers)
 
     return result
 
@@ -107,7 +106,7 @@ def download_summary(connector, client, fileid):
     url = posixpath.join(client.host, 'api/v2/files/%s/summary' % fileid)
     headers = {"X-API-KEY": client.key}
     # fetch data
-    result = connector.get(url, stream=True, verify=connector.ssl_verify if connector else True, headers=headers)
+    result = connector.get(url, stream=True, verify=connector.ssl_verify, headers=headers)
 
     return result
 
@@ -127,7 +126,7 @@ def download_metadata(connector, client, fileid, extractor=None):
     headers = {"X-API-KEY": client.key}
 
     # fetch data
-    result = connector.get(url, stream=True, verify=connector.ssl_verify if connector else True, headers=headers)
+    result = connector.get(url, stream=True, verify=connector.ssl_verify, headers=headers)
 
     return result
 
@@ -143,7 +142,7 @@ def delete(connector, client , fileid):
     headers = {"X-API-KEY": client.key}
     url = posixpath.join(client.host, 'api/v2/files/%s' % fileid)
 
-    result = requests.delete(url, headers=headers, verify=connector.ssl_verify if connector else True)
+    result = connector.delete(url, headers=headers, verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
@@ -162,7 +161,7 @@ def submit_extraction(connector, client, fileid, extractorname):
     result = connector.post(url,
                             headers={'Content-Type': 'application/json', "X-API-KEY": client.key},
                             data=json.dumps({"extractor": extractorname}),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
 
     return result
 
@@ -182,7 +181,7 @@ def upload_metadata(connector, client, fileid, metadata):
                'X-API-KEY': client.key}
     url = posixpath.join(client.host, 'api/v2/files/%s/metadata' % fileid)
     result = connector.post(url, headers=headers, data=json.dumps(metadata),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
 
 
 # pylint: disable=too-many-arguments
@@ -233,7 +232,7 @@ def upload_preview(connector, client, fileid, previewfile, previewmetadata=None,
         }
 
         response = connector.post(visualization_config_url, headers=headers, data=payload,
-                                  verify=connector.ssl_verify if connector else True)
+                                  verify=connector.ssl_verify)
 
         if response.status_code == 200:
             visualization_config_id = response.json()['id']
@@ -248,16 +247,9 @@ def upload_preview(connector, client, fileid, previewfile, previewmetadata=None,
                                                'api/v2/visualizations?name=%s&description=%s&config=%s' % (
                                                    visualization_name, visualization_description, visualization_config_id))
 
-            filename = os.path.basename(previewfile)
-            if preview_mimetype is not None:
-                multipart_encoder_object = MultipartEncoder(
-                    fields={'file': (filename, open(previewfile, 'rb'), preview_mimetype)})
-            else:
-                multipart_encoder_object = MultipartEncoder(fields={'file': (filename, open(previewfile, 'rb'))})
-            headers = {'X-API-KEY': client.key,
-                       'Content-Type': multipart_encoder_object.content_type}
-            response = connector.post(visualization_url, data=multipart_encoder_object, headers=headers,
-                                      verify=connector.ssl_verify if connector else True)
+            headers = {'X-API-KEY': client.key}
+            response = upload_file(connector, visualization_url, previewfile, mimetype=preview_mimetype,
+                                   headers=headers)
 
             if response.status_code == 200:
                 preview_id = response.json()['id']
@@ -286,7 +278,7 @@ def upload_tags(connector, client, fileid, tags):
     headers = {'Content-Type': 'application/json'}
     url = posixpath.join(client.host, 'api/files/%s/tags?key=%s' % (fileid, client.key))
     result = connector.post(url, headers=headers, data=json.dumps(tags),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
 
 
 def upload_thumbnail(connector, client, fileid, thumbnail):
@@ -307,10 +299,8 @@ def upload_thumbnail(connector, client, fileid, thumbnail):
     url = posixpath.join(client.host, 'api/v2/thumbnails')
 
     if os.path.exists(thumbnail):
-        file_data = {"file": open(thumbnail, 'rb')}
         headers = {"X-API-KEY": client.key}
-        result = connector.post(url, files=file_data, headers=headers,
-                                verify=connector.ssl_verify if connector else True)
+        result = upload_file(connector, url, thumbnail, headers=headers)
 
         thumbnailid = result.json()['id']
         logger.debug("uploaded thumbnail id = [%s]", thumbnailid)
@@ -318,7 +308,7 @@ def upload_thumbnail(connector, client, fileid, thumbnail):
                    'X-API-KEY': client.key}
         url = posixpath.join(client.host, 'api/v2/files/%s/thumbnail/%s' % (fileid, thumbnailid))
         result = connector.patch(url, headers=headers,
-                                 verify=connector.ssl_verify if connector else True)
+                                 verify=connector.ssl_verify)
         return result.json()["thumbnail_id"]
     else:
         logger.error("unable to upload thumbnail %s to file %s", thumbnail, fileid)
@@ -354,14 +344,8 @@ def upload_to_dataset(connector, client, datasetid, filepath, check_duplicate=Fa
         url = '%s?folder_id=%s' % (url, folder_id)
 
     if os.path.exists(filepath):
-        filename = os.path.basename(filepath)
-        # m = MultipartEncoder(
-        #     fields={'File': (filename, open(filepath, 'rb'))}
-        # )
-        file_data = {"file": open(filepath, 'rb')}
         headers = {"X-API-KEY": client.key}
-        result = connector.post(url, files=file_data, headers=headers,
-                                verify=connector.ssl_verify if connector else True)
+        result = upload_file(connector, url, filepath, headers=headers)
 
         uploadedfileid = result.json()['id']
         logger.debug("uploaded file id = [%s]", uploadedfileid)
@@ -391,14 +375,8 @@ def _upload_to_dataset_local(connector, client, datasetid, filepath):
                                             source_path)
                 break
 
-        filename = os.path.basename(filepath)
-        m = MultipartEncoder(
-            fields={'file': (filename, open(filepath, 'rb'))}
-        )
-        headers = {"X-API-KEY": client.key,
-                   'Content-Type': m.content_type}
-        result = connector.post(url, data=m, headers=headers,
-                                verify=connector.ssl_verify if connector else True)
+        headers = {"X-API-KEY": client.key}
+        result = upload_file(connector, url, filepath, headers=headers)
 
         uploadedfileid = result.json()['id']
         logger.debug("uploaded file id = [%s]", uploadedfileid)
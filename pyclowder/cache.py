@@ -0,0 +1,172 @@
+"""Download Cache
+
+This module contains a cache for files downloaded from clowder. Files are stored
+on disk by their id, together with the size and checksum that clowder reported
+for the file, so a changed file is downloaded again. The cache is limited to a
+maximum number of bytes, the least recently used files are removed first. The
+cache folder can be shared by multiple extractors on the same host, file locks
+are used to make sure only one of them downloads a file.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class DownloadCache(object):
+    """On disk cache of downloaded files, shared between processes on the same host."""
+
+    # fields from the file information returned by clowder used to check if the cached file is still valid
+    signature_fields = ['size', 'bytes', 'version_id', 'version_num', 'sha512', 'sha256', 'md5', 'checksum']
+
+    def __init__(self, folder, max_size):
+        """
+        Create a cache in folder.
+
+        :param string folder: folder to store the cached files, created if it does not exist
+        :param int max_size: maximum number of bytes of files in the cache
+        """
+        self.folder = folder
+        self.max_size = int(max_size)
+        self.tmp_folder = os.path.join(folder, 'tmp')
+        os.makedirs(self.tmp_folder, exist_ok=True)
+
+    @classmethod
+    def signature(cls, file_info):
+        """Return the fields of the file information that identify the contents of the file."""
+        if not isinstance(file_info, dict):
+            return {}
+        return {k: file_info[k] for k in cls.signature_fields if k in file_info}
+
+    def fetch(self, fileid, signature, download, ext=""):
+        """Return a temporary copy of the file, downloading it if it is not in the cache.
+
+        The returned file is owned by the caller and should be removed once it is no longer needed. The file shares
+        the disk space with the cached copy (hard link) when possible, so it should not be modified.
+
+        :param string fileid: id of the file in clowder
+        :param dict signature: result of signature() for the current file information from clowder, the file is
+            always downloaded and not cached if it is empty
+        :param download: function without arguments that downloads the file and returns the path of the download
+        :param string ext: extension of the returned file
+        """
+        logger = logging.getLogger(__name__)
+        entry = os.path.join(self.folder, fileid)
+
+        if not signature:
+            # nothing to check if the cached file is still the same file, always download it
+            logger.debug("[%s] : no signature, not using download cache", fileid)
+            return download()
+
+        with self._lock(fileid):
+            if self._is_valid(entry, signature):
+                logger.debug("[%s] : found file in download cache", fileid)
+                os.utime(entry, None)
+                return self._checkout(entry, ext)
+
+            downloaded = download()
+            size = os.path.getsize(downloaded)
+            if size > self.max_size:
+                if not os.path.exists(entry):
+                    self._remove_lock(fileid)
+                return downloaded
+
+            # move the downloaded file into the cache, readers never see a partially written file
+            tmp_entry = os.path.join(self.tmp_folder, uuid.uuid4().hex)
+            shutil.move(downloaded, tmp_entry)
+            with open(entry + '.json', 'w') as signature_file:
+                json.dump(signature, signature_file)
+            os.replace(tmp_entry, entry)
+            result = self._checkout(entry, ext)
+
+        self._evict()
+        return result
+
+    def _is_valid(self, entry, signature):
+        if not os.path.isfile(entry) or not os.path.isfile(entry + '.json'):
+            return False
+        try:
+            with open(entry + '.json') as signature_file:
+                if json.load(signature_file) != signature:
+                    return False
+        except ValueError:
+            return False
+        size = signature.get('size', signature.get('bytes'))
+        return size is None or str(os.path.getsize(entry)) == str(size)
+
+    def _checkout(self, entry, ext):
+        (fd, filename) = tempfile.mkstemp(suffix=ext, dir=self.tmp_folder)
+        os.close(fd)
+        try:
+            os.remove(filename)
+            os.link(entry, filename)
+        except OSError:
+            shutil.copyfile(entry, filename)
+        return filename
+
+    def _evict(self):
+        """Remove the least recently used files until the cache is below max_size."""
+        logger = logging.getLogger(__name__)
+        with self._lock('.cache'):
+            entries = []
+            for name in os.listdir(self.folder):
+                path = os.path.join(self.folder, name)
+                if '.' in name or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for (_, size, _) in entries)
+            for (_, size, name) in sorted(entries):
+                if total <= self.max_size:
+                    break
+                with self._lock(name, blocking=False) as locked:
+                    if not locked:
+                        continue
+                    logger.debug("[%s] : removing file from download cache", name)
+                    for path in [name, name + '.json']:
+                        with contextlib.suppress(OSError):
+                            os.remove(os.path.join(self.folder, path))
+                    self._remove_lock(name)
+                    total -= size
+
+    @contextlib.contextmanager
+    def _lock(self, name, blocking=True):
+        """Lock name for all processes using the cache, yields False if not blocking and the lock is taken."""
+        if fcntl is None:
+            yield True
+            return
+        path = os.path.join(self.folder, name + '.lock')
+        while True:
+            lockfile = open(path, 'a')
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lockfile.close()
+                yield False
+                return
+            # the lock file is removed by _remove_lock while it is locked, lock the new file if it was replaced
+            try:
+                if os.stat(path).st_ino == os.fstat(lockfile.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lockfile.close()
+        try:
+            yield True
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+
+    def _remove_lock(self, name):
+        """Remove the lock file of name, only call this while holding the lock."""
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(self.folder, name + '.lock'))
@@ -16,6 +16,10 @@ class ClowderClient(object):
     """
     Client to Clowder API to store connection information.
 
+    The client keeps the requests session, the url of the api and the authentication headers, so it can be reused
+    for all calls to the same host with the same key. Connectors keep one client per host and key, see
+    `Connector.get_client`.
+
     The `path` parameter used by many of the methods in this class call a specific path relative to the host + "api".
     For example passing in "/version" for host "https://seagrant-dev.ncsa.illinois.edu/clowder/" will call
     "https://seagrant-dev.ncsa.illinois.edu/clowder/api/version". Make sure to include the slash at the beginning of
@@ -33,6 +37,8 @@ class ClowderClient(object):
         :param string key: The API key used to write to the API. Set this or `username`/`password` below.
         :param string username: HTTP Basic Authentication username. Set this or `key`.
         :param string password: HTTP Basic Authentication password. Set this or `key`.
+        :param requests.Session session: Optional session used for all calls, allows reuse of connections.
+        :param bool ssl_verify: Optional, set to False to skip the verification of the SSL certificate.
          """
 
         # clone operator
@@ -42,17 +48,81 @@ class ClowderClient(object):
             self.key = kwargs.get('key', client.key)
             self.username = kwargs.get('username', client.username)
             self.password = kwargs.get('password', client.password)
+            self.session = kwargs.get('session', client.session)
+            self.ssl_verify = kwargs.get('ssl_verify', client.ssl_verify)
         else:
             self.host = kwargs.get('host', 'http://localhost:9000')
             self.key = kwargs.get('key', None)
             self.username = kwargs.get('username', None)
             self.password = kwargs.get('password', None)
+            self.session = kwargs.get('session', None)
+            self.ssl_verify = kwargs.get('ssl_verify', True)
+        if self.session is None:
+            self.session = requests.Session()
 
         # make sure the host does not end with a slash
         self.host = self.host.rstrip('/')
+        self.api_url = self.host + '/api'
+
+        # authentication used for all calls
+        self.headers = {'X-API-KEY': self.key} if self.key else {}
+        self.auth = (self.username, self.password) if self.username and self.password else None
 
         # warning if both key and username/password present
         if not self.key and not self.username:
             self.logger.warning("No key or username/password present.")
         if self.key and self.username and self.password:
             self.logger.info("Both key and username/password present, will use username/password for calls.")
+
+    def get(self, path, params=None, headers=None):
+        """
+        Call Clowder API using GET and return the decoded JSON result.
+
+        :param string path: Path of the endpoint relative to the api url, e.g. "/version"
+        :param dict params: Optional query parameters
+        :param dict headers: Optional headers, added to the authentication headers
+        """
+        return self._call('GET', path, params=params, headers=headers)
+
+    def post(self, path, content, params=None, headers=None):
+        """
+        Call Clowder API using POST with the content encoded as JSON and return the decoded JSON result.
+
+        :param string path: Path of the endpoint relative to the api url, e.g. "/collections"
+        :param content: The content to send, encoded as JSON
+        :param dict params: Optional query parameters
+        :param dict headers: Optional headers, added to the authentication headers
+        """
+        return self._call('POST', path, params=params, headers=headers, json=content)
+
+    def put(self, path, content, params=None, headers=None):
+        """
+        Call Clowder API using PUT with the content encoded as JSON and return the decoded JSON result.
+
+        :param string path: Path of the endpoint relative to the api url
+        :param content: The content to send, encoded as JSON
+        :param dict params: Optional query parameters
+        :param dict headers: Optional headers, added to the authentication headers
+        """
+        return self._call('PUT', path, params=params, headers=headers, json=content)
+
+    def delete(self, path, params=None, headers=None):
+        """
+        Call Clowder API using DELETE and return the decoded JSON result.
+
+        :param string path: Path of the endpoint relative to the api url
+        :param dict params: Optional query parameters
+        :param dict headers: Optional headers, added to the authentication headers
+        """
+        return self._call('DELETE', path, params=params, headers=headers)
+
+    def _call(self, method, path, headers=None, **kwargs):
+        all_headers = dict(self.headers)
+        if headers:
+            all_headers.update(headers)
+        result = self.session.request(method, self.api_url + path, headers=all_headers, auth=self.auth,
+                                      verify=self.ssl_verify, **kwargs)
+        result.raise_for_status()
+        if not result.content:
+            return None
+        return result.json()
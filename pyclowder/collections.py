@@ -5,11 +5,16 @@ This module provides simple wrappers around the clowder Collections API
 
 import json
 import logging
-import requests
 import posixpath
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 from pyclowder.client import ClowderClient
+from pyclowder.utils import upload_file, with_default_connector
 
 
+@with_default_connector
 def create_empty(connector, host, key, collectionname, description, parentid=None, spaceid=None):
     """Create a new collection in Clowder.
 
@@ -28,28 +33,28 @@ def create_empty(connector, host, key, collectionname, description, parentid=Non
     if parentid:
         if spaceid:
             url = posixpath.join(host, 'api/collections/newCollectionWithParent?key=%s' % key)
-            result = requests.post(url, headers={"Content-Type": "application/json"},
-                                   data=json.dumps({"name": collectionname, "description": description,
-                                                    "parentId": [parentid], "space": spaceid}),
-                                   verify=connector.ssl_verify if connector else True)
+            result = connector.post(url, headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"name": collectionname, "description": description,
+                                                     "parentId": [parentid], "space": spaceid}),
+                                    verify=connector.ssl_verify)
         else:
             url = posixpath.join(host, 'api/collections/newCollectionWithParent?key=%s' % key)
-            result = requests.post(url, headers={"Content-Type": "application/json"},
-                                   data=json.dumps({"name": collectionname, "description": description,
-                                                    "parentId": [parentid]}),
-                                   verify=connector.ssl_verify if connector else True)
+            result = connector.post(url, headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"name": collectionname, "description": description,
+                                                     "parentId": [parentid]}),
+                                    verify=connector.ssl_verify)
     else:
         if spaceid:
             url = posixpath.join(host, 'api/collections?key=%s' % key)
-            result = requests.post(url, headers={"Content-Type": "application/json"},
-                                   data=json.dumps({"name": collectionname, "description": description,
-                                                    "space": spaceid}),
-                                   verify=connector.ssl_verify if connector else True)
+            result = connector.post(url, headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"name": collectionname, "description": description,
+                                                     "space": spaceid}),
+                                    verify=connector.ssl_verify)
         else:
             url = posixpath.join(host, 'api/collections?key=%s' % key)
-            result = requests.post(url, headers={"Content-Type": "application/json"},
-                                   data=json.dumps({"name": collectionname, "description": description}),
-                                   verify=connector.ssl_verify if connector else True)
+            result = connector.post(url, headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"name": collectionname, "description": description}),
+                                    verify=connector.ssl_verify)
     result.raise_for_status()
 
     collectionid = result.json()['id']
@@ -58,15 +63,17 @@ def create_empty(connector, host, key, collectionname, description, parentid=Non
     return collectionid
 
 
+@with_default_connector
 def delete(connector, host, key, collectionid):
     url = posixpath.join(host, "api/collections/%s?key=%s" % (collectionid, key))
 
-    result = requests.delete(url, verify=connector.ssl_verify if connector else True)
+    result = connector.delete(url, verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
 
 
+@with_default_connector
 def get_child_collections(connector, host, key, collectionid):
     """Get list of child collections in collection by UUID.
 
@@ -79,13 +86,14 @@ def get_child_collections(connector, host, key, collectionid):
 
     url = posixpath.join(host, "api/collections/%s/getChildCollections?key=%s" % (collectionid, key))
 
-    result = requests.get(url,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
 
 
+@with_default_connector
 def get_datasets(connector, host, key, collectionid):
     """Get list of datasets in collection by UUID.
 
@@ -98,14 +106,131 @@ def get_datasets(connector, host, key, collectionid):
 
     url = posixpath.join(host, "api/collections/%s/datasets?key=%s" % (collectionid, key))
 
-    result = requests.get(url,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     return json.loads(result.text)
 
 
+def for_each_dataset(connector, host, key, collectionid, action, recursive=True, dataset_filter=None, max_workers=4,
+                     progress=None, progress_interval=10, rate_limit=None, on_collection=None):
+    """Call action for all datasets in a collection and its child collections.
+
+    The collections are walked breadth-first, the datasets and child collections of multiple collections are
+    requested concurrently, and action is called for multiple datasets concurrently, using max_workers threads.
+    Collections and datasets that can be reached using multiple paths are only visited once. Failures are logged and
+    returned in the errors of the result, they do not stop the traversal.
+
+    Returns a dictionary with the number of collections and datasets found, the number of datasets processed and
+    failed, the seconds it took, the datasets processed per second, and errors, mapping the id of each collection or
+    dataset that failed to the exception.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    collectionid -- the collection to walk
+    action -- function called with the dataset information for each dataset
+    recursive -- whether to also walk child collections (defaults to True)
+    dataset_filter -- (optional) function called with the dataset information, only datasets for which it returns
+                      True are processed
+    max_workers -- number of concurrent requests
+    progress -- (optional) function called with the statistics every progress_interval seconds and at the end
+    progress_interval -- seconds between progress reports
+    rate_limit -- (optional) maximum number of times per second action is called
+    on_collection -- (optional) function called with the id of each collection found, in breadth-first order
+    """
+    logger = logging.getLogger(__name__)
+
+    stats = {'collections': 1, 'datasets': 0, 'processed': 0, 'failed': 0, 'seconds': 0.0, 'rate': 0.0,
+             'errors': dict()}
+    seen_collections = {collectionid}
+    seen_datasets = set()
+    started = time.time()
+    last_report = started
+    if rate_limit:
+        action = _rate_limited(action, rate_limit)
+
+    def report():
+        stats['seconds'] = time.time() - started
+        stats['rate'] = stats['processed'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        logger.info("collection %s : %d collections, %d of %d datasets processed, %d failed, %.1f datasets/s",
+                    collectionid, stats['collections'], stats['processed'], stats['datasets'], stats['failed'],
+                    stats['rate'])
+        if progress:
+            progress(stats)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = dict()
+
+        def visit(cid):
+            futures[executor.submit(get_datasets, connector, host, key, cid)] = ('datasets', cid)
+            if recursive:
+                futures[executor.submit(get_child_collections, connector, host, key, cid)] = ('collections', cid)
+
+        if on_collection:
+            on_collection(collectionid)
+        visit(collectionid)
+        while futures:
+            (done, _) = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                (kind, itemid) = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    logger.warning("failed to process %s %s : %s", kind, itemid, exc)
+                    stats['errors'][itemid] = exc
+                    if kind == 'action':
+                        stats['failed'] += 1
+                    continue
+
+                if kind == 'collections':
+                    for coll in result:
+                        if coll['id'] not in seen_collections:
+                            seen_collections.add(coll['id'])
+                            stats['collections'] += 1
+                            if on_collection:
+                                on_collection(coll['id'])
+                            visit(coll['id'])
+                elif kind == 'datasets':
+                    for ds in result:
+                        if ds['id'] in seen_datasets:
+                            continue
+                        seen_datasets.add(ds['id'])
+                        if dataset_filter and not dataset_filter(ds):
+                            continue
+                        stats['datasets'] += 1
+                        futures[executor.submit(action, ds)] = ('action', ds['id'])
+                else:
+                    stats['processed'] += 1
+
+            if time.time() - last_report >= progress_interval:
+                last_report = time.time()
+                report()
+
+    report()
+    return stats
+
+
+def _rate_limited(func, rate):
+    """Return a wrapper of func that is called at most rate times per second, by all threads combined."""
+    lock = threading.Lock()
+    next_call = [time.time()]
+
+    def wrapper(*args, **kwargs):
+        with lock:
+            now = time.time()
+            delay = next_call[0] - now
+            next_call[0] = max(now, next_call[0]) + 1.0 / rate
+        if delay > 0:
+            time.sleep(delay)
+        return func(*args, **kwargs)
+    return wrapper
+
+
 # pylint: disable=too-many-arguments
+@with_default_connector
 def upload_preview(connector, host, key, collectionid, previewfile, previewmetadata):
     """Upload preview to Clowder.
 
@@ -127,25 +252,23 @@ def upload_preview(connector, host, key, collectionid, previewfile, previewmetad
 
     # upload preview
     url = posixpath.join(host, 'api/previews?key=%s' % key)
-    with open(previewfile, 'rb') as filebytes:
-        result = requests.post(url, files={"File": filebytes},
-                               verify=connector.ssl_verify if connector else True)
-        result.raise_for_status()
+    result = upload_file(connector, url, previewfile, field="File")
+    result.raise_for_status()
     previewid = result.json()['id']
     logger.debug("preview id = [%s]", previewid)
 
     # associate uploaded preview with original collection
     if collectionid and not (previewmetadata and 'section_id' in previewmetadata and previewmetadata['section_id']):
         url = posixpath.join(host, 'api/collections/%s/previews/%s?key=%s' % (collectionid, previewid, key))
-        result = requests.post(url, headers=headers, data=json.dumps({}),
-                               verify=connector.ssl_verify if connector else True)
+        result = connector.post(url, headers=headers, data=json.dumps({}),
+                                verify=connector.ssl_verify)
         result.raise_for_status()
 
     # associate metadata with preview
     if previewmetadata is not None:
         url = posixpath.join(host, 'api/previews/%s/metadata?key=%s' % (previewid, key))
-        result = requests.post(url, headers=headers, data=json.dumps(previewmetadata),
-                               verify=connector.ssl_verify if connector else True)
+        result = connector.post(url, headers=headers, data=json.dumps(previewmetadata),
+                                verify=connector.ssl_verify)
     result.raise_for_status()
 
     return previewid
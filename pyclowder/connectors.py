@@ -17,6 +17,8 @@ parameters:
 
 * rabbitmq_uri [REQUIRED] : the uri of the RabbitMQ server
 * rabbitmq_key [OPTIONAL] : the key that binds the queue to the exchange
+* workers [OPTIONAL] : number of messages that are processed at the same time
+* processes [OPTIONAL] : process the messages in a pool of this many processes
 
 HPCConnector
 
@@ -30,23 +32,39 @@ back to clowder. This connector takes a single argument (which can be list):
                           pickled messsages to be processed.
 """
 
+import asyncio
+import collections
+import copy
 import errno
 import json
 import logging
+import multiprocessing
 import os
 import pickle
+import random
+import shutil
 import subprocess
-import sys
 import time
 import tempfile
 import threading
 import uuid
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from pyclowder.client import ClowderClient
+import pyclowder.aio
 import pyclowder.datasets
 import pyclowder.files
+import pyclowder.metrics
+import pyclowder.profiler
+import pyclowder.tracing
 import pyclowder.utils
 
 import smtplib
@@ -55,6 +73,33 @@ from email.mime.multipart import MIMEMultipart
 from string import Template
 
 
+class _ThreadLocalSession(object):
+    """A requests.Session for each thread, all sharing the connection pools of one HTTPAdapter.
+
+    A requests.Session is not thread-safe (its cookies and settings are changed while a request is made), the pools
+    of urllib3 used by the adapter are, so the handler threads share the keep-alive connections without sharing the
+    session. Attributes are looked up on the session of the calling thread.
+    """
+
+    def __init__(self, adapter, hooks):
+        self.adapter = adapter
+        self.hooks = list(hooks)
+        self.local = threading.local()
+
+    def _session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            session.hooks['response'].extend(self.hooks)
+            self.local.session = session
+        return session
+
+    def __getattr__(self, name):
+        return getattr(self._session(), name)
+
+
 class Connector(object):
     """ Class that will listen for messages.
 
@@ -63,7 +108,9 @@ class Connector(object):
     """
 
     def __init__(self, extractor_name, extractor_info, check_message=None, process_message=None, ssl_verify=True,
-                 mounted_paths=None, clowder_url=None, max_retry=10, extractor_key=None, clowder_email=None):
+                 mounted_paths=None, clowder_url=None, max_retry=10, extractor_key=None, clowder_email=None,
+                 http_pool_size=10, http_max_retries=3, http_backoff_factor=0.5, session=None,
+                 parallel_downloads=4, download_cache=None, download_segments=4, download_chunk_size=1024 * 1024):
         self.extractor_name = extractor_name
         self.extractor_info = extractor_info
         self.check_message = check_message
@@ -79,6 +126,22 @@ class Connector(object):
         if extractor_key:
             self.extractor_info["unique_key"] = extractor_key
         self.max_retry = max_retry
+        self.http_pool_size = int(http_pool_size)
+        self.http_max_retries = int(http_max_retries)
+        self.http_backoff_factor = float(http_backoff_factor)
+        self.parallel_downloads = int(parallel_downloads)
+        self.download_cache = download_cache
+        self.download_segments = int(download_segments)
+        self.download_chunk_size = int(download_chunk_size)
+        if session is None:
+            self.session = self._create_session()
+        else:
+            self.session = session
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self.job_cache = {}
+        self.job_cache_fetching = {}
+        self.job_cache_lock = threading.Lock()
 
         filename = 'notifications.json'
         self.smtp_server = None
@@ -123,6 +186,88 @@ class Connector(object):
                 pass
             server.quit()
 
+    def get_client(self, host, key):
+        """Return the ClowderClient for host and key, the client is created once and uses the session of the connector.
+
+        Keyword arguments:
+        host -- the clowder host, including http and port
+        key -- the secret key to login to clowder
+        """
+        host = host.rstrip('/')
+        with self.clients_lock:
+            client = self.clients.get((host, key))
+            if client is None:
+                client = ClowderClient(host=host, key=key, session=self.session, ssl_verify=self.ssl_verify)
+                self.clients[(host, key)] = client
+            return client
+
+    def job_cached(self, endpoint, client, resource_id, fetch):
+        """Return the result of fetch(), memoized while processing the current message.
+
+        The job cache is cleared at the start and the end of every message, and the entries of a resource are removed
+        when the resource is changed using the files or datasets API. Every caller gets its own copy of the result, so
+        it can be modified. If another thread is already fetching the same result, this waits for that result instead
+        of fetching it again.
+
+        Keyword arguments:
+        endpoint -- name of the call, e.g. "datasets.get_file_list"
+        client -- the ClowderClient used for the call
+        resource_id -- the id of the file or dataset
+        fetch -- function without arguments that returns the result of the call
+        """
+        key = (endpoint, client.host, client.key, resource_id)
+        with self.job_cache_lock:
+            if key in self.job_cache:
+                return copy.deepcopy(self.job_cache[key])
+            future = self.job_cache_fetching.get(key)
+            fetching = future is None
+            if fetching:
+                future = Future()
+                self.job_cache_fetching[key] = future
+        if not fetching:
+            return copy.deepcopy(future.result())
+
+        try:
+            result = fetch()
+        except BaseException as exc:
+            with self.job_cache_lock:
+                if self.job_cache_fetching.get(key) is future:
+                    del self.job_cache_fetching[key]
+            future.set_exception(exc)
+            raise
+        with self.job_cache_lock:
+            # the result is not kept if the resource was changed while it was fetched
+            if self.job_cache_fetching.get(key) is future:
+                del self.job_cache_fetching[key]
+                self.job_cache[key] = result
+        future.set_result(result)
+        return copy.deepcopy(result)
+
+    def invalidate_job_cache(self, resource_id=None):
+        """Remove the cached results of resource_id from the job cache, or all results if resource_id is None."""
+        with self.job_cache_lock:
+            if resource_id is None:
+                self.job_cache.clear()
+                self.job_cache_fetching.clear()
+            else:
+                for key in [key for key in self.job_cache if key[3] == resource_id]:
+                    del self.job_cache[key]
+                for key in [key for key in self.job_cache_fetching if key[3] == resource_id]:
+                    del self.job_cache_fetching[key]
+
+    def _create_session(self):
+        """Create the keep-alive HTTP session used for all calls to clowder.
+
+        The session keeps up to http_pool_size connections per host open, and will retry failed connections as well
+        as idempotent requests that return 502, 503 or 504 with an exponential backoff. Each thread uses its own
+        requests.Session, the connections are shared by all threads.
+        """
+        retries = Retry(total=self.http_max_retries, backoff_factor=self.http_backoff_factor,
+                        status_forcelist=[502, 503, 504], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.http_pool_size, pool_maxsize=self.http_pool_size,
+                              max_retries=retries)
+        return _ThreadLocalSession(adapter, [pyclowder.metrics.observe_response, pyclowder.tracing.observe_response])
+
     def listen(self):
         """Listen for incoming messages.
 
@@ -180,30 +325,7 @@ class Connector(object):
         intermediatefileid = body.get('intermediateId', '')
         datasetid = body.get('datasetId', '')
         filename = body.get('filename', '')
-
-        # determine resource type; defaults to file
-        resource_type = "file"
-        message_type = body['routing_key']
-        if message_type.find(".dataset.") > -1:
-            resource_type = "dataset"
-        elif message_type.find(".file.") > -1:
-            resource_type = "file"
-        elif message_type.find("metadata.added") > -1:
-            resource_type = "metadata"
-        elif message_type == "extractors." + self.extractor_name \
-                or message_type == "extractors." + self.extractor_info['name']:
-            # This was a manually submitted extraction
-            if datasetid == fileid:
-                resource_type = "dataset"
-            else:
-                resource_type = "file"
-        elif message_type.endswith(self.extractor_info['name']) or message_type.endswith(self.extractor_name):
-            # This was migrated from another queue (e.g. error queue) so use extractor default
-            for key, value in self.extractor_info['process'].items():
-                if key == "dataset":
-                    resource_type = "dataset"
-                else:
-                    resource_type = "file"
+        resource_type = self._resource_type(body)
 
         # determine what to download (if needed) and add relevant data to resource
         if resource_type == "dataset":
@@ -268,6 +390,36 @@ class Connector(object):
                 "metadata": body['metadata']
             }
 
+    def _resource_type(self, body):
+        """Return the type of resource of the message, "file", "dataset" or "metadata", see _build_resource."""
+        fileid = body.get('id', '')
+        datasetid = body.get('datasetId', '')
+
+        # determine resource type; defaults to file
+        resource_type = "file"
+        message_type = body['routing_key']
+        if message_type.find(".dataset.") > -1:
+            resource_type = "dataset"
+        elif message_type.find(".file.") > -1:
+            resource_type = "file"
+        elif message_type.find("metadata.added") > -1:
+            resource_type = "metadata"
+        elif message_type == "extractors." + self.extractor_name \
+                or message_type == "extractors." + self.extractor_info['name']:
+            # This was a manually submitted extraction
+            if datasetid == fileid:
+                resource_type = "dataset"
+            else:
+                resource_type = "file"
+        elif message_type.endswith(self.extractor_info['name']) or message_type.endswith(self.extractor_name):
+            # This was migrated from another queue (e.g. error queue) so use extractor default
+            for key, value in self.extractor_info['process'].items():
+                if key == "dataset":
+                    resource_type = "dataset"
+                else:
+                    resource_type = "file"
+        return resource_type
+
     def _check_for_local_file(self, file_metadata):
         """ Try to get pointer to locally accessible copy of file for extractor."""
 
@@ -293,17 +445,55 @@ class Connector(object):
         Returns:
             (tmp directory created, tmp file created)
         """
-        file_md = pyclowder.files.download_metadata(self, host, secret_key, fileid)
+        with pyclowder.tracing.span('download_metadata', fileid=fileid):
+            file_md = pyclowder.files.download_metadata(self, host, secret_key, fileid)
         md_name = os.path.basename(filepath)+"_metadata.json"
 
         md_dir = tempfile.mkdtemp(suffix=fileid)
         (fd, md_file) = tempfile.mkstemp(suffix=md_name, dir=md_dir)
 
-        with os.fdopen(fd, "wb") as tmp_file:
+        with os.fdopen(fd, "w") as tmp_file:
             tmp_file.write(json.dumps(file_md))
 
         return (md_dir, md_file)
 
+    def _download_file(self, host, secret_key, fileid, intermediatefileid, ext, file_info):
+        """Download a file into a temporary file, using the download cache if enabled.
+
+        file_info is the information about the file from clowder (download_info or file list) and is used to check
+        if the cached file is still valid.
+        """
+        def download():
+            return pyclowder.files.download(self, host, secret_key, fileid, intermediatefileid, ext, tracking=False)
+
+        with pyclowder.tracing.span('download', fileid=fileid, cached=bool(self.download_cache)) as download_span:
+            if not self.download_cache:
+                filename = download()
+            else:
+                signature = self.download_cache.signature(file_info)
+                if not signature:
+                    signature = self.download_cache.signature(pyclowder.files.download_summary(self, host, secret_key,
+                                                                                               fileid))
+                filename = self.download_cache.fetch(fileid, signature, download, ext)
+            download_span.set('bytes', os.path.getsize(filename))
+        return filename
+
+    def _download_dataset_file(self, host, secret_key, ds_file):
+        """Download a file of a dataset and its metadata into temporary files.
+
+        Returns:
+            (tmp file created, tmp directory created, tmp metadata file created)
+        """
+        inputfile = self._download_file(host, secret_key, ds_file['id'], ds_file['id'], ds_file['file_ext'],
+                                        ds_file)
+        try:
+            (file_md_dir, file_md_tmp) = self._download_file_metadata(host, secret_key, ds_file['id'],
+                                                                      ds_file['filepath'])
+        except Exception:
+            os.remove(inputfile)
+            raise
+        return (inputfile, file_md_dir, file_md_tmp)
+
     def _prepare_dataset(self, host, secret_key, resource):
         logger = logging.getLogger(__name__)
 
@@ -317,76 +507,133 @@ class Connector(object):
         temp_link_dir = tempfile.mkdtemp()
         tmp_dirs_created.append(temp_link_dir)
 
-        # first check if any files in dataset accessible locally
-        ds_file_list = pyclowder.datasets.get_file_list(self, host, secret_key, resource["id"])
-        for ds_file in ds_file_list:
-            file_path = self._check_for_local_file(ds_file)
-            if not file_path:
-                missing_files.append(ds_file)
-            else:
-                # Create a link to the original file if the "true" name of the file doesn't match what's on disk
-                if not file_path.lower().endswith(ds_file['filename'].lower()):
-                    ln_name = os.path.join(temp_link_dir, ds_file['filename'])
-                    os.symlink(file_path, ln_name)
-                    tmp_files_created.append(ln_name)
-                    file_path = ln_name
-
-                # Also get file metadata in format expected by extrator
-                (file_md_dir, file_md_tmp) = self._download_file_metadata(host, secret_key, ds_file['id'],
-                                                                          ds_file['filepath'])
-                located_files.append(file_path)
-                located_files.append(file_md_tmp)
-                tmp_files_created.append(file_md_tmp)
-                tmp_dirs_created.append(file_md_dir)
-
-        # If only some files found locally, check & download any that were missed
-        if len(located_files) > 0:
-            for ds_file in missing_files:
-                # Download file to temp directory
-                inputfile = pyclowder.files.download(self, host, secret_key, ds_file['id'], ds_file['id'],
-                                                     ds_file['file_ext'], tracking=False)
-                # Also get file metadata in format expected by extractor
-                (file_md_dir, file_md_tmp) = self._download_file_metadata(host, secret_key, ds_file['id'],
-                                                                          ds_file['filepath'])
-                located_files.append(inputfile)
-                located_files.append(file_md_tmp)
-                tmp_files_created.append(inputfile)
-                tmp_files_created.append(file_md_tmp)
-                tmp_dirs_created.append(file_md_dir)
-
-            # Also, get dataset metadata (normally included in dataset .zip download file)
-            ds_md = pyclowder.datasets.download_metadata(self, host, secret_key, resource["id"])
-            md_name = "%s_dataset_metadata.json" % resource["id"]
-            md_dir = tempfile.mkdtemp(suffix=resource["id"])
-            (fd, md_file) = tempfile.mkstemp(suffix=md_name, dir=md_dir)
-            with os.fdopen(fd, "wb") as tmp_file:
-                tmp_file.write(json.dumps(ds_md))
-            located_files.append(md_file)
-            tmp_files_created.append(md_file)
-            tmp_dirs_created.append(md_dir)
-
-            file_paths = located_files
-
-        # If we didn't find any files locally, download dataset .zip as normal
-        else:
+        # files and metadata are fetched in parallel, limited by the number of pooled connections to clowder
+        max_workers = max(1, min(self.parallel_downloads, self.http_pool_size))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # first check if any files in dataset accessible locally
+            ds_file_list = pyclowder.datasets.get_file_list(self, host, secret_key, resource["id"])
+            for ds_file in ds_file_list:
+                file_path = self._check_for_local_file(ds_file)
+                if not file_path:
+                    missing_files.append(ds_file)
+                else:
+                    # Create a link to the original file if the "true" name of the file doesn't match what's on disk
+                    if not file_path.lower().endswith(ds_file['filename'].lower()):
+                        ln_name = os.path.join(temp_link_dir, ds_file['filename'])
+                        os.symlink(file_path, ln_name)
+                        tmp_files_created.append(ln_name)
+                        file_path = ln_name
+
+                    # Also get file metadata in format expected by extrator
+                    future = executor.submit(pyclowder.tracing.wrap(self._download_file_metadata), host, secret_key,
+                                             ds_file['id'], ds_file['filepath'])
+                    located_files.append((file_path, future))
+
+            # If only some files found locally, check & download any that were missed
+            if len(located_files) > 0:
+                downloads = [executor.submit(pyclowder.tracing.wrap(self._download_dataset_file), host, secret_key,
+                                             ds_file)
+                             for ds_file in missing_files]
+
+                # Collect the results in the same order as the dataset file list, any temporary file that was
+                # created is registered before the first error is raised so it can be cleaned up.
+                error = None
+                for (file_path, future) in located_files:
+                    try:
+                        (file_md_dir, file_md_tmp) = future.result()
+                    except Exception as exc:  # pylint: disable=broad-except
+                        error = error or exc
+                        continue
+                    file_paths.append(file_path)
+                    file_paths.append(file_md_tmp)
+                    tmp_files_created.append(file_md_tmp)
+                    tmp_dirs_created.append(file_md_dir)
+                for future in downloads:
+                    try:
+                        (inputfile, file_md_dir, file_md_tmp) = future.result()
+                    except Exception as exc:  # pylint: disable=broad-except
+                        error = error or exc
+                        continue
+                    file_paths.append(inputfile)
+                    file_paths.append(file_md_tmp)
+                    tmp_files_created.append(inputfile)
+                    tmp_files_created.append(file_md_tmp)
+                    tmp_dirs_created.append(file_md_dir)
+                if error:
+                    self._remove_temporary(tmp_files_created, tmp_dirs_created)
+                    raise error
+
+                # Also, get dataset metadata (normally included in dataset .zip download file)
+                ds_md = pyclowder.datasets.download_metadata(self, host, secret_key, resource["id"])
+                md_name = "%s_dataset_metadata.json" % resource["id"]
+                md_dir = tempfile.mkdtemp(suffix=resource["id"])
+                (fd, md_file) = tempfile.mkstemp(suffix=md_name, dir=md_dir)
+                with os.fdopen(fd, "w") as tmp_file:
+                    tmp_file.write(json.dumps(ds_md))
+                file_paths.append(md_file)
+                tmp_files_created.append(md_file)
+                tmp_dirs_created.append(md_dir)
+
+        # If we didn't find any files locally, download dataset .zip and extract it while downloading
+        if len(located_files) == 0:
+            output_folder = tempfile.mkdtemp(suffix=resource["id"])
             try:
-                inputzip = pyclowder.datasets.download(self, host, secret_key, resource["id"])
-                file_paths = pyclowder.utils.extract_zip_contents(inputzip)
-                tmp_files_created += file_paths
-                tmp_files_created.append(inputzip)
-            except Exception as e:
+                file_paths = pyclowder.datasets.download_and_extract(self, host, secret_key, resource["id"],
+                                                                     output_folder)
+            except zipfile.BadZipFile:
+                logger.debug("Could not extract dataset while downloading, downloading dataset .zip")
+                shutil.rmtree(output_folder, ignore_errors=True)
+                file_paths = None
+            except Exception:
                 logger.exception("No files found and download failed")
+                shutil.rmtree(output_folder, ignore_errors=True)
+                file_paths = []
+            else:
+                tmp_files_created += file_paths
+                tmp_dirs_created += self._list_directories(output_folder)
+
+            # fall back to downloading the .zip, which is removed as soon as it is extracted
+            if file_paths is None:
+                file_paths = []
+                try:
+                    inputzip = pyclowder.datasets.download(self, host, secret_key, resource["id"])
+                    try:
+                        file_paths = pyclowder.utils.extract_zip_contents(inputzip)
+                    finally:
+                        os.remove(inputzip)
+                    tmp_files_created += file_paths
+                    tmp_dirs_created += self._list_directories(inputzip.replace(".zip", ""))
+                except Exception:
+                    logger.exception("No files found and download failed")
 
         return (file_paths, tmp_files_created, tmp_dirs_created)
 
+    @staticmethod
+    def _list_directories(folder):
+        """List folder and all directories in it, deepest first, so they can be removed in order."""
+        return [root for (root, _, _) in os.walk(folder, topdown=False)]
+
+    @staticmethod
+    def _remove_temporary(tmp_files, tmp_dirs):
+        """Remove temporary files and directories created while processing a message."""
+        logger = logging.getLogger(__name__)
+        for tmp_f in tmp_files:
+            try:
+                os.remove(tmp_f)
+            except OSError:
+                logger.exception("Error removing temporary dataset file")
+        for tmp_d in tmp_dirs:
+            try:
+                os.rmdir(tmp_d)
+            except OSError:
+                logger.exception("Error removing temporary dataset directory")
+
     # pylint: disable=too-many-branches,too-many-statements
-    def _process_message(self, body):
-        """The actual processing of the message.
+    def _parse_message(self, body):
+        """Return (emailaddrlist, source_host, host, secret_key, retry_count, resource) of the message.
 
-        This will call check_message to see if the message should be processed and if the
-        file should be downloaded. Finally it will call the actual process_message function.
+        Returns None if the message can not be processed.
         """
-
         logger = logging.getLogger(__name__)
         emailaddrlist = None
         if body.get('notifies'):
@@ -397,7 +644,7 @@ class Connector(object):
         host = self.clowder_url if self.clowder_url else source_host
         if host == '' or source_host == '':
             logging.error("Host is empty, this is bad.")
-            return
+            return None
         if not source_host.endswith('/'): source_host += '/'
         if not host.endswith('/'): host += '/'
         secret_key = body.get('secretKey', '')
@@ -406,7 +653,78 @@ class Connector(object):
         resource = self._build_resource(body, host, secret_key, clowder_version)
         if not resource:
             logging.error("No resource found, this is bad.")
+            return None
+        return emailaddrlist, source_host, host, secret_key, retry_count, resource
+
+    def _message_failed(self, resource, retry_count, exc):
+        """Send the message to the error queue or resubmit it, depending on the exception and retry_count."""
+        logger = logging.getLogger(__name__)
+        if isinstance(exc, subprocess.CalledProcessError):
+            message = str.format("Error in subprocess [exit code={}]:\n{}", exc.returncode, exc.output)
+            logger.exception("[%s] %s", resource['id'], message)
+            self.message_error(resource, message)
+        elif isinstance(exc, PyClowderExtractionAbort):
+            message = str.format("Aborting message: {}", exc.message)
+            logger.exception("[%s] %s", resource['id'], message)
+            self.message_error(resource, message)
+        else:
+            message = str(exc)
+            logger.exception("[%s] %s", resource['id'], message)
+            if retry_count < self.max_retry:
+                message = "(#%s) %s" % (retry_count+1, message)
+                self.message_resubmit(resource, retry_count+1, message)
+            else:
+                self.message_error(resource, message)
+
+    def _process_message(self, body):
+        """The actual processing of the message.
+
+        This will call check_message to see if the message should be processed and if the
+        file should be downloaded. Finally it will call the actual process_message function.
+        """
+        job = self._job(body)
+        (result, error) = (None, None)
+        while True:
+            try:
+                (func, args) = job.throw(error) if error is not None else job.send(result)
+            except StopIteration:
+                return
+            try:
+                (result, error) = (func(*args), None)
+            except BaseException as exc:  # pylint: disable=broad-except
+                (result, error) = (None, exc)
+
+    def _job(self, body):
+        """Generator of the steps of the message, see _process_message.
+
+        The job yields (func, args) for each call that can block, check_message, process_message,
+        downloads and email, and is sent the result (or thrown the exception) of the call. This
+        way _process_message and AsyncRabbitMQHandler run the same job, one calling the steps in
+        the current thread, the other awaiting them on the event loop.
+        """
+        # the results of the job cache are only used while processing this message
+        self.invalidate_job_cache()
+        try:
+            with pyclowder.tracing.span('job', extractor=self.extractor_name, job_id=getattr(self, 'job_id', None),
+                                        retry_count=body.get('retry_count', 0)) as job_span, \
+                    pyclowder.profiler.profile(self.extractor_name):
+                yield from self._process_job(body, job_span)
+        finally:
+            self.invalidate_job_cache()
+
+    def _process_job(self, body, job_span):
+        """Steps of the message in the job span, see _job."""
+
+        logger = logging.getLogger(__name__)
+        with pyclowder.tracing.span('parse_message'):
+            parsed = self._parse_message(body)
+        if not parsed:
             return
+        (emailaddrlist, source_host, host, secret_key, retry_count, resource) = parsed
+        pyclowder.metrics.MESSAGE_RETRIES.observe(retry_count, extractor=self.extractor_name)
+        job_span.set('resource.type', resource['type'])
+        job_span.set('resource.id', resource['id'])
+        pyclowder.profiler.tag(type=resource['type'], id=resource['id'])
 
         # tell everybody we are starting to process the file
         self.status_update(pyclowder.utils.StatusMessage.start, resource, "Started processing.")
@@ -416,7 +734,9 @@ class Connector(object):
         try:
             check_result = pyclowder.utils.CheckMessage.download
             if self.check_message:
-                check_result = self.check_message(self, source_host, secret_key, resource, body)
+                with pyclowder.metrics.CHECK_MESSAGE_SECONDS.time(extractor=self.extractor_name), \
+                        pyclowder.tracing.span('check_message'):
+                    check_result = yield (self.check_message, (self, source_host, secret_key, resource, body))
             if check_result != pyclowder.utils.CheckMessage.ignore:
                 if self.process_message:
 
@@ -426,22 +746,26 @@ class Connector(object):
                         found_local = False
                         try:
                             if check_result != pyclowder.utils.CheckMessage.bypass:
-                                file_metadata = pyclowder.files.download_info(self, host, secret_key, resource["id"])
+                                with pyclowder.tracing.span('download_info', fileid=resource["id"]):
+                                    file_metadata = yield (pyclowder.files.download_info,
+                                                           (self, host, secret_key, resource["id"]))
                                 file_path = self._check_for_local_file(file_metadata)
                                 if not file_path:
-                                    file_path = pyclowder.files.download(self, host, secret_key, resource["id"],
-                                                                         resource["intermediate_id"],
-                                                                         resource["file_ext"],
-                                                                         tracking=False)
+                                    file_path = yield (self._download_file,
+                                                       (host, secret_key, resource["id"], resource["intermediate_id"],
+                                                        resource["file_ext"], file_metadata))
                                 else:
                                     found_local = True
                                 resource['local_paths'] = [file_path]
 
-                            self.process_message(self, source_host, secret_key, resource, body)
+                            with pyclowder.metrics.PROCESS_MESSAGE_SECONDS.time(extractor=self.extractor_name), \
+                                    pyclowder.tracing.span('process_message'):
+                                yield (self.process_message, (self, source_host, secret_key, resource, body))
 
                             clowderurl = "%sfiles/%s" % (source_host, body.get('id', ''))
                             # notification of extraction job is done by email.
-                            self.email(emailaddrlist, clowderurl)
+                            with pyclowder.tracing.span('email'):
+                                yield (self.email, (emailaddrlist, clowderurl))
                         finally:
                             if file_path is not None and not found_local:
                                 try:
@@ -454,24 +778,20 @@ class Connector(object):
                         file_paths, tmp_files, tmp_dirs = [], [], []
                         try:
                             if check_result != pyclowder.utils.CheckMessage.bypass:
-                                (file_paths, tmp_files, tmp_dirs) = self._prepare_dataset(host, secret_key, resource)
+                                with pyclowder.tracing.span('prepare_dataset', datasetid=resource["id"]):
+                                    (file_paths, tmp_files, tmp_dirs) = yield (self._prepare_dataset,
+                                                                               (host, secret_key, resource))
                             resource['local_paths'] = file_paths
 
-                            self.process_message(self, source_host, secret_key, resource, body)
+                            with pyclowder.metrics.PROCESS_MESSAGE_SECONDS.time(extractor=self.extractor_name), \
+                                    pyclowder.tracing.span('process_message'):
+                                yield (self.process_message, (self, source_host, secret_key, resource, body))
                             clowderurl = "%sdatasets/%s" % (source_host, body.get('datasetId', ''))
                             # notificatino of extraction job is done by email.
-                            self.email(emailaddrlist, clowderurl)
+                            with pyclowder.tracing.span('email'):
+                                yield (self.email, (emailaddrlist, clowderurl))
                         finally:
-                            for tmp_f in tmp_files:
-                                try:
-                                    os.remove(tmp_f)
-                                except OSError:
-                                    logger.exception("Error removing temporary dataset file")
-                            for tmp_d in tmp_dirs:
-                                try:
-                                    os.rmdir(tmp_d)
-                                except OSError:
-                                    logger.exception("Error removing temporary dataset directory")
+                            self._remove_temporary(tmp_files, tmp_dirs)
 
             else:
                 self.status_update(pyclowder.utils.StatusMessage.skip, resource, "Skipped in check_message")
@@ -493,22 +813,8 @@ class Connector(object):
             logger.exception("[%s] %s", resource['id'], message)
             self.message_resubmit(resource, retry_count, message)
             raise
-        except subprocess.CalledProcessError as exc:
-            message = str.format("Error in subprocess [exit code={}]:\n{}", exc.returncode, exc.output)
-            logger.exception("[%s] %s", resource['id'], message)
-            self.message_error(resource, message)
-        except PyClowderExtractionAbort as exc:
-            message = str.format("Aborting message: {}", exc.message)
-            logger.exception("[%s] %s", resource['id'], message)
-            self.message_error(resource, message)
         except Exception as exc:  # pylint: disable=broad-except
-            message = str(exc)
-            logger.exception("[%s] %s", resource['id'], message)
-            if retry_count < self.max_retry:
-                message = "(#%s) %s" % (retry_count+1, message)
-                self.message_resubmit(resource, retry_count+1, message)
-            else:
-                self.message_error(resource, message)
+            self._message_failed(resource, retry_count, exc)
 
     # pylint: disable=no-self-use
     def status_update(self, status, resource, message):
@@ -525,12 +831,15 @@ class Connector(object):
         logging.getLogger(__name__).info("[%s] : %s: %s", resource["id"], status, message)
 
     def message_ok(self, resource, message="Done processing."):
+        pyclowder.metrics.MESSAGES.inc(extractor=self.extractor_name, status='succeeded')
         self.status_update(pyclowder.utils.StatusMessage.done, resource, message)
 
     def message_error(self, resource, message="Error processing message."):
+        pyclowder.metrics.MESSAGES.inc(extractor=self.extractor_name, status='failed')
         self.status_update(pyclowder.utils.StatusMessage.error, resource, message)
 
     def message_resubmit(self, resource, retry_count, message="Resubmitting message."):
+        pyclowder.metrics.MESSAGES.inc(extractor=self.extractor_name, status='resubmitted')
         self.status_update(pyclowder.utils.StatusMessage.retry, resource, message)
 
     def message_process(self, resource, message):
@@ -538,7 +847,7 @@ class Connector(object):
 
     def get(self, url, params=None, raise_status=True, **kwargs):
         """
-        This methods wraps the Python requests GET method
+        This methods wraps the GET method of the shared requests session
         :param url: URl to use in GET request
         :param params: (optional) GET request parameters
         :param raise_status: (optional) If set to True, call raise_for_status. Default is True.
@@ -546,7 +855,7 @@ class Connector(object):
         :return: Response of the GET request
         """
 
-        response = requests.get(url, params=params, **kwargs)
+        response = self.session.get(url, params=params, **kwargs)
         if raise_status:
             response.raise_for_status()
 
@@ -554,7 +863,7 @@ class Connector(object):
 
     def post(self, url, data=None, json_data=None, raise_status=True, **kwargs):
         """
-        This methods wraps the Python requests POST method
+        This methods wraps the POST method of the shared requests session
         :param url: URl to use in POST request
         :param data: (optional) data (Dictionary, bytes, or file-like object) to send in the body of POST request
         :param json_data: (optional) json data to send with POST request
@@ -563,7 +872,7 @@ class Connector(object):
         :return: Response of the POST request
         """
 
-        response = requests.post(url, data=data, json=json_data, **kwargs)
+        response = self.session.post(url, data=data, json=json_data, **kwargs)
         if raise_status:
             response.raise_for_status()
 
@@ -571,7 +880,7 @@ class Connector(object):
 
     def patch(self, url, data=None, json_data=None, raise_status=True, **kwargs):
         """
-        This methods wraps the Python requests PATCH method
+        This methods wraps the PATCH method of the shared requests session
         :param url: URl to use in PATCH request
         :param data: (optional) data (Dictionary, bytes, or file-like object) to send in the body of PATCH request
         :param json_data: (optional) json data to send with PATCH request
@@ -580,7 +889,7 @@ class Connector(object):
         :return: Response of the PATCH request
         """
 
-        response = requests.patch(url, data=data, json=json_data, **kwargs)
+        response = self.session.patch(url, data=data, json=json_data, **kwargs)
         if raise_status:
             response.raise_for_status()
 
@@ -588,7 +897,7 @@ class Connector(object):
 
     def put(self, url, data=None, raise_status=True, **kwargs):
         """
-        This methods wraps the Python requests PUT method
+        This methods wraps the PUT method of the shared requests session
         :param url: URl to use in PUT request
         :param data: (optional) data to send with PUT request
         :param raise_status: (optional) If set to True, call raise_for_status. Default is True.
@@ -596,7 +905,7 @@ class Connector(object):
         :return: Response of the PUT request
         """
 
-        response = requests.put(url, data=data, **kwargs)
+        response = self.session.put(url, data=data, **kwargs)
         if raise_status:
             response.raise_for_status()
 
@@ -604,14 +913,14 @@ class Connector(object):
 
     def delete(self, url, raise_status=True, **kwargs):
         """
-        This methods wraps the Python requests DELETE method
+        This methods wraps the DELETE method of the shared requests session
         :param url: URl to use in DELETE request
         :param raise_status: (optional) If set to True, call raise_for_status. Default is True.
         :param kwargs: List of other optional arguments to pass to DELETE call
         :return: Response of the DELETE request
         """
 
-        response = requests.delete(url, **kwargs)
+        response = self.session.delete(url, **kwargs)
         if raise_status:
             response.raise_for_status()
 
@@ -629,9 +938,19 @@ class RabbitMQConnector(Connector):
     def __init__(self, extractor_name, extractor_info,
                  rabbitmq_uri, rabbitmq_key=None, rabbitmq_queue=None,
                  check_message=None, process_message=None, ssl_verify=True, mounted_paths=None,
-                 heartbeat=10, clowder_url=None, max_retry=10, extractor_key=None, clowder_email=None):
+                 heartbeat=10, clowder_url=None, max_retry=10, extractor_key=None, clowder_email=None, workers=1,
+                 http_pool_size=10, http_max_retries=3, http_backoff_factor=0.5, parallel_downloads=4,
+                 download_cache=None, download_segments=4, download_chunk_size=1024 * 1024, status_interval=0,
+                 processes=0, heartbeat_load=False, reconnect_max_delay=60):
         super(RabbitMQConnector, self).__init__(extractor_name, extractor_info, check_message, process_message,
-                                                ssl_verify, mounted_paths, clowder_url, max_retry, extractor_key, clowder_email)
+                                                ssl_verify, mounted_paths, clowder_url, max_retry, extractor_key,
+                                                clowder_email, http_pool_size=http_pool_size,
+                                                http_max_retries=http_max_retries,
+                                                http_backoff_factor=http_backoff_factor,
+                                                parallel_downloads=parallel_downloads,
+                                                download_cache=download_cache,
+                                                download_segments=download_segments,
+                                                download_chunk_size=download_chunk_size)
         self.rabbitmq_uri = rabbitmq_uri
         self.rabbitmq_key = rabbitmq_key
         if rabbitmq_queue is None:
@@ -644,9 +963,23 @@ class RabbitMQConnector(Connector):
         self.channel = None
         self.connection = None
         self.consumer_tag = None
-        self.worker = None
+        self.workers = max(1, int(workers))
+        self.handlers = []
+        self.status_interval = float(status_interval)
+        self.processes = int(processes)
+        self.process_pool = None
+        self.process_pool_lock = threading.Lock()
+        self.process_events = None
+        self.process_handlers = {}
         self.announcer = None
         self.heartbeat = float(heartbeat)
+        self.heartbeat_load = heartbeat_load
+        self.started = time.time()
+        self.reconnect_max_delay = float(reconnect_max_delay)
+        self.reconnect_attempt = 0
+        self.connected = None
+        self.listening = False
+        self.stopping = threading.Event()
 
     def connect(self):
         """connect to rabbitmq using URL parameters"""
@@ -657,24 +990,79 @@ class RabbitMQConnector(Connector):
         # connect to channel
         self.channel = self.connection.channel()
 
-        # setting prefetch count to 1 so we only take 1 message of the bus at a time,
-        # so other extractors of the same type can take the next message.
-        self.channel.basic_qos(prefetch_count=1)
+        # setting prefetch count to the number of workers (or processes) so we only take as many messages of the bus
+        # as we can process at the same time, so other extractors of the same type can take the next message.
+        self.channel.basic_qos(prefetch_count=max(self.workers, self.processes))
 
         # declare the queue in case it does not exist
         self.channel.queue_declare(queue=self.rabbitmq_queue, durable=True)
         self.channel.queue_declare(queue='error.'+self.rabbitmq_queue, durable=True)
 
-        # start the extractor announcer
-        self.announcer = RabbitMQBroadcast(self.rabbitmq_uri, self.extractor_info, self.clowder_email, self.rabbitmq_queue, self.heartbeat)
-        self.announcer.start_thread()
+        # the extractor is announced on the same connection, see listen
+        if self.announcer is None:
+            self.announcer = RabbitMQBroadcast(self.extractor_info, self.clowder_email, self.rabbitmq_queue,
+                                               self.heartbeat, self.load if self.heartbeat_load else None)
+        self.announcer.declare(self.channel)
 
     def listen(self):
-        """Listen for messages coming from RabbitMQ"""
+        """Listen for messages coming from RabbitMQ.
 
-        # check for connection
-        if not self.channel:
-            self.connect()
+        If the connection is lost, a new connection is made after a random delay of up to 1, 2, 4, ...
+        seconds (at most reconnect_max_delay) and the queues are declared again. Messages that are
+        being processed keep running, see _mark_stale. A reconnect_max_delay of 0 stops listening
+        when the connection is lost.
+        """
+        self.listening = True
+        try:
+            while not self.stopping.is_set():
+                try:
+                    # check for connection
+                    if not self.channel:
+                        self.connect()
+                    self.connected = time.time()
+                    self._consume()
+                except SystemExit:
+                    raise
+                except KeyboardInterrupt:
+                    raise
+                except GeneratorExit:
+                    raise
+                except pika.exceptions.AMQPConnectionError as exc:
+                    logging.getLogger(__name__).warning("Lost connection to RabbitMQ: %r", exc)
+                except Exception:  # pylint: disable=broad-except
+                    logging.getLogger(__name__).exception("Error while consuming messages.")
+                finally:
+                    self._close()
+
+                if self.stopping.is_set() or self.reconnect_max_delay <= 0:
+                    break
+                self._mark_stale()
+                self.stopping.wait(self._reconnect_delay())
+        finally:
+            logging.getLogger(__name__).info("Stopped listening for messages.")
+            with self.process_pool_lock:
+                (pool, self.process_pool) = (self.process_pool, None)
+            if pool:
+                pool.shutdown(wait=False)
+            self.listening = False
+
+    def _reconnect_delay(self):
+        """Return the delay before the next attempt to connect, after the connection failed or was lost.
+
+        The delay doubles with each attempt, up to reconnect_max_delay. It only starts with a short
+        delay again if the last connection stayed up for at least reconnect_max_delay.
+        """
+        if self.connected is not None and time.time() - self.connected >= self.reconnect_max_delay:
+            self.reconnect_attempt = 0
+        self.connected = None
+        delay = random.uniform(0, min(self.reconnect_max_delay, 2 ** self.reconnect_attempt))
+        self.reconnect_attempt += 1
+        logging.getLogger(__name__).warning("Connection to RabbitMQ lost, reconnecting in %.1f seconds "
+                                            "(attempt %d).", delay, self.reconnect_attempt)
+        return delay
+
+    def _consume(self):
+        """Consume messages until the connector is stopped or the channel is closed."""
 
         # create listener
         self.consumer_tag = self.channel.basic_consume(queue=self.rabbitmq_queue,
@@ -683,47 +1071,76 @@ class RabbitMQConnector(Connector):
 
         # start listening
         logging.getLogger(__name__).info("Starting to listen for messages.")
-        try:
-            # pylint: disable=protected-access
-            while self.channel and self.channel.is_open and self.channel._consumer_infos:
-                self.channel.connection.process_data_events(time_limit=1)  # 1 second
-                if self.worker:
-                    self.worker.process_messages(self.channel, self.rabbitmq_queue)
-                    if self.worker.is_finished():
-                        self.worker = None
-        except SystemExit:
-            raise
-        except KeyboardInterrupt:
-            raise
-        except GeneratorExit:
-            raise
-        except Exception:  # pylint: disable=broad-except
-            logging.getLogger(__name__).exception("Error while consuming messages.")
-        finally:
-            logging.getLogger(__name__).info("Stopped listening for messages.")
-            if self.channel and self.channel.is_open:
-                try:
-                    self.channel.close()
-                except Exception:
-                    logging.getLogger(__name__).exception("Error while closing channel.")
-            self.channel = None
-            if self.connection and self.connection.is_open:
-                try:
-                    self.connection.close()
-                except Exception:
-                    logging.getLogger(__name__).exception("Error while closing connection.")
-            if self.announcer:
-                self.announcer.stop_thread()
+        # pylint: disable=protected-access
+        while self.channel and self.channel.is_open and self.channel._consumer_infos:
+            # returns as soon as a handler queued a message (see wakeup), or after 1 second
+            self.channel.connection.process_data_events(time_limit=1)
+            self._process_handlers()
+            self.announcer.send(self.channel)
+
+    def _close(self):
+        """Close the channel and the connection, ignoring errors of a connection that is already lost."""
+        if self.channel and self.channel.is_open:
+            try:
+                self.channel.close()
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception("Error while closing channel.")
+        self.channel = None
+        if self.connection and self.connection.is_open:
+            try:
+                self.connection.close()
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception("Error while closing connection.")
+        self.connection = None
 
-            self.connection = None
+    def _mark_stale(self):
+        """Mark the messages that are being processed as received on a closed channel.
+
+        Their delivery tags can not be acknowledged on the new channel. RabbitMQ delivers these
+        messages again, when one with the same message id is received by on_message it is given
+        to the handler that is already processing it, instead of processing it again.
+        """
+        for handler in self.handlers:
+            if not handler.stale:
+                handler.stale = time.time()
+
+    def _process_handlers(self):
+        """Send the messages queued by the handlers and remove the handlers that are finished."""
+        for handler in list(self.handlers):
+            handler.process_messages(self.channel, self.rabbitmq_queue)
+            if handler.is_finished():
+                self.handlers.remove(handler)
 
     def stop(self):
         """Tell the connector to stop listening for messages."""
+        self.stopping.set()
         if self.channel:
             self.channel.stop_consuming(self.consumer_tag)
 
+    def wakeup(self):
+        """Wake up the listen loop from a handler thread, so queued messages are send immediately."""
+        connection = self.connection
+        if connection and connection.is_open:
+            try:
+                connection.add_callback_threadsafe(lambda: None)
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).debug("Could not wake up listener, connection is closed.")
+
     def alive(self):
-        return self.connection is not None
+        return self.connection is not None or self.listening
+
+    def load(self):
+        """Return the current load of the connector, added to the heartbeats if heartbeat_load is set."""
+        load = {
+            'workers': max(self.workers, self.processes),
+            'active': len(self.handlers),
+            'uptime': round(time.time() - self.started, 1),
+        }
+        for status in ('succeeded', 'failed', 'resubmitted'):
+            load[status] = pyclowder.metrics.MESSAGES.get(extractor=self.extractor_name, status=status)
+        if hasattr(os, 'getloadavg'):
+            load['loadavg'] = os.getloadavg()[0]
+        return load
 
     @staticmethod
     def _decode_body(body, codecs=None):
@@ -743,22 +1160,36 @@ class RabbitMQConnector(Connector):
         or there is an exception (except for SystemExit and SystemError exceptions).
         """
 
+        if getattr(method, 'redelivered', False):
+            handler = self._stale_handler(header, body)
+            if handler is not None:
+                # received before the connection was lost and still being processed, see _mark_stale
+                logging.getLogger(__name__).info("Message %s delivered again after reconnect.", handler.message_id)
+                handler.method = method
+                handler.stale = None
+                return
+
+        pyclowder.metrics.MESSAGES.inc(extractor=self.extractor_name, status='received')
+        if getattr(header, 'timestamp', None):
+            pyclowder.metrics.QUEUE_WAIT_SECONDS.observe(max(0.0, time.time() - header.timestamp),
+                                                         extractor=self.extractor_name)
         try:
             json_body = json.loads(self._decode_body(body))
             if 'routing_key' not in json_body and method.routing_key:
                 json_body['routing_key'] = method.routing_key
 
-            if 'jobid' in json_body:
-                job_id = json_body['jobid']
-            elif 'job_id' in json_body:
-                job_id = json_body['job_id']
-            else:
-                job_id = None
+            job_id = self._job_id(json_body)
 
-            self.worker = RabbitMQHandler(self.extractor_name, self.extractor_info, job_id, self.check_message,
-                                          self.process_message, self.ssl_verify, self.mounted_paths, self.clowder_url,
-                                          method, header, body)
-            self.worker.start_thread(json_body)
+            handler = self._create_handler(job_id, method, header, body)
+            handler.message_id = self._message_id(header, job_id)
+            self.handlers.append(handler)
+            try:
+                handler.start_thread(json_body)
+            except BrokenProcessPool:
+                # no worker process could be started, give the message back to rabbitmq
+                logging.getLogger(__name__).exception("Could not process message, message requeued")
+                self.handlers.remove(handler)
+                channel.basic_nack(method.delivery_tag, requeue=True)
 
         except ValueError:
             # something went wrong, move message to error queue and give up on this message immediately
@@ -770,62 +1201,201 @@ class RabbitMQConnector(Connector):
                                   body=body)
             channel.basic_ack(method.delivery_tag)
 
+    @staticmethod
+    def _job_id(json_body):
+        if 'jobid' in json_body:
+            return json_body['jobid']
+        elif 'job_id' in json_body:
+            return json_body['job_id']
+        return None
+
+    @staticmethod
+    def _message_id(header, job_id):
+        """Return the id used to recognize a message when it is delivered again, or None if the message has no id.
+
+        This is the message_id or correlation_id of the message properties, or the job id in the message.
+        """
+        for value in (getattr(header, 'message_id', None), getattr(header, 'correlation_id', None)):
+            if isinstance(value, str) and value:
+                return value
+        return str(job_id) if job_id else None
+
+    def _stale_handler(self, header, body):
+        """Return the stale handler processing the message that is delivered again, see _mark_stale."""
+        try:
+            message_id = self._message_id(header, self._job_id(json.loads(self._decode_body(body))))
+        except ValueError:
+            return None
+        if message_id is None:
+            return None
+        for handler in self.handlers:
+            if handler.stale and handler.message_id == message_id:
+                return handler
+        return None
+
+    def _create_handler(self, job_id, method, header, body):
+        """Create the handler that processes a single message."""
+        if self.processes > 0:
+            return RabbitMQProcessHandler(self.extractor_name, self.extractor_info, job_id, method=method,
+                                          header=header, body=body, session=self.session,
+                                          status_interval=self.status_interval, notify=self.wakeup,
+                                          submit=self._submit_process)
+        return RabbitMQHandler(self.extractor_name, self.extractor_info, job_id, self.check_message,
+                               self.process_message, self.ssl_verify, self.mounted_paths, self.clowder_url,
+                               method, header, body, session=self.session,
+                               parallel_downloads=self.parallel_downloads,
+                               download_cache=self.download_cache,
+                               download_segments=self.download_segments,
+                               download_chunk_size=self.download_chunk_size,
+                               status_interval=self.status_interval, notify=self.wakeup)
+
+    def _submit_process(self, handler, json_body):
+        """Process the message of handler in the process pool, the events are send back to the handler.
+
+        If the pool is broken, because a worker process died, a new pool is created and the message
+        is submitted again. Raises BrokenProcessPool if the new pool is broken as well.
+        """
+        key = uuid.uuid4().hex
+        self.process_handlers[key] = handler
+        for attempt in range(2):
+            with self.process_pool_lock:
+                if self.process_pool is None:
+                    self.process_pool = self._create_process_pool()
+                pool = self.process_pool
+            try:
+                future = pool.submit(_process_in_worker, key, json_body)
+            except BrokenProcessPool:
+                self._discard_process_pool(pool)
+                if attempt > 0:
+                    del self.process_handlers[key]
+                    raise
+            else:
+                future.add_done_callback(lambda f: self._process_finished(key, json_body, pool, f))
+                return future
+
+    def _create_process_pool(self):
+        """Create the pool of worker processes, and the thread that dispatches the events of the workers."""
+        # fork if possible, the check_message and process_message of an extractor can not be pickled
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        if self.process_events is None:
+            self.process_events = context.Queue()
+            thread = threading.Thread(target=self._dispatch_process_events, name="RabbitMQProcessEvents")
+            thread.daemon = True
+            thread.start()
+        settings = {
+            'extractor_name': self.extractor_name,
+            'extractor_info': self.extractor_info,
+            'check_message': self.check_message,
+            'process_message': self.process_message,
+            'ssl_verify': self.ssl_verify,
+            'mounted_paths': self.mounted_paths,
+            'clowder_url': self.clowder_url,
+            'max_retry': self.max_retry,
+            'http_pool_size': self.http_pool_size,
+            'http_max_retries': self.http_max_retries,
+            'http_backoff_factor': self.http_backoff_factor,
+            'parallel_downloads': self.parallel_downloads,
+            'download_cache': self.download_cache,
+            'download_segments': self.download_segments,
+            'download_chunk_size': self.download_chunk_size,
+        }
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                   initializer=_init_worker_process, initargs=(settings, self.process_events))
+
+    def _process_finished(self, key, json_body, pool, future):
+        """Called when the worker process is done, if the process died the message is resubmitted.
+
+        This runs in a thread of the pool, the pool is broken if a worker process died, it is shut down and a new
+        pool is created for the next message, unless another message already replaced it.
+        """
+        error = "cancelled" if future.cancelled() else future.exception()
+        if error is not None:
+            self._discard_process_pool(pool)
+            self.process_events.put((key, 'crashed', (json_body, str(error))))
+
+    def _discard_process_pool(self, pool):
+        """Shut down the broken pool, a new pool is created for the next message unless pool was already replaced."""
+        with self.process_pool_lock:
+            broken = self.process_pool is pool
+            if broken:
+                self.process_pool = None
+        if broken:
+            pool.shutdown(wait=False)
+
+    def _dispatch_process_events(self):
+        """Pass the events send by the worker processes to the handlers, runs in its own thread."""
+        while True:
+            try:
+                (key, method, args) = self.process_events.get()
+            except (EOFError, OSError):
+                # the queue is closed when the program exits
+                return
+            if key is None and method == 'metric':
+                pyclowder.metrics.apply(*args)
+                continue
+            handler = self.process_handlers.get(key)
+            if handler is None:
+                continue
+            try:
+                if method == 'done':
+                    del self.process_handlers[key]
+                    handler.process_done()
+                elif method == 'crashed':
+                    del self.process_handlers[key]
+                    handler.process_crashed(self.max_retry, *args)
+                else:
+                    getattr(handler, method)(*args)
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception("Error handling event from worker process.")
+
 
 class RabbitMQBroadcast:
-    def __init__(self, rabbitmq_uri, extractor_info, clowder_email, rabbitmq_queue, heartbeat):
-        self.active = True
-        self.rabbitmq_uri = rabbitmq_uri
+    """Announces the extractor by publishing heartbeats on the extractors fanout exchange.
+
+    The heartbeats are published on the channel of the connector, send is called from the loop of
+    the connector and publishes a heartbeat when one is due. If load is given, it is called for
+    every heartbeat and the result is added to the heartbeat as load.
+    """
+
+    def __init__(self, extractor_info, clowder_email, rabbitmq_queue, heartbeat, load=None):
         self.extractor_info = extractor_info
         self.clowder_email = clowder_email
         self.rabbitmq_queue = rabbitmq_queue
         self.heartbeat = heartbeat
+        self.load = load
         self.id = str(uuid.uuid4())
-        self.connection = None
-        self.channel = None
-        self.thread = None
-
-    def start_thread(self):
-        parameters = pika.URLParameters(self.rabbitmq_uri)
-        self.connection = pika.BlockingConnection(parameters)
-
-        # connect to channel
-        self.channel = self.connection.channel()
-
-        # create extractors exchange for fanout
-        self.channel.exchange_declare(exchange='extractors', exchange_type='fanout', durable=True)
-
-        self.thread = threading.Thread(target=self.send_heartbeat)
-        self.thread.daemon = True
-        self.thread.start()
+        self.next_heartbeat = 0
 
-    def stop_thread(self):
-        self.thread = None
+    @staticmethod
+    def declare(channel):
+        """Create the extractors exchange for fanout."""
+        channel.exchange_declare(exchange='extractors', exchange_type='fanout', durable=True)
 
-    def send_heartbeat(self):
-        # create the message we will send
+    def message(self):
+        """Return the heartbeat message."""
         message = {
             'id': self.id,
             'queue': self.rabbitmq_queue,
             'owner': self.clowder_email,
             'extractor_info': self.extractor_info
         }
-        next_heartbeat = time.time()
-        while self.thread:
+        if self.load:
             try:
-                self.channel.connection.process_data_events()
-                if time.time() >= next_heartbeat:
-                    self.channel.basic_publish(exchange='extractors', routing_key='', body=json.dumps(message))
-                    next_heartbeat = time.time() + self.heartbeat
-            except SystemExit:
-                raise
-            except KeyboardInterrupt:
-                raise
-            except GeneratorExit:
-                raise
+                message['load'] = self.load()
             except Exception:  # pylint: disable=broad-except
-                logging.getLogger(__name__).exception("Error while sending heartbeat.")
-                sys.exit(-1)
-            time.sleep(1)
+                logging.getLogger(__name__).exception("Error while computing load of heartbeat.")
+        return message
+
+    def send(self, channel):
+        """Publish a heartbeat on channel if one is due, returns True if a heartbeat was published."""
+        if time.time() < self.next_heartbeat:
+            return False
+        channel.basic_publish(exchange='extractors', routing_key='', body=json.dumps(self.message()))
+        self.next_heartbeat = time.time() + self.heartbeat
+        return True
 
 
 class RabbitMQHandler(Connector):
@@ -833,20 +1403,47 @@ class RabbitMQHandler(Connector):
 
     To avoid sharing non-threadsafe channels across threads, this will maintain
     a queue of messages that the super- loop can access and send later.
+
+    If status_interval is larger than 0, PROCESSING status updates are coalesced
+    per resource and only the latest is send at most once every status_interval
+    seconds. All other status updates are always send, after any pending
+    PROCESSING update of the same resource.
+
+    notify is called from the processing thread every time a message is queued,
+    so the connection thread can send it without waiting.
+
+    stale is the time the connection the message was received on was lost. The ok, error
+    or resubmit of a stale message is held until the message is delivered again, or
+    dropped after redelivery_timeout seconds, when another extractor has received it.
+    A message is recognized when it is delivered again using message_id, see
+    RabbitMQConnector._message_id, messages without an id are held until the timeout.
     """
 
+    redelivery_timeout = 300
+
     def __init__(self, extractor_name, extractor_info, job_id, check_message=None, process_message=None, ssl_verify=True,
-                 mounted_paths=None, clowder_url=None, method=None, header=None, body=None, max_retry=10):
+                 mounted_paths=None, clowder_url=None, method=None, header=None, body=None, max_retry=10,
+                 session=None, parallel_downloads=4, download_cache=None, download_segments=4,
+                 download_chunk_size=1024 * 1024, status_interval=0, notify=None):
 
         super(RabbitMQHandler, self).__init__(extractor_name, extractor_info, check_message, process_message,
-                                              ssl_verify, mounted_paths, clowder_url, max_retry)
+                                              ssl_verify, mounted_paths, clowder_url, max_retry, session=session,
+                                              parallel_downloads=parallel_downloads, download_cache=download_cache,
+                                              download_segments=download_segments,
+                                              download_chunk_size=download_chunk_size)
         self.method = method
         self.header = header
         self.body = body
         self.job_id = job_id
-        self.messages = []
+        self.messages = collections.deque()
+        self.status_interval = float(status_interval)
+        self.pending_status = collections.OrderedDict()
+        self.last_flush = 0
+        self.notify = notify
         self.thread = None
         self.finished = False
+        self.stale = None
+        self.message_id = None
         self.lock = threading.Lock()
 
     def start_thread(self, json_body):
@@ -867,12 +1464,25 @@ class RabbitMQHandler(Connector):
 
     def is_finished(self):
         with self.lock:
-            return self.thread and not self.thread.is_alive() and self.finished and len(self.messages) == 0
+            return self.thread and not self.thread.is_alive() and self.finished and len(self.messages) == 0 \
+                and len(self.pending_status) == 0
 
     def process_messages(self, channel, rabbitmq_queue):
+        if self.pending_status and time.time() - self.last_flush >= self.status_interval:
+            with self.lock:
+                self._flush_status()
+
         while self.messages:
             with self.lock:
-                msg = self.messages.pop(0)
+                if self.stale and self.messages[0]["type"] != 'status':
+                    if time.time() - self.stale < self.redelivery_timeout:
+                        break
+                    logging.getLogger(__name__).warning("Message of job %s was not delivered again after "
+                                                        "reconnect, dropping its result.", self.job_id)
+                    self.messages.clear()
+                    self.finished = True
+                    break
+                msg = self.messages.popleft()
 
             # PROCESSING - Standard update message during extractor processing
             if msg["type"] == 'status':
@@ -919,39 +1529,324 @@ class RabbitMQHandler(Connector):
             else:
                 logging.getLogger(__name__).error("Received unknown message type [%s]." % msg["type"])
 
+    def _flush_status(self):
+        """Move the pending PROCESSING status updates to the message queue, must be called holding the lock."""
+        if self.pending_status:
+            self.messages.extend(self.pending_status.values())
+            self.pending_status.clear()
+            self.last_flush = time.time()
+
+    def _queue(self, msg):
+        """Add a message to the queue, after any pending PROCESSING status updates."""
+        with self.lock:
+            self._flush_status()
+            self.messages.append(msg)
+        if self.notify:
+            self.notify()
+
     def status_update(self, status, resource, message):
         super(RabbitMQHandler, self).status_update(status, resource, message)
 
-        with self.lock:
-            # TODO: Remove 'status' from payload later and read from message_type and message in Clowder 2.0
-            self.messages.append({"type": "status",
-                                  "resource": resource,
-                                  "payload": {
-                                      "file_id":      resource["id"],
-                                      "extractor_id": self.extractor_info['name'],
-                                      "job_id":       self.job_id,
-                                      "status":       "%s: %s" % (status, message),
-                                      "start":        pyclowder.utils.iso8601time(),
-                                      "message_type": "%s" % status,
-                                      "message":      message
-                                  }})
+        # TODO: Remove 'status' from payload later and read from message_type and message in Clowder 2.0
+        msg = {"type": "status",
+               "resource": resource,
+               "payload": {
+                   "file_id":      resource["id"],
+                   "extractor_id": self.extractor_info['name'],
+                   "job_id":       self.job_id,
+                   "status":       "%s: %s" % (status, message),
+                   "start":        pyclowder.utils.iso8601time(),
+                   "message_type": "%s" % status,
+                   "message":      message
+               }}
+        if self.status_interval > 0 and status in (pyclowder.utils.StatusMessage.processing, "PROCESSING"):
+            # only the latest update is kept, process_messages sends it when the interval has passed
+            with self.lock:
+                self.pending_status[resource["id"]] = msg
+        else:
+            self._queue(msg)
 
     def message_ok(self, resource, message="Done processing."):
         super(RabbitMQHandler, self).message_ok(resource, message)
-        with self.lock:
-            self.messages.append({"type": "ok"})
+        self._queue({"type": "ok"})
 
     def message_error(self, resource, message="Error processing message."):
         super(RabbitMQHandler, self).message_error(resource, message)
-        with self.lock:
-            self.messages.append({"type": "error"})
+        self._queue({"type": "error"})
 
     def message_resubmit(self, resource, retry_count, message=None):
         if message is None:
             message = "(#%s)" % retry_count
         super(RabbitMQHandler, self).message_resubmit(resource, retry_count, message)
+        self._queue({"type": "resubmit", "retry_count": retry_count})
+
+
+class RabbitMQProcessHandler(RabbitMQHandler):
+    """Handler that processes a single message in the process pool of the RabbitMQConnector.
+
+    The worker process sends the status updates and the final ok/error/resubmit back to this
+    handler, where they are queued and published by the channel thread like any other handler.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.submit = kwargs.pop('submit')
+        super(RabbitMQProcessHandler, self).__init__(*args, **kwargs)
+        self.future = None
+        self.done = False
+
+    def start_thread(self, json_body):
+        """Start processing the message in the process pool."""
+        self.future = self.submit(self, json_body)
+
+    def is_finished(self):
+        with self.lock:
+            return self.done and self.finished and len(self.messages) == 0 and len(self.pending_status) == 0
+
+    def process_done(self):
+        """Called when the worker process finished the message."""
         with self.lock:
-            self.messages.append({"type": "resubmit", "retry_count": retry_count})
+            self.done = True
+
+    def process_crashed(self, max_retry, json_body, error):
+        """Called when the worker process died while processing the message."""
+        resource_type = self._resource_type(json_body)
+        if resource_type == "dataset":
+            resource = {"type": "dataset", "id": json_body.get('datasetId', '')}
+        elif resource_type == "metadata":
+            resource = {"type": "metadata", "id": json_body.get('resourceId', '')}
+        else:
+            resource = {"type": "file", "id": json_body.get('id', '')}
+        retry_count = json_body.get('retry_count', 0)
+        message = "Worker process died: %s" % error
+        logging.getLogger(__name__).error("[%s] %s", resource['id'], message)
+        if retry_count < max_retry:
+            self.message_resubmit(resource, retry_count + 1, "(#%s) %s" % (retry_count + 1, message))
+        else:
+            self.message_error(resource, message)
+        self.process_done()
+
+
+class _ProcessConnector(Connector):
+    """Connector used in the worker processes, sends all events back to the RabbitMQConnector."""
+
+    def __init__(self, events, **kwargs):
+        super(_ProcessConnector, self).__init__(**kwargs)
+        self.events = events
+        self.key = None
+
+    def status_update(self, status, resource, message):
+        self.events.put((self.key, 'status_update', (status, resource, message)))
+
+    def message_ok(self, resource, message="Done processing."):
+        self.events.put((self.key, 'message_ok', (resource, message)))
+
+    def message_error(self, resource, message="Error processing message."):
+        self.events.put((self.key, 'message_error', (resource, message)))
+
+    def message_resubmit(self, resource, retry_count, message=None):
+        self.events.put((self.key, 'message_resubmit', (resource, retry_count, message)))
+
+
+_worker_connector = None
+
+
+def _init_worker_process(settings, events):
+    """Create the connector of a worker process."""
+    global _worker_connector
+    _worker_connector = _ProcessConnector(events, **settings)
+    # metrics are published by the main process
+    pyclowder.metrics._forward = lambda *args: events.put((None, 'metric', args))
+
+
+def _process_in_worker(key, body):
+    """Process a message in a worker process."""
+    _worker_connector.key = key
+    try:
+        _worker_connector._process_message(body)
+    except BaseException:  # pylint: disable=broad-except
+        # the message is already resubmitted, keep the worker process alive
+        logging.getLogger(__name__).exception("Error processing message in worker process.")
+    finally:
+        _worker_connector.events.put((key, 'done', ()))
+
+
+class AsyncRabbitMQConnector(RabbitMQConnector):
+    """Listens for messages on RabbitMQ using an asyncio event loop.
+
+    Each message is processed as a task on the event loop, up to workers at the same time. The
+    downloads and plain check_message and process_message functions run in the thread pool of the
+    connector. If check_message or process_message is a coroutine function it is awaited on the
+    event loop instead, and can use pyclowder.aio.files and pyclowder.aio.datasets to talk to
+    clowder without blocking the event loop, these calls run in a separate thread pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncRabbitMQConnector, self).__init__(*args, **kwargs)
+        self.loop = None
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.io_executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def connect(self):
+        """create the event loop and the connection to rabbitmq, the connection is opened by listen"""
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        self.connection = AsyncioConnection(pika.URLParameters(self.rabbitmq_uri),
+                                            on_open_callback=self._on_connection_open,
+                                            on_open_error_callback=self._on_connection_closed,
+                                            on_close_callback=self._on_connection_closed,
+                                            custom_ioloop=self.loop)
+
+        # the extractor is announced on the same connection, see _tick
+        if self.announcer is None:
+            self.announcer = RabbitMQBroadcast(self.extractor_info, self.clowder_email, self.rabbitmq_queue,
+                                               self.heartbeat, self.load if self.heartbeat_load else None)
+
+    def listen(self):
+        """Run the event loop until the connector is stopped.
+
+        If the connection is lost, a new connection is made after a delay, the same way as
+        RabbitMQConnector.listen does. The tasks processing messages keep running on the event loop
+        in the meantime. A reconnect_max_delay of 0 stops listening when the connection is lost.
+        """
+        self.listening = True
+
+        # check for connection
+        if not self.connection:
+            self.connect()
+
+        logging.getLogger(__name__).info("Starting to listen for messages.")
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.call_later(1, self._tick)
+            self.loop.run_forever()
+        finally:
+            logging.getLogger(__name__).info("Stopped listening for messages.")
+            self.executor.shutdown(wait=False)
+            self.io_executor.shutdown(wait=False)
+            self.channel = None
+            self.connection = None
+            self.listening = False
+
+    def _on_connection_open(self, connection):
+        self.connected = time.time()
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_closed(self, connection, reason):
+        logging.getLogger(__name__).info("Connection to RabbitMQ closed: %s", reason)
+        self.channel = None
+        self.connection = None
+        self.consumer_tag = None
+        if self.stopping.is_set() or self.reconnect_max_delay <= 0:
+            self.loop.stop()
+            return
+        self._mark_stale()
+        self.loop.call_later(self._reconnect_delay(), self._reconnect)
+
+    def _reconnect(self):
+        if self.stopping.is_set():
+            self.loop.stop()
+        else:
+            self.connect()
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(lambda ch, reason: self.connection.close()
+                                      if self.connection and self.connection.is_open else None)
+
+        # setting prefetch count to the number of workers, see RabbitMQConnector.connect
+        channel.basic_qos(prefetch_count=self.workers, callback=lambda frame: channel.queue_declare(
+            queue='error.' + self.rabbitmq_queue, durable=True, callback=lambda frame: channel.queue_declare(
+                queue=self.rabbitmq_queue, durable=True, callback=self._on_queue_declared)))
+
+    def _on_queue_declared(self, frame):
+        self.announcer.declare(self.channel)
+        self.consumer_tag = self.channel.basic_consume(queue=self.rabbitmq_queue,
+                                                       on_message_callback=self.on_message,
+                                                       auto_ack=False)
+
+    def _tick(self):
+        """Send coalesced status updates and heartbeats, called every second."""
+        self._process_handlers()
+        if self.channel and self.channel.is_open and self.consumer_tag:
+            self.announcer.send(self.channel)
+        if self.loop.is_running():
+            self.loop.call_later(1, self._tick)
+
+    def _process_handlers(self):
+        if self.channel and self.channel.is_open:
+            super(AsyncRabbitMQConnector, self)._process_handlers()
+
+    def stop(self):
+        """Tell the connector to stop listening for messages."""
+        self.stopping.set()
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        if self.connection and not self.connection.is_closing and not self.connection.is_closed:
+            self.connection.close()
+        elif not self.connection:
+            # waiting to reconnect, see _on_connection_closed
+            self.loop.stop()
+
+    def wakeup(self):
+        """Send the messages queued by the handlers on the event loop, can be called from any thread."""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._process_handlers)
+
+    def _create_handler(self, job_id, method, header, body):
+        return AsyncRabbitMQHandler(self.extractor_name, self.extractor_info, job_id, self.check_message,
+                                    self.process_message, self.ssl_verify, self.mounted_paths, self.clowder_url,
+                                    method, header, body, session=self.session,
+                                    parallel_downloads=self.parallel_downloads,
+                                    download_cache=self.download_cache,
+                                    download_segments=self.download_segments,
+                                    download_chunk_size=self.download_chunk_size,
+                                    status_interval=self.status_interval, notify=self.wakeup,
+                                    loop=self.loop, executor=self.executor, io_executor=self.io_executor)
+
+
+class AsyncRabbitMQHandler(RabbitMQHandler):
+    """Handler that processes a single message as a task on the event loop of the AsyncRabbitMQConnector."""
+
+    def __init__(self, *args, **kwargs):
+        self.loop = kwargs.pop('loop', None)
+        self.executor = kwargs.pop('executor', None)
+        self.io_executor = kwargs.pop('io_executor', None)
+        super(AsyncRabbitMQHandler, self).__init__(*args, **kwargs)
+        self.task = None
+
+    def start_thread(self, json_body):
+        """Start processing the message as a task on the event loop."""
+        self.task = self.loop.create_task(self._process_message_async(json_body))
+
+    def is_finished(self):
+        with self.lock:
+            return self.task and self.task.done() and self.finished and len(self.messages) == 0 \
+                and len(self.pending_status) == 0
+
+    async def _process_message_async(self, body):
+        """Run the steps of the job on the event loop, see Connector._job.
+
+        Coroutine functions are awaited on the event loop, other steps are called in the thread pool
+        of the connector. No thread is used while the job waits for a coroutine, so a coroutine
+        process_message can await pyclowder.aio calls with any number of workers.
+        """
+        job = self._job(body)
+        (result, error) = (None, None)
+        while True:
+            try:
+                (func, args) = job.throw(error) if error is not None else job.send(result)
+            except StopIteration:
+                return
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    result = await func(*args)
+                else:
+                    result = await self.loop.run_in_executor(self.executor, pyclowder.tracing.wrap(func), *args)
+                error = None
+            except BaseException as exc:  # pylint: disable=broad-except
+                (result, error) = (None, exc)
 
 
 class HPCConnector(Connector):
@@ -959,9 +1854,13 @@ class HPCConnector(Connector):
 
     # pylint: disable=too-many-arguments
     def __init__(self, extractor_name, extractor_info, picklefile, job_id=None,
-                 check_message=None, process_message=None, ssl_verify=True, mounted_paths=None, max_retry=10):
+                 check_message=None, process_message=None, ssl_verify=True, mounted_paths=None, max_retry=10,
+                 parallel_downloads=4, download_cache=None, download_segments=4, download_chunk_size=1024 * 1024):
         super(HPCConnector, self).__init__(extractor_name, extractor_info, check_message, process_message,
-                                           ssl_verify, mounted_paths, max_retry=max_retry)
+                                           ssl_verify, mounted_paths, max_retry=max_retry,
+                                           parallel_downloads=parallel_downloads, download_cache=download_cache,
+                                           download_segments=download_segments,
+                                           download_chunk_size=download_chunk_size)
         self.job_id = job_id
         self.picklefile = picklefile
         self.logfile = None
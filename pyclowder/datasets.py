@@ -7,9 +7,9 @@ import json
 import logging
 import os
 import posixpath
-from pyclowder.client import ClowderClient
-from pyclowder.collections import get_datasets, get_child_collections, delete as delete_collection
-from pyclowder.utils import StatusMessage
+import threading
+from pyclowder.collections import for_each_dataset, delete as delete_collection
+from pyclowder.utils import StatusMessage, with_default_connector
 
 clowder_version = int(os.getenv('CLOWDER_VERSION', '1'))
 # Import dataset API methods based on Clowder version
@@ -19,6 +19,7 @@ else:
     import pyclowder.api.v1.datasets as datasets
 
 
+@with_default_connector
 def create_empty(connector, host, key, datasetname, description, parentid=None, spaceid=None):
     """Create a new dataset in Clowder.
 
@@ -31,11 +32,12 @@ def create_empty(connector, host, key, datasetname, description, parentid=None,
     parentid -- id of parent collection
     spaceid -- id of the space to add dataset to
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     datasetid = datasets.create_empty(connector, client, datasetname, description, parentid, spaceid)
     return datasetid
 
 
+@with_default_connector
 def delete(connector, host, key, datasetid):
     """Delete dataset from Clowder.
 
@@ -45,14 +47,23 @@ def delete(connector, host, key, datasetid):
     key -- the secret key to login to clowder
     datasetid -- the dataset to delete
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     result = datasets.delete(connector, client, datasetid)
+    connector.invalidate_job_cache(datasetid)
     return result
 
 
-def delete_by_collection(connector, host, key, collectionid, recursive=True, delete_colls=False):
+def delete_by_collection(connector, host, key, collectionid, recursive=True, delete_colls=False, max_workers=4,
+                         rate_limit=None, dry_run=False, checkpoint=None, progress=None):
     """Delete datasets from Clowder by iterating through collection.
 
+    The collections are walked and the datasets are deleted concurrently, see collections.for_each_dataset(). If
+    delete_colls is set and all datasets were deleted, the collections are deleted afterwards, child collections
+    first.
+
+    Returns the statistics of collections.for_each_dataset(), with the ids of the datasets and collections that
+    were deleted, or would be deleted for a dry run, in deleted_datasets and deleted_collections.
+
     Keyword arguments:
     connector -- connector information, used to get missing parameters and send status updates
     host -- the clowder host, including http and port, should end with a /
@@ -60,21 +71,58 @@ def delete_by_collection(connector, host, key, collectionid, recursive=True, del
     collectionid -- the collection to walk
     recursive -- whether to also iterate across child collections
     delete_colls -- whether to also delete collections containing the datasets
+    max_workers -- number of concurrent requests
+    rate_limit -- (optional) maximum number of datasets deleted per second
+    dry_run -- only list the datasets and collections that would be deleted
+    checkpoint -- (optional) file to which the ids of deleted datasets and collections are appended, the ids
+                  already in the file are skipped, so an interrupted delete can be resumed
+    progress -- (optional) function called with the statistics while deleting
     """
-    client = ClowderClient(host=host, key=key)
-    dslist = get_datasets(connector, host, key, collectionid)
-    for ds in dslist:
-        delete(connector, client, ds['id'])
-
-    if recursive:
-        childcolls = get_child_collections(connector, client, collectionid)
-        for coll in childcolls:
-            delete_by_collection(connector, host, key, coll['id'], recursive, delete_colls)
-
-    if delete_colls:
-        delete_collection(connector, client, collectionid)
-
+    logger = logging.getLogger(__name__)
 
+    done = set()
+    if checkpoint and os.path.isfile(checkpoint):
+        with open(checkpoint) as checkpoint_file:
+            done = set(line.strip() for line in checkpoint_file if line.strip())
+    checkpoint_file = open(checkpoint, 'a') if checkpoint and not dry_run else None
+    lock = threading.Lock()
+    deleted_datasets = []
+    collections = []
+
+    def remove(kind, itemid, func):
+        if dry_run:
+            logger.info("dry run, would delete %s %s", kind, itemid)
+        else:
+            func(connector, host, key, itemid)
+        with lock:
+            if checkpoint_file:
+                checkpoint_file.write(itemid + "\n")
+                checkpoint_file.flush()
+            if kind == 'dataset':
+                deleted_datasets.append(itemid)
+
+    try:
+        stats = for_each_dataset(connector, host, key, collectionid,
+                                 lambda ds: remove('dataset', ds['id'], delete),
+                                 recursive=recursive, dataset_filter=lambda ds: ds['id'] not in done,
+                                 max_workers=max_workers, progress=progress, rate_limit=rate_limit,
+                                 on_collection=collections.append)
+        deleted_collections = []
+        if delete_colls and not stats['errors']:
+            for coll in reversed(collections):
+                if coll not in done:
+                    remove('collection', coll, delete_collection)
+                    deleted_collections.append(coll)
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    stats['deleted_datasets'] = deleted_datasets
+    stats['deleted_collections'] = deleted_collections
+    return stats
+
+
+@with_default_connector
 def download(connector, host, key, datasetid):
     """Download dataset to be processed from Clowder as zip file.
 
@@ -84,11 +132,30 @@ def download(connector, host, key, datasetid):
     key -- the secret key to login to clowder
     datasetid -- the file that is currently being processed
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     zipfile = datasets.download(connector, client, datasetid)
     return zipfile
 
 
+@with_default_connector
+def download_and_extract(connector, host, key, datasetid, output_folder):
+    """Download dataset to be processed from Clowder and extract it without storing the zip file.
+
+    Returns the list of extracted files. Raises zipfile.BadZipFile if the zip file can not be extracted while it is
+    being downloaded, in which case download should be used.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the file that is currently being processed
+    output_folder -- folder to extract the contents of the dataset into
+    """
+    client = connector.get_client(host, key)
+    return datasets.download_and_extract(connector, client, datasetid, output_folder)
+
+
+@with_default_connector
 def download_metadata(connector, host, key, datasetid, extractor=None):
     """Download dataset JSON-LD metadata from Clowder.
 
@@ -99,11 +166,12 @@ def download_metadata(connector, host, key, datasetid, extractor=None):
     datasetid -- the dataset to fetch metadata of
     extractor -- extractor name to filter results (if only one extractor's metadata is desired)
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     result_json = datasets.download_metadata(connector, client, datasetid, extractor)
     return result_json
 
 
+@with_default_connector
 def get_info(connector, host, key, datasetid):
     """Get basic dataset information from UUID.
 
@@ -113,11 +181,13 @@ def get_info(connector, host, key, datasetid):
     key -- the secret key to login to clowder
     datasetid -- the dataset to get info of
     """
-    client = ClowderClient(host=host, key=key)
-    info = datasets.get_info(connector, client, datasetid)
+    client = connector.get_client(host, key)
+    info = connector.job_cached('datasets.get_info', client, datasetid,
+                                lambda: datasets.get_info(connector, client, datasetid))
     return info
 
 
+@with_default_connector
 def get_file_list(connector, host, key, datasetid):
     """Get list of files in a dataset as JSON object.
 
@@ -127,11 +197,13 @@ def get_file_list(connector, host, key, datasetid):
     key -- the secret key to login to clowder
     datasetid -- the dataset to get filelist of
     """
-    client = ClowderClient(host=host, key=key)
-    file_list = datasets.get_file_list(connector, client, datasetid)
+    client = connector.get_client(host, key)
+    file_list = connector.job_cached('datasets.get_file_list', client, datasetid,
+                                     lambda: datasets.get_file_list(connector, client, datasetid))
     return file_list
 
 
+@with_default_connector
 def remove_metadata(connector, host, key, datasetid, extractor=None):
     """Delete dataset JSON-LD metadata from Clowder.
 
@@ -143,10 +215,12 @@ def remove_metadata(connector, host, key, datasetid, extractor=None):
     extractor -- extractor name to filter deletion
                     !!! ALL JSON-LD METADATA WILL BE REMOVED IF NO extractor PROVIDED !!!
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     datasets.remove_metadata(connector, client, datasetid, extractor)
+    connector.invalidate_job_cache(datasetid)
 
 
+@with_default_connector
 def submit_extraction(connector, host, key, datasetid, extractorname):
     """Submit dataset for extraction by given extractor.
 
@@ -157,36 +231,39 @@ def submit_extraction(connector, host, key, datasetid, extractorname):
     datasetid -- the dataset UUID to submit
     extractorname -- registered name of extractor to trigger
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     return datasets.submit_extraction(connector, client, datasetid, extractorname)
 
 
-def submit_extractions_by_collection(connector, host, key, collectionid, extractorname, recursive=True):
+def submit_extractions_by_collection(connector, host, key, collectionid, extractorname, recursive=True,
+                                     dataset_filter=None, max_workers=4, progress=None):
     """Manually trigger an extraction on all datasets in a collection.
 
         This will iterate through all datasets in the given collection and submit them to
-        the provided extractor.
+        the provided extractor. The collections are walked and the datasets are submitted
+        concurrently, see collections.for_each_dataset(), and each dataset is submitted once.
+
+        Returns the statistics of collections.for_each_dataset().
 
         Keyword arguments:
         connector -- connector information, used to get missing parameters and send status updates
         host -- the clowder host, including http and port, should end with a /
         key -- the secret key to login to clowder
-        datasetid -- the dataset UUID to submit
+        collectionid -- the collection UUID to submit
         extractorname -- registered name of extractor to trigger
         recursive -- whether to also submit child collection datasets recursively (defaults to True)
+        dataset_filter -- (optional) function called with the dataset information, only datasets for which
+                          it returns True are submitted
+        max_workers -- number of concurrent requests
+        progress -- (optional) function called with the statistics while submitting
     """
-    client = ClowderClient(host=host, key=key)
-    dslist = get_datasets(connector, client, collectionid)
-
-    for ds in dslist:
-        submit_extraction(connector, client, ds['id'], extractorname)
-
-    if recursive:
-        childcolls = get_child_collections(connector, client, collectionid)
-        for coll in childcolls:
-            submit_extractions_by_collection(connector, client, coll['id'], extractorname, recursive)
+    return for_each_dataset(connector, host, key, collectionid,
+                            lambda ds: submit_extraction(connector, host, key, ds['id'], extractorname),
+                            recursive=recursive, dataset_filter=dataset_filter, max_workers=max_workers,
+                            progress=progress)
 
 
+@with_default_connector
 def upload_tags(connector, host, key, datasetid, tags):
     """Upload dataset tag to Clowder.
 
@@ -197,15 +274,17 @@ def upload_tags(connector, host, key, datasetid, tags):
     datasetid -- the dataset that is currently being processed
     tags -- the tags to be uploaded
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     connector.status_update(StatusMessage.processing, {"type": "dataset", "id": datasetid}, "Uploading dataset tags.")
 
     headers = {'Content-Type': 'application/json'}
     url = posixpath.join(client.host, 'api/datasets/%s/tags?key=%s' % (datasetid, client.key))
     result = connector.post(url, headers=headers, data=json.dumps(tags),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
+    connector.invalidate_job_cache(datasetid)
 
 
+@with_default_connector
 def upload_metadata(connector, host, key, datasetid, metadata):
     """Upload dataset JSON-LD metadata to Clowder.
 
@@ -216,10 +295,12 @@ def upload_metadata(connector, host, key, datasetid, metadata):
     datasetid -- the dataset that is currently being processed
     metadata -- the metadata to be uploaded
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     datasets.upload_metadata(connector, client, datasetid, metadata)
+    connector.invalidate_job_cache(datasetid)
 
 
+@with_default_connector
 def upload_preview(connector, host, key, datasetid, previewfile, previewmetadata=None, preview_mimetype=None,
                    visualization_name=None, visualization_description=None, visualization_config_data=None,
                    visualization_component_id=None):
@@ -237,15 +318,17 @@ def upload_preview(connector, host, key, datasetid, previewfile, previewmetadata
                     file itself and this parameter can be ignored. E.g. 'application/vnd.clowder+custom+xml'
     """
 
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     preview_id = datasets.upload_preview(connector, client, datasetid, previewfile, previewmetadata, preview_mimetype,
                                          visualization_name=visualization_name,
                                          visualization_description=visualization_description,
                                          visualization_config_data=visualization_config_data,
                                          visualization_component_id=visualization_component_id)
+    connector.invalidate_job_cache(datasetid)
     return preview_id
 
 
+@with_default_connector
 def upload_thumbnail(connector, host, key, datasetid, thumbnail):
     """Upload thumbnail to Clowder.
 
@@ -258,5 +341,7 @@ def upload_thumbnail(connector, host, key, datasetid, thumbnail):
             """
     logger = logging.getLogger(__name__)
 
-    client = ClowderClient(host=host, key=key)
-    return datasets.upload_thumbnail(connector, client, datasetid, thumbnail)
+    client = connector.get_client(host, key)
+    thumbnail_id = datasets.upload_thumbnail(connector, client, datasetid, thumbnail)
+    connector.invalidate_job_cache(datasetid)
+    return thumbnail_id
@@ -19,10 +19,14 @@ import traceback
 import re
 import time
 
-from pyclowder.connectors import RabbitMQConnector, HPCConnector, LocalConnector
+from pyclowder.cache import DownloadCache
+from pyclowder.connectors import RabbitMQConnector, AsyncRabbitMQConnector, HPCConnector, LocalConnector
 from pyclowder.utils import CheckMessage, setup_logging
 import pyclowder.files
 import pyclowder.datasets
+import pyclowder.metrics
+import pyclowder.profiler
+import pyclowder.tracing
 from functools import reduce
 
 clowder_version = int(os.getenv('CLOWDER_VERSION', '1'))
@@ -79,11 +83,30 @@ class Extractor(object):
             connector_default = "Local"
         max_retry = int(os.getenv('MAX_RETRY', 10))
         heartbeat = int(os.getenv('HEARTBEAT', 5*60))
+        heartbeat_load = os.getenv('HEARTBEAT_LOAD', "False").lower() == "true"
+        reconnect_max_delay = float(os.getenv('RECONNECT_MAX_DELAY', 60))
+        workers = int(os.getenv('WORKERS', 1))
+        http_pool_size = int(os.getenv('HTTP_POOL_SIZE', 10))
+        http_max_retries = int(os.getenv('HTTP_MAX_RETRIES', 3))
+        http_backoff_factor = float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5))
+        parallel_downloads = int(os.getenv('PARALLEL_DOWNLOADS', 4))
+        download_cache = os.getenv('DOWNLOAD_CACHE', "")
+        download_cache_size = int(os.getenv('DOWNLOAD_CACHE_SIZE', 10240))
+        download_segments = int(os.getenv('DOWNLOAD_SEGMENTS', 4))
+        download_chunk_size = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+        status_interval = float(os.getenv('STATUS_INTERVAL', 0))
+        processes = int(os.getenv('PROCESSES', 0))
+        metrics_port = int(os.getenv('METRICS_PORT', 0))
+        trace_file = os.getenv('TRACE_FILE', "")
+        trace_endpoint = os.getenv('TRACE_ENDPOINT', "")
+        profile_dir = os.getenv('PROFILE_DIR', "")
+        profile_threshold = float(os.getenv('PROFILE_THRESHOLD', 60))
+        profile_sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
 
         # create the actual extractor
         self.parser = argparse.ArgumentParser(description=self.extractor_info['description'])
         self.parser.add_argument('--connector', '-c', type=str, nargs='?', default=connector_default,
-                                 choices=["RabbitMQ", "HPC", "Local"],
+                                 choices=["RabbitMQ", "AsyncRabbitMQ", "HPC", "Local"],
                                  help='connector to use (default=RabbitMQ)')
         self.parser.add_argument('--logging', '-l', nargs='?', default=logging_config,
                                  help='file or url or logging coonfiguration (default=None)')
@@ -119,6 +142,69 @@ class Extractor(object):
                                  help='Maximum number of retries if an error happens in the extractor (default=%d)' % max_retry)
         self.parser.add_argument('--heartbeat', dest='heartbeat', default=heartbeat,
                                  help='Time in seconds between extractor heartbeats (default=%d)' % heartbeat)
+        self.parser.add_argument('--heartbeat-load', dest='heartbeat_load', action='store_true',
+                                 default=heartbeat_load,
+                                 help='Add the current load of the extractor (active messages, messages processed, '
+                                      'load average) to the heartbeats')
+        self.parser.add_argument('--reconnect-max-delay', dest='reconnect_max_delay', type=float,
+                                 default=reconnect_max_delay,
+                                 help='Maximum number of seconds to wait before reconnecting to RabbitMQ when the '
+                                      'connection is lost, 0 exits instead (default=%s)' % reconnect_max_delay)
+        self.parser.add_argument('--workers', dest='workers', type=int, default=workers,
+                                 help='Number of messages processed concurrently, process_message needs to be '
+                                      'thread safe if this is more than 1 (default=%d)' % workers)
+        self.parser.add_argument('--http-pool-size', dest='http_pool_size', type=int, default=http_pool_size,
+                                 help='Number of connections to clowder kept open (default=%d)' % http_pool_size)
+        self.parser.add_argument('--http-max-retries', dest='http_max_retries', type=int, default=http_max_retries,
+                                 help='Number of retries of failed connections to clowder (default=%d)'
+                                      % http_max_retries)
+        self.parser.add_argument('--http-backoff-factor', dest='http_backoff_factor', type=float,
+                                 default=http_backoff_factor,
+                                 help='Backoff factor in seconds between retries to clowder (default=%s)'
+                                      % http_backoff_factor)
+        self.parser.add_argument('--parallel-downloads', dest='parallel_downloads', type=int,
+                                 default=parallel_downloads,
+                                 help='Number of dataset files downloaded at the same time, limited by the '
+                                      'http pool size (default=%d)' % parallel_downloads)
+        self.parser.add_argument('--download-cache', dest='download_cache', default=download_cache,
+                                 help='Folder to cache downloaded files in, can be shared by extractors on the '
+                                      'same host (default is no cache)')
+        self.parser.add_argument('--download-cache-size', dest='download_cache_size', type=int,
+                                 default=download_cache_size,
+                                 help='Maximum size in MB of the download cache (default=%d)' % download_cache_size)
+        self.parser.add_argument('--download-segments', dest='download_segments', type=int,
+                                 default=download_segments,
+                                 help='Number of concurrent range requests used to download large files '
+                                      '(default=%d)' % download_segments)
+        self.parser.add_argument('--download-chunk-size', dest='download_chunk_size', type=int,
+                                 default=download_chunk_size,
+                                 help='Number of bytes read at a time when downloading files '
+                                      '(default=%d)' % download_chunk_size)
+        self.parser.add_argument('--status-interval', dest='status_interval', type=float,
+                                 default=status_interval,
+                                 help='Minimum number of seconds between PROCESSING status updates send to '
+                                      'clowder, 0 sends all updates (default=%s)' % status_interval)
+        self.parser.add_argument('--processes', dest='processes', type=int, default=processes,
+                                 help='Number of worker processes used to process messages, 0 processes the '
+                                      'messages in threads of the connector (default=%d)' % processes)
+        self.parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=metrics_port,
+                                 help='Port to publish metrics in the Prometheus format on /metrics, 0 does not '
+                                      'publish metrics (default=%d)' % metrics_port)
+        self.parser.add_argument('--trace-file', dest='trace_file', default=trace_file,
+                                 help='File to which the tracing spans of each message are appended as JSON lines')
+        self.parser.add_argument('--trace-endpoint', dest='trace_endpoint', default=trace_endpoint,
+                                 help='OTLP/HTTP endpoint to which the tracing spans of each message are send, '
+                                      'for example http://localhost:4318')
+        self.parser.add_argument('--profile-dir', dest='profile_dir', default=profile_dir,
+                                 help='Folder to write profiles of slow or sampled messages to, as collapsed stacks')
+        self.parser.add_argument('--profile-threshold', dest='profile_threshold', type=float,
+                                 default=profile_threshold,
+                                 help='Write the profile of messages that take at least this many seconds '
+                                      '(default=%s)' % profile_threshold)
+        self.parser.add_argument('--profile-sample-rate', dest='profile_sample_rate', type=float,
+                                 default=profile_sample_rate,
+                                 help='Fraction of the other messages of which the profile is written '
+                                      '(default=%s)' % profile_sample_rate)
 
     def setup(self):
         """Parse command line arguments and so some setup
@@ -149,7 +235,25 @@ class Extractor(object):
         logger = logging.getLogger(__name__)
         connector = None
 
-        if self.args.connector == "RabbitMQ":
+        download_cache = None
+        if self.args.download_cache:
+            download_cache = DownloadCache(self.args.download_cache, self.args.download_cache_size * 1024 * 1024)
+
+        if self.args.metrics_port:
+            pyclowder.metrics.start_http_server(self.args.metrics_port)
+
+        if self.args.trace_endpoint:
+            pyclowder.tracing.configure(pyclowder.tracing.OtlpExporter(self.args.trace_endpoint,
+                                                                       service_name=self.extractor_info['name']))
+        elif self.args.trace_file:
+            pyclowder.tracing.configure(pyclowder.tracing.JsonlExporter(self.args.trace_file))
+
+        if self.args.profile_dir:
+            pyclowder.profiler.configure(pyclowder.profiler.Profiler(self.args.profile_dir,
+                                                                     threshold=self.args.profile_threshold,
+                                                                     sample_rate=self.args.profile_sample_rate))
+
+        if self.args.connector in ("RabbitMQ", "AsyncRabbitMQ"):
             if 'rabbitmq_uri' not in self.args:
                 logger.error("Missing URI for RabbitMQ")
             else:
@@ -167,21 +271,37 @@ class Extractor(object):
                                 else:
                                     rabbitmq_key.append("*.%s.%s" % (key, mt.replace("/", ".")))
 
-                connector = RabbitMQConnector(self.args.rabbitmq_queuename,
-                                              self.extractor_info,
-                                              check_message=self.check_message,
-                                              process_message=self.process_message,
-                                              rabbitmq_uri=self.args.rabbitmq_uri,
-                                              rabbitmq_key=rabbitmq_key,
-                                              rabbitmq_queue=self.args.rabbitmq_queuename,
-                                              mounted_paths=json.loads(self.args.mounted_paths),
-                                              clowder_url=self.args.clowder_url,
-                                              max_retry=self.args.max_retry,
-                                              heartbeat=self.args.heartbeat,
-                                              extractor_key=self.args.extractor_key,
-                                              clowder_email=self.args.clowder_email)
+                if self.args.connector == "AsyncRabbitMQ":
+                    connector_class = AsyncRabbitMQConnector
+                else:
+                    connector_class = RabbitMQConnector
+                connector = connector_class(self.args.rabbitmq_queuename,
+                                            self.extractor_info,
+                                            check_message=self.check_message,
+                                            process_message=self.process_message,
+                                            rabbitmq_uri=self.args.rabbitmq_uri,
+                                            rabbitmq_key=rabbitmq_key,
+                                            rabbitmq_queue=self.args.rabbitmq_queuename,
+                                            mounted_paths=json.loads(self.args.mounted_paths),
+                                            clowder_url=self.args.clowder_url,
+                                            max_retry=self.args.max_retry,
+                                            heartbeat=self.args.heartbeat,
+                                            extractor_key=self.args.extractor_key,
+                                            clowder_email=self.args.clowder_email,
+                                            workers=self.args.workers,
+                                            http_pool_size=max(self.args.http_pool_size, self.args.workers),
+                                            http_max_retries=self.args.http_max_retries,
+                                            http_backoff_factor=self.args.http_backoff_factor,
+                                            parallel_downloads=self.args.parallel_downloads,
+                                            download_cache=download_cache,
+                                            download_segments=self.args.download_segments,
+                                            download_chunk_size=self.args.download_chunk_size,
+                                            status_interval=self.args.status_interval,
+                                            processes=self.args.processes,
+                                            heartbeat_load=self.args.heartbeat_load,
+                                            reconnect_max_delay=self.args.reconnect_max_delay)
                 connector.connect()
-                threading.Thread(target=connector.listen, name="RabbitMQConnector").start()
+                threading.Thread(target=connector.listen, name=connector_class.__name__).start()
 
         elif self.args.connector == "HPC":
             if 'hpc_picklefile' not in self.args:
@@ -193,7 +313,11 @@ class Extractor(object):
                                          process_message=self.process_message,
                                          picklefile=self.args.hpc_picklefile,
                                          mounted_paths=json.loads(self.args.mounted_paths),
-                                         max_retry=self.args.max_retry)
+                                         max_retry=self.args.max_retry,
+                                         parallel_downloads=self.args.parallel_downloads,
+                                         download_cache=download_cache,
+                                         download_segments=self.args.download_segments,
+                                         download_chunk_size=self.args.download_chunk_size)
                 threading.Thread(target=connector.listen, name="HPCConnector").start()
 
         elif self.args.connector == "Local":
@@ -434,9 +558,7 @@ class SimpleExtractor(Extractor):
             if 'outputs' in result.keys():
                 self.logger.debug("upload output files")
                 if type == 'file' or type == 'dataset':
-                    for output in result['outputs']:
-                        if os.path.exists(str(output)):
-                            pyclowder.files.upload_to_dataset(connector, host, secret_key, dataset_id, str(output))
+                    self._upload_outputs(connector, host, secret_key, dataset_id, result['outputs'])
                 else:
                     self.logger.error("unable to upload outputs to resource type: %s" % type)
 
@@ -459,10 +581,7 @@ class SimpleExtractor(Extractor):
 
                         if 'outputs' in nds.keys():
                             self.logger.debug("upload output files to new dataset")
-                            for output in nds['outputs']:
-                                if os.path.exists(str(output)):
-                                    pyclowder.files.upload_to_dataset(connector, host, secret_key, new_dataset_id,
-                                                                      str(output))
+                            self._upload_outputs(connector, host, secret_key, new_dataset_id, nds['outputs'])
 
                         if 'previews' in nds.keys():
                             # TODO: Add Clowder endpoint (& pyclowder method) to attach previews to datasets
@@ -471,6 +590,19 @@ class SimpleExtractor(Extractor):
         finally:
             self.cleanup_data(result)
 
+    def _upload_outputs(self, connector, host, secret_key, dataset_id, outputs):
+        """Upload the output files that exist to the dataset.
+
+        Once all files are uploaded, every failed upload is logged and the first error is raised.
+        """
+        outputs = [str(output) for output in outputs if os.path.exists(str(output))]
+        results = pyclowder.files.upload_many_to_dataset(connector, host, secret_key, dataset_id, outputs)
+        errors = [(output, result) for (output, result) in results.items() if isinstance(result, Exception)]
+        for (output, error) in errors:
+            self.logger.error("unable to upload output %s: %s", output, error)
+        if errors:
+            raise errors[0][1]
+
     def process_file(self, input_file):
         """
         This function will process the file and return a dict that contains the result. This
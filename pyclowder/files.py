@@ -8,11 +8,12 @@ import logging
 import os
 import posixpath
 import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
+from concurrent.futures import ThreadPoolExecutor
 
-from pyclowder.client import ClowderClient
-from pyclowder.collections import get_datasets, get_child_collections
+from pyclowder.collections import for_each_dataset
 from pyclowder.datasets import get_file_list
+from pyclowder.utils import upload_file, with_default_connector
+import pyclowder.tracing
 
 clowder_version = int(os.getenv('CLOWDER_VERSION', '1'))
 # Import files API methods based on Clowder version
@@ -31,13 +32,15 @@ except:
     pass
 
 
+@with_default_connector
 def get_download_url(connector, host, key, fileid, intermediatefileid=None, ext=""):
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     download_url = files.get_download_url(connector, client, fileid, intermediatefileid, ext)
     return download_url
 
 
 # pylint: disable=too-many-arguments
+@with_default_connector
 def download(connector, host, key, fileid, intermediatefileid=None, ext="", tracking=True):
     """Download file to be processed from Clowder.
 
@@ -50,11 +53,12 @@ def download(connector, host, key, fileid, intermediatefileid=None, ext="", trac
     ext -- the file extension, the downloaded file will end with this extension
     tracking -- should the download action be tracked
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     inputfilename = files.download(connector, client, fileid, intermediatefileid, ext)
     return inputfilename
 
 
+@with_default_connector
 def download_info(connector, host, key, fileid):
     """Download file summary metadata from Clowder.
 
@@ -64,11 +68,12 @@ def download_info(connector, host, key, fileid):
     key -- the secret key to login to clowder
     fileid -- the file to fetch metadata of
     """
-    client = ClowderClient(host=host, key=key)
-    result = files.download_info(connector, client, fileid)
-    return result.json()
+    client = connector.get_client(host, key)
+    return connector.job_cached('files.download_info', client, fileid,
+                                lambda: files.download_info(connector, client, fileid).json())
 
 
+@with_default_connector
 def download_summary(connector, host, key, fileid):
     """Download file summary metadata from Clowder.
 
@@ -78,11 +83,12 @@ def download_summary(connector, host, key, fileid):
     key -- the secret key to login to clowder
     fileid -- the file to fetch metadata of
     """
-    client = ClowderClient(host=host, key=key)
-    result = files.download_summary(connector, client, fileid)
-    return result.json()
+    client = connector.get_client(host, key)
+    return connector.job_cached('files.download_summary', client, fileid,
+                                lambda: files.download_summary(connector, client, fileid).json())
 
 
+@with_default_connector
 def download_metadata(connector, host, key, fileid, extractor=None):
     """Download file JSON-LD metadata from Clowder.
 
@@ -93,11 +99,12 @@ def download_metadata(connector, host, key, fileid, extractor=None):
     fileid -- the file to fetch metadata of
     extractor -- extractor name to filter results (if only one extractor's metadata is desired)
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     result = files.download_metadata(connector, client, fileid, extractor)
     return result.json()
 
 
+@with_default_connector
 def delete(connector, host, key, fileid):
     """Delete file from Clowder.
 
@@ -107,10 +114,13 @@ def delete(connector, host, key, fileid):
         key -- the secret key to login to clowder
         fileid -- the file to delete
         """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     result = files.delete(connector, client, fileid)
+    # the file is also removed from the file list of its dataset
+    connector.invalidate_job_cache()
     return result
 
+@with_default_connector
 def submit_extraction(connector, host, key, fileid, extractorname):
     """Submit file for extraction by given extractor.
 
@@ -121,7 +131,7 @@ def submit_extraction(connector, host, key, fileid, extractorname):
     fileid -- the file UUID to submit
     extractorname -- registered name of extractor to trigger
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     result = files.submit_extraction(connector, client, fileid, extractorname)
     return result.json()
 
@@ -140,8 +150,7 @@ def submit_extractions_by_dataset(connector, host, key, datasetid, extractorname
         extractorname -- registered name of extractor to trigger
         ext -- extension to filter. e.g. 'tif' will only submit TIFF files for extraction.
     """
-    client = ClowderClient(host=host, key=key)
-    filelist = get_file_list(connector, client, datasetid)
+    filelist = get_file_list(connector, host, key, datasetid)
 
     for f in filelist:
         # Only submit files that end with given extension, if specified
@@ -151,11 +160,15 @@ def submit_extractions_by_dataset(connector, host, key, datasetid, extractorname
         submit_extraction(connector, host, key, f['id'], extractorname)
 
 
-def submit_extractions_by_collection(connector, host, key, collectionid, extractorname, ext=False, recursive=True):
+def submit_extractions_by_collection(connector, host, key, collectionid, extractorname, ext=False, recursive=True,
+                                     dataset_filter=None, max_workers=4, progress=None):
     """Manually trigger an extraction on all files in a collection.
 
         This will iterate through all datasets in the given collection and submit them to
-        the submit_extractions_by_dataset(). Does not operate recursively if there are nested collections.
+        the submit_extractions_by_dataset(). The collections are walked and the datasets are
+        submitted concurrently, see collections.for_each_dataset(), and each dataset is submitted once.
+
+        Returns the statistics of collections.for_each_dataset().
 
         Keyword arguments:
         connector -- connector information, used to get missing parameters and send status updates
@@ -165,19 +178,19 @@ def submit_extractions_by_collection(connector, host, key, collectionid, extract
         extractorname -- registered name of extractor to trigger
         ext -- extension to filter. e.g. 'tif' will only submit TIFF files for extraction
         recursive -- whether to also submit child collection files recursively (defaults to True)
+        dataset_filter -- (optional) function called with the dataset information, only datasets for which
+                          it returns True are submitted
+        max_workers -- number of concurrent requests
+        progress -- (optional) function called with the statistics while submitting
     """
-
-    dslist = get_datasets(connector, host, key, collectionid)
-
-    for ds in dslist:
-        submit_extractions_by_dataset(connector, host, key, ds['id'], extractorname, ext)
-
-    if recursive:
-        childcolls = get_child_collections(connector, host, key, collectionid)
-        for coll in childcolls:
-            submit_extractions_by_collection(connector, host, key, coll['id'], extractorname, ext, recursive)
+    return for_each_dataset(connector, host, key, collectionid,
+                            lambda ds: submit_extractions_by_dataset(connector, host, key, ds['id'], extractorname,
+                                                                     ext),
+                            recursive=recursive, dataset_filter=dataset_filter, max_workers=max_workers,
+                            progress=progress)
 
 
+@with_default_connector
 def upload_metadata(connector, host, key, fileid, metadata):
     """Upload file JSON-LD metadata to Clowder.
 
@@ -188,11 +201,13 @@ def upload_metadata(connector, host, key, fileid, metadata):
     fileid -- the file that is currently being processed
     metadata -- the metadata to be uploaded
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     files.upload_metadata(connector, client, fileid, metadata)
+    connector.invalidate_job_cache(fileid)
 
 
 # pylint: disable=too-many-arguments
+@with_default_connector
 def upload_preview(connector, host, key, fileid, previewfile, previewmetadata=None, preview_mimetype=None,
                    visualization_name=None, visualization_description=None, visualization_config_data=None,
                    visualization_component_id=None):
@@ -210,15 +225,17 @@ def upload_preview(connector, host, key, fileid, previewfile, previewmetadata=No
                     file itself and this parameter can be ignored. E.g. 'application/vnd.clowder+custom+xml'
     """
 
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     preview_id = files.upload_preview(connector, client, fileid, previewfile, previewmetadata, preview_mimetype,
                                       visualization_name=visualization_name,
                                       visualization_description=visualization_description,
                                       visualization_config_data=visualization_config_data,
                                       visualization_component_id=visualization_component_id)
+    connector.invalidate_job_cache(fileid)
     return preview_id
 
 
+@with_default_connector
 def upload_tags(connector, host, key, fileid, tags):
     """Upload file tag to Clowder.
 
@@ -229,15 +246,17 @@ def upload_tags(connector, host, key, fileid, tags):
     fileid -- the file that is currently being processed
     tags -- the tags to be uploaded
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     connector.message_process({"type": "file", "id": fileid}, "Uploading file tags.")
 
     headers = {'Content-Type': 'application/json'}
     url = posixpath.join(client.host, 'api/files/%s/tags?key=%s' % (fileid, client.key))
     result = connector.post(url, headers=headers, data=json.dumps(tags),
-                            verify=connector.ssl_verify if connector else True)
+                            verify=connector.ssl_verify)
+    connector.invalidate_job_cache(fileid)
 
 
+@with_default_connector
 def upload_thumbnail(connector, host, key, fileid, thumbnail):
     """Upload thumbnail to Clowder.
 
@@ -249,11 +268,13 @@ def upload_thumbnail(connector, host, key, fileid, thumbnail):
     thumbnail -- the file containing the thumbnail
     """
     
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     thumbnail_id = files.upload_thumbnail(connector, client, fileid, thumbnail)
+    connector.invalidate_job_cache(fileid)
     return thumbnail_id
 
 
+@with_default_connector
 def upload_to_dataset(connector, host, key, datasetid, filepath, check_duplicate=False, folder_id=None):
     """Upload file to existing Clowder dataset.
 
@@ -266,14 +287,16 @@ def upload_to_dataset(connector, host, key, datasetid, filepath, check_duplicate
     check_duplicate -- check if filename already exists in dataset and skip upload if so
     folder_id -- the folder that the file should be associated with
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     if clowder_version == 2:
-        return files.upload_to_dataset(connector, client, datasetid, filepath, check_duplicate, folder_id)
+        uploadedfileid = files.upload_to_dataset(connector, client, datasetid, filepath, check_duplicate, folder_id)
+        connector.invalidate_job_cache(datasetid)
+        return uploadedfileid
     else:
         logger = logging.getLogger(__name__)
 
         if check_duplicate:
-            ds_files = get_file_list(connector, client, datasetid)
+            ds_files = get_file_list(connector, host, key, datasetid)
             for f in ds_files:
                 if f['filename'] == os.path.basename(filepath):
                     logger.debug("found %s in dataset %s; not re-uploading" % (f['filename'], datasetid))
@@ -286,21 +309,75 @@ def upload_to_dataset(connector, host, key, datasetid, filepath, check_duplicate
         url = posixpath.join(client.host, 'api/uploadToDataset/%s?key=%s' % (datasetid, client.key))
 
         if os.path.exists(filepath):
-            filename = os.path.basename(filepath)
-            m = MultipartEncoder(
-                fields={'file': (filename, open(filepath, 'rb'))}
-            )
-            result = connector.post(url, data=m, headers={'Content-Type': m.content_type},
-                                    verify=connector.ssl_verify if connector else True)
+            result = upload_file(connector, url, filepath)
 
             uploadedfileid = result.json()['id']
             logger.debug("uploaded file id = [%s]", uploadedfileid)
+            connector.invalidate_job_cache(datasetid)
 
             return uploadedfileid
         else:
             logger.error("unable to upload file %s (not found)", filepath)
 
 
+def upload_many_to_dataset(connector, host, key, datasetid, filepaths, check_duplicate=False, folder_id=None,
+                           max_workers=4):
+    """Upload many files to existing Clowder dataset, using multiple uploads at the same time.
+
+    Returns a dict that maps every path to the id of the uploaded file, None if the file was not uploaded because a
+    file with the same name is already in the dataset, or the exception raised while uploading the file. A path that
+    is in filepaths more than once is uploaded once.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    datasetid -- the dataset that the files should be associated with
+    filepaths -- list of paths of files to upload
+    check_duplicate -- skip files of which the filename already exists in dataset, or earlier in filepaths
+    folder_id -- the folder that the files should be associated with
+    max_workers -- maximum number of files uploaded at the same time, limited by the connection pool of the connector
+    """
+    logger = logging.getLogger(__name__)
+    results = dict()
+
+    existing = set()
+    if check_duplicate:
+        for f in get_file_list(connector, host, key, datasetid):
+            existing.add(f.get('filename', f.get('name')))
+
+    uploads = []
+    seen = set()
+    for filepath in filepaths:
+        filename = os.path.basename(filepath)
+        if filepath in seen:
+            continue
+        seen.add(filepath)
+        if check_duplicate and filename in existing:
+            logger.debug("found %s in dataset %s; not re-uploading" % (filename, datasetid))
+            results[filepath] = None
+        elif not os.path.isfile(filepath):
+            results[filepath] = IOError("unable to upload file %s (not found)" % filepath)
+        else:
+            existing.add(filename)
+            uploads.append(filepath)
+
+    max_workers = max(1, min(max_workers, getattr(connector, 'http_pool_size', max_workers)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        upload = pyclowder.tracing.wrap(upload_to_dataset)
+        futures = [(filepath, executor.submit(upload, connector, host, key, datasetid, filepath, folder_id=folder_id))
+                   for filepath in uploads]
+        for (filepath, future) in futures:
+            try:
+                results[filepath] = future.result()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.exception("unable to upload file %s", filepath)
+                results[filepath] = exc
+
+    return results
+
+
+@with_default_connector
 def _upload_to_dataset_local(connector, host, key, datasetid, filepath):
     """Upload file POINTER to existing Clowder dataset. Does not copy actual file bytes.
 
@@ -311,6 +388,7 @@ def _upload_to_dataset_local(connector, host, key, datasetid, filepath):
     datasetid -- the dataset that the file should be associated with
     filepath -- path to file
     """
-    client = ClowderClient(host=host, key=key)
+    client = connector.get_client(host, key)
     uploadedfileid = files._upload_to_dataset_local(connector, client, datasetid, filepath)
+    connector.invalidate_job_cache(datasetid)
     return uploadedfileid
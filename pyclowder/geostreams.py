@@ -3,12 +3,161 @@
 This module provides simple wrappers around the clowder Geostreams API
 """
 
+import contextlib
 import json
 import logging
+import math
+import os
 import posixpath
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import requests
 
+from pyclowder.utils import default_connector, with_default_connector
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class GeostreamsIndex(object):
+    """Index of sensors and streams by name.
 
+    Sensors and streams found by get_sensor_by_name and get_stream_by_name are kept for ttl seconds, so they are not
+    requested from Geostreams for every lookup. Names that are not found are not kept, and create_sensor and
+    create_stream remove the name from the index. If filename is given the index is also stored on disk, and can be
+    shared by multiple extractors on the same host: the file is read again when it was changed by another process,
+    and changes are merged into the file while holding a lock on filename.lock.
+    """
+
+    def __init__(self, ttl=300, filename=None):
+        """
+        Create an empty index, or load it from filename.
+
+        :param float ttl: seconds a sensor or stream is kept in the index, 0 disables the index
+        :param string filename: (optional) json file to store the index
+        """
+        self.ttl = float(ttl)
+        self.filename = filename
+        self.entries = dict()
+        self.stat = None
+        self.lock = threading.Lock()
+        with self.lock:
+            self._reload()
+
+    @staticmethod
+    def _key(kind, host, name):
+        return kind, host.rstrip('/'), str(name)
+
+    def get(self, kind, host, name):
+        """Return the sensor or stream with the given name, or None if it is not in the index or has expired."""
+        if self.ttl <= 0:
+            return None
+        key = self._key(kind, host, name)
+        with self.lock:
+            self._reload()
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.time():
+                return None
+            return entry[1]
+
+    def put(self, kind, host, name, value):
+        """Add the sensor or stream with the given name to the index."""
+        if self.ttl <= 0 or value is None:
+            return
+        key = self._key(kind, host, name)
+
+        def change(entries):
+            entry = entries.get(key)
+            if entry is not None and entry[1] == value and entry[0] >= time.time():
+                # already added by another process
+                return False
+            entries[key] = [time.time() + self.ttl, value]
+            return True
+
+        self._update(change)
+
+    def invalidate(self, kind=None, host=None, name=None):
+        """Remove sensors and/or streams from the index, all arguments that are None match any value."""
+        def change(entries):
+            keys = [key for key in entries
+                    if (kind is None or key[0] == kind) and (host is None or key[1] == host.rstrip('/')) and
+                    (name is None or key[2] == str(name))]
+            for key in keys:
+                del entries[key]
+            return len(keys) > 0
+
+        self._update(change)
+
+    def _update(self, change):
+        """Apply change to the entries, and to the file if the entries changed, change returns True if it did."""
+        with self.lock:
+            if not self.filename:
+                change(self.entries)
+                return
+            with self._file_lock():
+                # merge with the changes of other processes
+                self.stat = None
+                self._reload()
+                if change(self.entries):
+                    self._save()
+
+    def _reload(self):
+        """Read the entries from disk if the file was replaced since it was last read."""
+        if not self.filename:
+            return
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return
+        stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stat == self.stat:
+            return
+        try:
+            with open(self.filename) as index_file:
+                self.entries = {tuple(k.split('|', 2)): v for (k, v) in json.load(index_file).items()}
+            self.stat = stat
+        except (OSError, ValueError):
+            logging.getLogger(__name__).warning("could not load geostreams index from %s", self.filename)
+
+    def _save(self):
+        now = time.time()
+        self.entries = {k: v for (k, v) in self.entries.items() if v[0] >= now}
+        data = {'|'.join(k): v for (k, v) in self.entries.items()}
+        try:
+            (fd, tmp_filename) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filename)))
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump(data, index_file)
+            os.replace(tmp_filename, self.filename)
+            stat = os.stat(self.filename)
+            self.stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            logging.getLogger(__name__).warning("could not save geostreams index to %s", self.filename)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Lock the file of the index for all processes."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.filename + '.lock', 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+# index of sensors and streams used by get_sensor_by_name and get_stream_by_name
+index = GeostreamsIndex(ttl=float(os.getenv('GEOSTREAMS_CACHE_TTL', 300)),
+                        filename=os.getenv('GEOSTREAMS_CACHE_FILE'))
+
+
+@with_default_connector
 def create_sensor(connector, host, key, sensorname, geom, type, region):
     """Create a new sensor in Geostreams.
 
@@ -38,9 +187,10 @@ def create_sensor(connector, host, key, sensorname, geom, type, region):
 
     url = posixpath.join(host, "api/geostreams/sensors?key=%s" % key)
 
-    result = requests.post(url, headers={'Content-type': 'application/json'},
-                           data=json.dumps(body),
-                           verify=connector.ssl_verify if connector else True)
+    index.invalidate('sensor', host, sensorname)
+    result = connector.post(url, headers={'Content-type': 'application/json'},
+                            data=json.dumps(body),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
 
     sensorid = result.json()['id']
@@ -49,6 +199,7 @@ def create_sensor(connector, host, key, sensorname, geom, type, region):
     return sensorid
 
 
+@with_default_connector
 def create_stream(connector, host, key, streamname, sensorid, geom, properties=None):
     """Create a new stream in Geostreams.
 
@@ -77,9 +228,10 @@ def create_stream(connector, host, key, streamname, sensorid, geom, properties=N
 
     url = posixpath.join(host, "api/geostreams/streams?key=%s" % key)
 
-    result = requests.post(url, headers={'Content-type': 'application/json'},
-                           data=json.dumps(body),
-                           verify=connector.ssl_verify if connector else True)
+    index.invalidate('stream', host, streamname)
+    result = connector.post(url, headers={'Content-type': 'application/json'},
+                            data=json.dumps(body),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
 
     streamid = result.json()['id']
@@ -88,6 +240,7 @@ def create_stream(connector, host, key, streamname, sensorid, geom, properties=N
     return streamid
 
 
+@with_default_connector
 def create_datapoint(connector, host, key, streamid, geom, starttime, endtime, properties=None):
     """Create a new datapoint in Geostreams.
 
@@ -104,32 +257,295 @@ def create_datapoint(connector, host, key, streamid, geom, starttime, endtime, p
 
     logger = logging.getLogger(__name__)
 
-    if not properties:
-        properties = {}
+    body = _datapoint_body(streamid, geom, starttime, endtime, properties)
 
-    body = {
+    url = posixpath.join(host, 'api/geostreams/datapoints?key=%s' % key)
+
+    result = connector.post(url, headers={'Content-type': 'application/json'},
+                            data=json.dumps(body),
+                            verify=connector.ssl_verify)
+    result.raise_for_status()
+
+    dpid = result.json()['id']
+    logger.debug("datapoint id = [%s]", dpid)
+
+    return dpid
+
+
+def _datapoint_body(streamid, geom, starttime, endtime, properties=None):
+    """Return the JSON body of a datapoint, as it is send to Geostreams."""
+    return {
         "start_time": starttime,
         "end_time": endtime,
         "type": "Point",
         "geometry": geom,
-        "properties": properties,
+        "properties": properties or {},
         "stream_id": str(streamid)
     }
 
-    url = posixpath.join(host, 'api/geostreams/datapoints?key=%s' % key)
 
-    result = requests.post(url, headers={'Content-type': 'application/json'},
-                           data=json.dumps(body),
-                           verify=connector.ssl_verify if connector else True)
-    result.raise_for_status()
+class DatapointBatcher(object):
+    """Create many datapoints in Geostreams using bulk requests.
 
-    dpid = result.json()['id']
-    logger.debug("datapoint id = [%s]", dpid)
+    Datapoints are buffered per stream and send to the bulk endpoint of Geostreams when batch_size datapoints of a
+    stream are buffered, or by a background thread when the oldest datapoint of a stream is buffered for
+    flush_interval seconds. Batches are send by max_workers threads, add() blocks once max_pending batches are waiting
+    to be send. If the server has no bulk endpoint, the datapoints are created using concurrent single requests
+    instead.
 
-    return dpid
+    Failed requests are retried up to max_retries times. If a bulk request keeps failing, the datapoints of the
+    batch are created using concurrent single requests, so only the datapoints that can not be created end up in
+    failed. After bulk_max_client_errors bulk requests in a row are rejected by the server, the bulk endpoint is no
+    longer used.
+
+    Example:
 
+        with DatapointBatcher(connector, host, key) as batcher:
+            for (time, value) in readings:
+                batcher.add(streamid, geom, time, time, {"value": value})
+        logger.info("created %(created)d datapoints (%(rate).1f/s)", batcher.stats())
+    """
 
-def get_sensor_by_name(connector, host, key, sensorname):
+    # responses of the bulk endpoint that mean it is not available on the server
+    bulk_unsupported = [404, 405, 501]
+
+    # number of bulk requests in a row with a 4xx response after which the bulk endpoint is no longer used
+    bulk_max_client_errors = 3
+
+    def __init__(self, connector, host, key, batch_size=1000, flush_interval=10, max_workers=4, max_pending=None,
+                 max_retries=3, backoff_factor=0.5, bulk=True):
+        """Create a batcher, all datapoints are send to host.
+
+        Keyword arguments:
+        connector -- connector information, used to make the requests
+        host -- the clowder host, including http and port, should end with a /
+        key -- the secret key to login to clowder
+        batch_size -- maximum number of datapoints per bulk request
+        flush_interval -- seconds after which the datapoints of a stream are send, even if less than batch_size
+                          datapoints are buffered, 0 disables this
+        max_workers -- number of threads sending requests
+        max_pending -- number of batches waiting to be send before add() blocks, defaults to 2 * max_workers
+        max_retries -- number of times a failed request is retried
+        backoff_factor -- seconds to wait before the first retry, doubled for each next retry
+        bulk -- use the bulk endpoint, set to False to always create datapoints one at a time
+        """
+        self.connector = default_connector(connector)
+        self.host = host
+        self.key = key
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = int(max_pending) if max_pending else 2 * self.max_workers
+        self.max_retries = int(max_retries)
+        self.backoff_factor = float(backoff_factor)
+        self.bulk = bulk
+        self.bulk_client_errors = 0
+
+        self.buffers = dict()
+        self.buffer_started = dict()
+        self.buffer_lock = threading.RLock()
+        self.futures = set()
+        self.futures_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.lock = threading.Lock()
+        self.failed = []
+        self.submitted = 0
+        self.created = 0
+        self.requests = 0
+        self.started = time.time()
+        self.finished = None
+
+        self.closing = threading.Event()
+        self.flusher = None
+        if self.flush_interval > 0:
+            self.flusher = threading.Thread(target=self._flush_expired, name="DatapointBatcher")
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, streamid, geom, starttime, endtime, properties=None):
+        """Add a datapoint, using the same arguments as create_datapoint.
+
+        Keyword arguments:
+        streamid -- id of stream to attach datapoint to
+        geom -- GeoJSON object of sensor geometry
+        starttime -- start time, in format 2017-01-25T09:33:02-06:00
+        endtime -- end time, in format 2017-01-25T09:33:02-06:00
+        properties -- JSON object with any desired properties
+        """
+        streamid = str(streamid)
+        body = _datapoint_body(streamid, geom, starttime, endtime, properties)
+        with self.buffer_lock:
+            buffer = self.buffers.setdefault(streamid, [])
+            if not buffer:
+                self.buffer_started[streamid] = time.time()
+            buffer.append(body)
+            with self.lock:
+                self.submitted += 1
+            if len(buffer) >= self.batch_size:
+                self._send(streamid)
+
+    def flush(self):
+        """Send all buffered datapoints, and wait for all requests to finish."""
+        with self.buffer_lock:
+            for streamid in list(self.buffers):
+                self._send(streamid)
+        # a failed bulk request submits the single requests of its datapoints, wait for these as well
+        while True:
+            with self.futures_lock:
+                futures = list(self.futures)
+            if not futures:
+                return
+            wait(futures)
+
+    def close(self):
+        """Send all buffered datapoints and stop the threads sending requests."""
+        self.closing.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        self.flush()
+        self.executor.shutdown()
+        self.finished = time.time()
+        logger = logging.getLogger(__name__)
+        stats = self.stats()
+        logger.info("created %d of %d datapoints in %d requests, %.1f datapoints/s",
+                    stats['created'], stats['submitted'], stats['requests'], stats['rate'])
+
+    def stats(self):
+        """Return the number of datapoints submitted, created and failed, and the datapoints created per second."""
+        with self.lock:
+            elapsed = (self.finished or time.time()) - self.started
+            return {
+                'submitted': self.submitted,
+                'created': self.created,
+                'failed': len(self.failed),
+                'requests': self.requests,
+                'seconds': elapsed,
+                'rate': self.created / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def _flush_expired(self):
+        """Send the datapoints of the streams that are buffered for flush_interval seconds, runs in its own thread."""
+        while True:
+            with self.buffer_lock:
+                oldest = min(self.buffer_started.values(), default=None)
+            timeout = self.flush_interval if oldest is None else oldest + self.flush_interval - time.time()
+            if self.closing.wait(max(0.0, timeout)):
+                return
+            with self.buffer_lock:
+                expired = time.time() - self.flush_interval
+                for (streamid, started) in list(self.buffer_started.items()):
+                    if started <= expired:
+                        self._send(streamid)
+
+    def _send(self, streamid):
+        """Send the buffered datapoints of a stream, blocks while too many batches are waiting to be send.
+
+        The caller holds buffer_lock.
+        """
+        bodies = self.buffers.pop(streamid, None)
+        self.buffer_started.pop(streamid, None)
+        if not bodies:
+            return
+        if self.bulk:
+            batches = [(self._post_bulk, bodies)]
+        else:
+            batches = [(self._post_single, body) for body in bodies]
+        for (func, arg) in batches:
+            while True:
+                with self.futures_lock:
+                    pending = list(self.futures)
+                if len(pending) < self.max_pending:
+                    break
+                wait(pending, return_when=FIRST_COMPLETED)
+            self._submit(func, arg)
+
+    def _submit(self, func, arg):
+        """Run func(arg) in the thread pool, the future is tracked in futures until it is done."""
+        future = self.executor.submit(func, arg)
+        with self.futures_lock:
+            self.futures.add(future)
+        future.add_done_callback(self._future_done)
+
+    def _future_done(self, future):
+        with self.futures_lock:
+            self.futures.discard(future)
+
+    def _post(self, url, data):
+        """Post data, retrying on connection errors and server errors. Returns the last response."""
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+            with self.lock:
+                self.requests += 1
+            try:
+                result = self.connector.post(url, headers={'Content-type': 'application/json'},
+                                             data=json.dumps(data), raise_status=False,
+                                             verify=self.connector.ssl_verify)
+            except requests.exceptions.ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                continue
+            if result.status_code < 500 or result.status_code in self.bulk_unsupported:
+                return result
+        return result
+
+    def _post_bulk(self, bodies):
+        """Create the datapoints using a bulk request, or using single requests if the bulk request fails."""
+        logger = logging.getLogger(__name__)
+        result = None
+        if self.bulk:
+            url = posixpath.join(self.host, 'api/geostreams/datapoints/bulk?key=%s' % self.key)
+            try:
+                result = self._post(url, bodies)
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("bulk request of %d datapoints failed, creating them one at a time: %s",
+                               len(bodies), exc)
+        if result is not None and result.ok:
+            with self.lock:
+                self.created += len(bodies)
+                self.bulk_client_errors = 0
+            return
+        if result is not None and result.status_code in self.bulk_unsupported:
+            if self.bulk:
+                logger.info("no bulk endpoint for datapoints, creating them one at a time")
+            self.bulk = False
+        elif result is not None:
+            logger.warning("bulk request of %d datapoints failed with status %d, creating them one at a time",
+                           len(bodies), result.status_code)
+            if 400 <= result.status_code < 500:
+                with self.lock:
+                    self.bulk_client_errors += 1
+                    disable = self.bulk and self.bulk_client_errors >= self.bulk_max_client_errors
+                    if disable:
+                        self.bulk = False
+                if disable:
+                    logger.warning("%d bulk requests in a row failed with status %d, creating datapoints one at a "
+                                   "time from now on", self.bulk_client_errors, result.status_code)
+        # the single requests run in the thread pool, without waiting for max_pending, this thread is one of them
+        for body in bodies:
+            self._submit(self._post_single, body)
+
+    def _post_single(self, body):
+        url = posixpath.join(self.host, 'api/geostreams/datapoints?key=%s' % self.key)
+        try:
+            result = self._post(url, body)
+            result.raise_for_status()
+        except Exception as exc:  # pylint: disable=broad-except
+            with self.lock:
+                self.failed.append((body, exc))
+            return
+        with self.lock:
+            self.created += 1
+
+
+@with_default_connector
+def get_sensor_by_name(connector, host, key, sensorname, use_cache=True):
     """Get sensor by name from Geostreams, or return None.
 
     Keyword arguments:
@@ -137,25 +553,33 @@ def get_sensor_by_name(connector, host, key, sensorname):
     host -- the clowder host, including http and port, should end with a /
     key -- the secret key to login to clowder
     sensorname -- name of sensor to search for
+    use_cache -- return the sensor from the index of sensors if it was found before
     """
 
     logger = logging.getLogger(__name__)
 
+    if use_cache:
+        sensor = index.get('sensor', host, sensorname)
+        if sensor is not None:
+            return sensor
+
     url = posixpath.join(host, "api/geostreams/sensors?sensor_name=%s&key=%s" % (sensorname, key))
 
-    result = requests.get(url,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     for sens in result.json():
         if 'name' in sens and sens['name'] == sensorname:
             logger.debug("found sensor '%s' = [%s]" % (sensorname, sens['id']))
+            index.put('sensor', host, sensorname, sens)
             return sens
 
     return None
 
 
-def get_sensors_by_circle(connector, host, key, lon, lat, radius=0):
+@with_default_connector
+def get_sensors_by_circle(connector, host, key, lon, lat, radius=0, use_index=False):
     """Get sensor by coordinate from Geostreams, or return None.
 
     Keyword arguments:
@@ -165,12 +589,16 @@ def get_sensors_by_circle(connector, host, key, lon, lat, radius=0):
     lon -- longitude of point
     lat -- latitude of point
     radius -- distance in meters around point to search
+    use_index -- search the local SpatialIndex of all sensors instead of calling Geostreams
     """
 
+    if use_index:
+        return get_sensor_index(connector, host, key).circle(lon, lat, radius)
+
     url = posixpath.join(host, "api/geostreams/sensors?geocode=%s,%s,%s&key=%s" % (lat, lon, radius, key))
 
-    result = requests.get(url,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     # Return first sensor
@@ -181,7 +609,8 @@ def get_sensors_by_circle(connector, host, key, lon, lat, radius=0):
         return None
 
 
-def get_sensors_by_polygon(connector, host, key, coord_list):
+@with_default_connector
+def get_sensors_by_polygon(connector, host, key, coord_list, use_index=False):
     """Get sensor by coordinate from Geostreams, or return None.
 
     Keyword arguments:
@@ -189,12 +618,16 @@ def get_sensors_by_polygon(connector, host, key, coord_list):
     host -- the clowder host, including http and port, should end with a /
     key -- the secret key to login to clowder
     coord_list -- list of (lon/lat) coordinate pairs forming polygon vertices
+    use_index -- search the local SpatialIndex of all sensors instead of calling Geostreams
     """
 
+    if use_index:
+        return get_sensor_index(connector, host, key).polygon(coord_list)
+
     coord_strings = [str(i) for i in coord_list]
     url = posixpath.join(host, "api/geostreams/sensors?geocode=%s&key=%s" % (','.join(coord_strings), key))
 
-    result = requests.get(url, verify=connector.ssl_verify if connector else True)
+    result = connector.get(url, verify=connector.ssl_verify)
     result.raise_for_status()
 
     # Return first sensor
@@ -205,7 +638,8 @@ def get_sensors_by_polygon(connector, host, key, coord_list):
         return None
 
 
-def get_stream_by_name(connector, host, key, streamname):
+@with_default_connector
+def get_stream_by_name(connector, host, key, streamname, use_cache=True):
     """Get stream by name from Geostreams, or return None.
 
     Keyword arguments:
@@ -213,25 +647,33 @@ def get_stream_by_name(connector, host, key, streamname):
     host -- the clowder host, including http and port, should end with a /
     key -- the secret key to login to clowder
     streamname -- name of stream to search for
+    use_cache -- return the stream from the index of streams if it was found before
     """
 
     logger = logging.getLogger(__name__)
 
+    if use_cache:
+        stream = index.get('stream', host, streamname)
+        if stream is not None:
+            return stream
+
     url = posixpath.join(host, "api/geostreams/streams?stream_name=%s&key=%s" % (streamname, key))
 
-    result = requests.get(url,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     for strm in result.json():
         if 'name' in strm and strm['name'] == streamname:
             logger.debug("found stream '%s' = [%s]" % (streamname, strm['id']))
+            index.put('stream', host, streamname, strm)
             return strm
 
     return None
 
 
-def get_streams_by_circle(connector, host, key, lon, lat, radius=0):
+@with_default_connector
+def get_streams_by_circle(connector, host, key, lon, lat, radius=0, use_index=False):
     """Get stream by coordinate from Geostreams, or return None.
 
     Keyword arguments:
@@ -241,12 +683,16 @@ def get_streams_by_circle(connector, host, key, lon, lat, radius=0):
     lon -- longitude of point
     lat -- latitude of point
     radius -- distance in meters around point to search
+    use_index -- search the local SpatialIndex of all streams instead of calling Geostreams
     """
 
+    if use_index:
+        return get_stream_index(connector, host, key).circle(lon, lat, radius)
+
     url = posixpath.join(host, "api/geostreams/stream?geocode=%s,%s,%s&key=%s" % (lat, lon, radius, key))
 
-    result = requests.get(url,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     jbody = result.json()
@@ -256,7 +702,8 @@ def get_streams_by_circle(connector, host, key, lon, lat, radius=0):
         return None
 
 
-def get_streams_by_polygon(connector, host, key, coord_list):
+@with_default_connector
+def get_streams_by_polygon(connector, host, key, coord_list, use_index=False):
     """Get stream by coordinate from Geostreams, or return None.
 
     Keyword arguments:
@@ -264,13 +711,17 @@ def get_streams_by_polygon(connector, host, key, coord_list):
     host -- the clowder host, including http and port, should end with a /
     key -- the secret key to login to clowder
     coord_list -- list of (lon/lat) coordinate pairs forming polygon vertices
+    use_index -- search the local SpatialIndex of all streams instead of calling Geostreams
     """
 
+    if use_index:
+        return get_stream_index(connector, host, key).polygon(coord_list)
+
     coord_strings = [str(i) for i in coord_list]
     url = posixpath.join(host, "api/geostreams/stream?geocode=%s&key=%s" % (','.join(coord_strings), key))
 
-    result = requests.get(url,
-                          verify=connector.ssl_verify if connector else True)
+    result = connector.get(url,
+                           verify=connector.ssl_verify)
     result.raise_for_status()
 
     jbody = result.json()
@@ -278,3 +729,269 @@ def get_streams_by_polygon(connector, host, key, coord_list):
         return jbody
     else:
         return None
+
+
+@with_default_connector
+def get_sensors(connector, host, key):
+    """Get all sensors from Geostreams.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    """
+
+    url = posixpath.join(host, "api/geostreams/sensors?key=%s" % key)
+
+    result = connector.get(url, verify=connector.ssl_verify)
+    result.raise_for_status()
+
+    return result.json()
+
+
+@with_default_connector
+def get_streams(connector, host, key):
+    """Get all streams from Geostreams.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    """
+
+    url = posixpath.join(host, "api/geostreams/streams?key=%s" % key)
+
+    result = connector.get(url, verify=connector.ssl_verify)
+    result.raise_for_status()
+
+    return result.json()
+
+
+def get_sensor_index(connector, host, key, refresh_interval=3600):
+    """Get a SpatialIndex of all sensors in Geostreams, the index is shared by all calls for the same host and key.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    refresh_interval -- seconds after which the sensors are loaded again
+    """
+
+    return _get_spatial_index('sensors', lambda: get_sensors(connector, host, key), host, key, refresh_interval)
+
+
+def get_stream_index(connector, host, key, refresh_interval=3600):
+    """Get a SpatialIndex of all streams in Geostreams, the index is shared by all calls for the same host and key.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    refresh_interval -- seconds after which the streams are loaded again
+    """
+
+    return _get_spatial_index('streams', lambda: get_streams(connector, host, key), host, key, refresh_interval)
+
+
+def nearest_sensor(connector, host, key, lon, lat):
+    """Get the sensor closest to a point from Geostreams, or return None.
+
+    Keyword arguments:
+    connector -- connector information, used to get missing parameters and send status updates
+    host -- the clowder host, including http and port, should end with a /
+    key -- the secret key to login to clowder
+    lon -- longitude of point
+    lat -- latitude of point
+    """
+
+    return get_sensor_index(connector, host, key).nearest(lon, lat)
+
+
+_spatial_indexes = dict()
+_spatial_indexes_lock = threading.Lock()
+
+
+def _get_spatial_index(kind, load, host, key, refresh_interval):
+    """Return the SpatialIndex of kind for host and key.
+
+    The index is refreshed using the load function and refresh_interval of the latest call, so the features are
+    loaded using the connector of the current caller.
+    """
+    index_key = (kind, host.rstrip('/'), key)
+    with _spatial_indexes_lock:
+        spatial_index = _spatial_indexes.get(index_key)
+        if spatial_index is None:
+            spatial_index = SpatialIndex(load, refresh_interval=refresh_interval)
+            _spatial_indexes[index_key] = spatial_index
+        else:
+            spatial_index.load = load
+            spatial_index.refresh_interval = float(refresh_interval)
+    return spatial_index
+
+
+class SpatialIndex(object):
+    """Local index of the locations of sensors or streams, to answer geometric queries without calling Geostreams.
+
+    The features returned by load are kept in a grid of cell_size degrees, using the point geometry of the feature,
+    or the average of the coordinates for other geometries. The features are loaded again after refresh_interval
+    seconds. Distances are great circle distances in meters.
+
+    Example:
+
+        sensors = SpatialIndex(lambda: get_sensors(connector, host, key))
+        sensor = sensors.nearest(-88.2, 40.1)
+    """
+
+    earth_radius = 6371008.8
+
+    def __init__(self, load, cell_size=1.0, refresh_interval=3600):
+        """
+        Create an index, the features are loaded on the first query.
+
+        :param load: function without arguments that returns a list of GeoJSON features
+        :param float cell_size: size of the grid cells in degrees
+        :param float refresh_interval: seconds after which the features are loaded again, 0 never loads them again
+        """
+        self.load = load
+        self.cell_size = float(cell_size)
+        self.refresh_interval = float(refresh_interval)
+        self.cells = dict()
+        self.loaded = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Load the features and rebuild the grid."""
+        cells = dict()
+        for feature in self.load() or []:
+            point = self._location(feature)
+            if point is not None:
+                cells.setdefault(self._cell(*point), []).append((point, feature))
+        with self.lock:
+            self.cells = cells
+            self.loaded = time.time()
+
+    def circle(self, lon, lat, radius):
+        """Return the features within radius meters of a point, closest first, or None if there are none."""
+        found = self._within(lon, lat, radius)
+        return [f for (_, f) in found] if found else None
+
+    def polygon(self, coord_list):
+        """Return the features inside a polygon, or None if there are none.
+
+        :param coord_list: list of (lon, lat) coordinate pairs forming polygon vertices
+        """
+        coord_list = [(float(c[0]), float(c[1])) for c in coord_list]
+        min_lon = min(c[0] for c in coord_list)
+        max_lon = max(c[0] for c in coord_list)
+        min_lat = min(c[1] for c in coord_list)
+        max_lat = max(c[1] for c in coord_list)
+        found = [f for (p, f) in self._candidates(min_lon, max_lon, min_lat, max_lat)
+                 if self._inside(p, coord_list)]
+        return found or None
+
+    def nearest(self, lon, lat):
+        """Return the feature closest to a point, or None if there are no features."""
+        cells = self._cells()
+        if not cells:
+            return None
+        (cx, cy) = self._cell(lon, lat)
+        max_ring = max(max(abs(x - cx), abs(y - cy)) for (x, y) in cells)
+        for ring in range(max_ring + 1):
+            candidates = []
+            for x in range(cx - ring, cx + ring + 1):
+                for y in range(cy - ring, cy + ring + 1):
+                    if max(abs(x - cx), abs(y - cy)) == ring:
+                        candidates.extend(cells.get((x, y), []))
+            if candidates:
+                # a closer feature can be in a later ring, search all cells within the distance of the best one
+                distance = min(self.distance(lon, lat, p[0], p[1]) for (p, _) in candidates)
+                return self._within(lon, lat, distance)[0][1]
+        return None
+
+    @classmethod
+    def distance(cls, lon1, lat1, lon2, lat2):
+        """Return the great circle distance in meters between two points."""
+        (lon1, lat1, lon2, lat2) = [math.radians(float(v)) for v in (lon1, lat1, lon2, lat2)]
+        h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        return 2 * cls.earth_radius * math.asin(min(1.0, math.sqrt(h)))
+
+    def _cells(self):
+        if self.loaded is None or (self.refresh_interval > 0 and time.time() - self.loaded > self.refresh_interval):
+            self.refresh()
+        return self.cells
+
+    def _cell(self, lon, lat):
+        return int(math.floor(lon / self.cell_size)), int(math.floor(lat / self.cell_size))
+
+    def _within(self, lon, lat, radius):
+        """Return (distance, feature) of all features within radius meters of a point, sorted by distance."""
+        (lon, lat, radius) = (float(lon), float(lat), float(radius))
+        angle = radius / self.earth_radius
+        dlat = math.degrees(angle)
+        if abs(lat) + dlat >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+            (min_lon, max_lon) = (-180, 180)
+        else:
+            dlon = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+            (min_lon, max_lon) = (lon - dlon, lon + dlon)
+        # split the bounding box where it crosses the antimeridian
+        if min_lon < -180:
+            boxes = [(min_lon + 360, 180), (-180, max_lon)]
+        elif max_lon > 180:
+            boxes = [(min_lon, 180), (-180, max_lon - 360)]
+        else:
+            boxes = [(min_lon, max_lon)]
+        candidates = []
+        for (box_min_lon, box_max_lon) in boxes:
+            candidates.extend(self._candidates(box_min_lon, box_max_lon, lat - dlat, lat + dlat))
+        found = []
+        for (p, f) in candidates:
+            d = self.distance(lon, lat, p[0], p[1])
+            if d <= radius * (1 + 1e-9):
+                found.append((d, f))
+        found.sort(key=lambda x: x[0])
+        return found
+
+    def _candidates(self, min_lon, max_lon, min_lat, max_lat):
+        """Return (location, feature) of the features in the cells overlapping a bounding box."""
+        cells = self._cells()
+        (x1, y1) = self._cell(min_lon, min_lat)
+        (x2, y2) = self._cell(max_lon, max_lat)
+        if (x2 - x1 + 1) * (y2 - y1 + 1) > len(cells):
+            keys = [k for k in cells if x1 <= k[0] <= x2 and y1 <= k[1] <= y2]
+        else:
+            keys = [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+        result = []
+        for k in keys:
+            result.extend(cells.get(k, []))
+        return result
+
+    @staticmethod
+    def _location(feature):
+        """Return (lon, lat) of a GeoJSON feature, or None if it has no coordinates."""
+        coordinates = (feature.get('geometry') or {}).get('coordinates')
+        points = []
+
+        def flatten(c):
+            if isinstance(c, (list, tuple)) and len(c) >= 2 and all(isinstance(v, (int, float)) for v in c):
+                points.append((float(c[0]), float(c[1])))
+            elif isinstance(c, (list, tuple)):
+                for v in c:
+                    flatten(v)
+        flatten(coordinates)
+        if not points:
+            return None
+        return sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)
+
+    @staticmethod
+    def _inside(point, polygon):
+        """Return True if point is inside polygon, using ray casting."""
+        (x, y) = point
+        inside = False
+        j = len(polygon) - 1
+        for i in range(len(polygon)):
+            (xi, yi) = polygon[i]
+            (xj, yj) = polygon[j]
+            if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+                inside = not inside
+            j = i
+        return inside
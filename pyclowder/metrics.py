@@ -0,0 +1,254 @@
+"""Metrics
+
+This module contains the counters and histograms that are kept by the connectors, for example the number of messages
+processed and the time it takes to process them, and the calls made to clowder. The metrics can be published in the
+Prometheus text format on http://<host>:<port>/metrics using start_http_server, this is done by the extractor if
+--metrics-port / METRICS_PORT is set.
+
+Metrics of messages processed in worker processes are send to the main process, where they are published.
+"""
+
+import bisect
+import contextlib
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+# function called instead of updating a metric, used by worker processes to send the metrics to the main process
+_forward = None
+
+
+class _Metric(object):
+    """Base class of all metrics, keeps a value per combination of labels."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = dict()
+        self.lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("%s expects labels %s, got %s" % (self.name, self.labelnames, sorted(labels)))
+        return tuple(str(labels[k]) for k in self.labelnames)
+
+    def _labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key)) + (extra or [])
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for (k, v) in pairs)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Value that only goes up, for example the number of messages processed."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter for the given labels by amount."""
+        if _forward:
+            _forward(self.name, 'inc', amount, labels)
+            return
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """Return the value of the counter for the given labels."""
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return ['%s%s %s' % (self.name, self._labels(key), _number(value)) for (key, value) in sorted(self.values.items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, for example the number of seconds it takes to process a message."""
+
+    type = 'histogram'
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None, registry=None):
+        super(Histogram, self).__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets or self.default_buckets))
+
+    def observe(self, value, **labels):
+        """Add an observation of value for the given labels."""
+        if _forward:
+            _forward(self.name, 'observe', value, labels)
+            return
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the number of seconds it takes to run the with block."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started, **labels)
+
+    def get(self, **labels):
+        """Return (count, sum) of the observations for the given labels."""
+        with self.lock:
+            entry = self.values.get(self._key(labels))
+            return (entry[2], entry[1]) if entry else (0, 0.0)
+
+    def _samples(self):
+        lines = []
+        for (key, (counts, total, count)) in sorted(self.values.items()):
+            cumulative = 0
+            for (bound, bucket_count) in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (self.name, self._labels(key, [('le', _number(bound))]), cumulative))
+            lines.append('%s_bucket%s %d' % (self.name, self._labels(key, [('le', '+Inf')]), count))
+            lines.append('%s_sum%s %s' % (self.name, self._labels(key), _number(total)))
+            lines.append('%s_count%s %d' % (self.name, self._labels(key), count))
+        return lines
+
+
+class Registry(object):
+    """Collection of metrics that are published together."""
+
+    def __init__(self):
+        self.metrics = dict()
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError("metric %s already exists" % metric.name)
+            self.metrics[metric.name] = metric
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+
+MESSAGES = Counter('pyclowder_messages_total',
+                   'Messages by status: received, succeeded, failed or resubmitted.',
+                   ['extractor', 'status'])
+CHECK_MESSAGE_SECONDS = Histogram('pyclowder_check_message_seconds',
+                                  'Seconds spend in check_message.', ['extractor'])
+PROCESS_MESSAGE_SECONDS = Histogram('pyclowder_process_message_seconds',
+                                    'Seconds spend in process_message.', ['extractor'])
+QUEUE_WAIT_SECONDS = Histogram('pyclowder_queue_wait_seconds',
+                               'Seconds between publishing a message and receiving it, for messages with a timestamp.',
+                               ['extractor'])
+MESSAGE_RETRIES = Histogram('pyclowder_message_retry_count',
+                            'Retry count of the messages received.', ['extractor'],
+                            buckets=(0, 1, 2, 3, 5, 10))
+HTTP_REQUEST_SECONDS = Histogram('pyclowder_http_request_seconds',
+                                 'Seconds until the response headers of a call to clowder are received.',
+                                 ['method', 'endpoint', 'status'])
+HTTP_BYTES = Counter('pyclowder_http_bytes_total',
+                     'Bytes send (upload) and received (download) in calls to clowder, based on Content-Length.',
+                     ['direction', 'endpoint'])
+
+# parts of the path of a url that are replaced by {id}, to keep the number of endpoints small
+_id_pattern = re.compile(r'^([0-9a-fA-F]{24}|[0-9a-fA-F-]{36}|\d+)$')
+
+
+def endpoint(url):
+    """Return the path of url with all ids replaced by {id}."""
+    path = urlparse(url).path
+    return '/'.join('{id}' if _id_pattern.match(part) else part for part in path.split('/'))
+
+
+def observe_response(response, *args, **kwargs):
+    """Response hook of the requests session, records the latency and bytes of each call."""
+    try:
+        request = response.request
+        path = endpoint(request.url)
+        HTTP_REQUEST_SECONDS.observe(response.elapsed.total_seconds(), method=request.method, endpoint=path,
+                                     status=response.status_code)
+        sent = request.headers.get('Content-Length')
+        if sent:
+            HTTP_BYTES.inc(int(sent), direction='upload', endpoint=path)
+        received = response.headers.get('Content-Length')
+        if received:
+            HTTP_BYTES.inc(int(received), direction='download', endpoint=path)
+    except Exception:  # pylint: disable=broad-except
+        logging.getLogger(__name__).debug("Could not record metrics of response.", exc_info=True)
+    return response
+
+
+def apply(name, method, value, labels):
+    """Update a metric, used to apply the updates forwarded by worker processes."""
+    metric = REGISTRY.get(name)
+    if metric is not None:
+        getattr(metric, method)(value, **labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port, addr='', registry=None):
+    """Publish the metrics on http://addr:port/metrics in a background thread, returns the server."""
+    server = _MetricsServer((addr, port), _MetricsHandler)
+    server.registry = registry if registry is not None else REGISTRY
+    thread = threading.Thread(target=server.serve_forever, name="MetricsServer")
+    thread.daemon = True
+    thread.start()
+    logging.getLogger(__name__).info("Publishing metrics on port %d", server.server_port)
+    return server
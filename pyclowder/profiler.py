@@ -0,0 +1,177 @@
+"""Profiler
+
+This module samples the stack of the thread processing a message, and writes the samples of a job to a file only when
+the job took longer than a threshold, or for a random fraction of the jobs. This makes it possible to leave profiling
+enabled in production and find out why one message in thousands is slow, without paying for a deterministic profiler
+on every message.
+
+The profiles are written as collapsed stacks, one line per unique stack with the number of samples, which can be
+turned into a flame graph using flamegraph.pl or loaded in speedscope. The files are named
+<time>-<resource type>-<resource id>-<seconds>s.folded.
+
+Profiling is disabled unless a profiler is configured, the extractor does this when --profile-dir / PROFILE_DIR is
+set, see also --profile-threshold / PROFILE_THRESHOLD and --profile-sample-rate / PROFILE_SAMPLE_RATE.
+
+Only the thread that processes the message is sampled, time spend waiting on work done in other threads, for
+example the segments of a large download, shows up as waiting in the job thread.
+"""
+
+import collections
+import contextlib
+import contextvars
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+# profiler of the jobs, None disables profiling
+_profiler = None
+
+# the job that is profiled in the current thread
+_current = contextvars.ContextVar('pyclowder_profile', default=None)
+
+# used to start the sampler thread once per process
+_start_lock = threading.Lock()
+
+_unsafe = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class _Job(object):
+    """Samples of a single job."""
+
+    def __init__(self, name, thread_id, sampled):
+        self.name = name
+        self.thread_id = thread_id
+        self.sampled = sampled
+        self.start = time.time()
+        self.tags = dict()
+        self.stacks = collections.Counter()
+
+
+class Profiler(object):
+    """Samples the stacks of the jobs every interval seconds from a background thread.
+
+    :param directory: folder the profiles are written to
+    :param threshold: jobs taking at least this many seconds are written, 0 writes all jobs
+    :param sample_rate: fraction of the other jobs that is written
+    :param interval: seconds between samples
+    """
+
+    def __init__(self, directory, threshold=60, sample_rate=0.0, interval=0.01):
+        self.directory = directory
+        self.threshold = float(threshold)
+        self.sample_rate = float(sample_rate)
+        self.interval = float(interval)
+        self.pid = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _start(self):
+        # the thread does not survive a fork, worker processes start their own
+        self.jobs = dict()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        thread = threading.Thread(target=self._run, name="Profiler")
+        thread.daemon = True
+        thread.start()
+        self.pid = os.getpid()
+
+    def begin(self, name):
+        """Start sampling the current thread, returns the job."""
+        if self.pid != os.getpid():
+            with _start_lock:
+                if self.pid != os.getpid():
+                    self._start()
+        job = _Job(name, threading.get_ident(), random.random() < self.sample_rate)
+        with self.lock:
+            self.jobs[id(job)] = job
+            self.wakeup.set()
+        return job
+
+    def end(self, job):
+        """Stop sampling the job, and write its profile if it is slow or sampled. Returns the filename or None."""
+        with self.lock:
+            self.jobs.pop(id(job), None)
+        duration = time.time() - job.start
+        if duration < self.threshold and not job.sampled:
+            return None
+        return self.write(job, duration)
+
+    def write(self, job, duration):
+        """Write the samples of the job as collapsed stacks."""
+        parts = [time.strftime('%Y%m%dT%H%M%S', time.localtime(job.start)), job.name]
+        parts.extend(str(job.tags[k]) for k in ('type', 'id') if k in job.tags)
+        parts.append('%.1fs' % duration)
+        filename = os.path.join(self.directory, _unsafe.sub('_', '-'.join(parts)) + '.folded')
+        with self.lock:
+            stacks = list(job.stacks.items())
+        try:
+            with open(filename, 'w') as profile_file:
+                for (stack, count) in sorted(stacks):
+                    profile_file.write('%s %d\n' % (stack, count))
+        except (IOError, OSError):
+            logging.getLogger(__name__).exception("Could not write profile to %s", filename)
+            return None
+        logging.getLogger(__name__).info("Job of %s took %.1f seconds, profile written to %s",
+                                         job.tags.get('id', job.name), duration, filename)
+        return filename
+
+    def sample(self):
+        """Add the current stack of each job to its samples."""
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        with self.lock:
+            for job in self.jobs.values():
+                frame = frames.get(job.thread_id)
+                if frame is not None:
+                    job.stacks[_collapse(frame)] += 1
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                if not self.jobs:
+                    self.wakeup.clear()
+                    continue
+            self.sample()
+            time.sleep(self.interval)
+
+
+def _collapse(frame):
+    """Return the stack of frame as function names separated by ;, starting with the outermost frame."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+@contextlib.contextmanager
+def profile(name):
+    """Sample the current thread during the with block, the job is written when it is slow or sampled."""
+    if not _profiler:
+        yield None
+        return
+    profiler = _profiler
+    job = profiler.begin(name)
+    token = _current.set(job)
+    try:
+        yield job
+    finally:
+        _current.reset(token)
+        profiler.end(job)
+
+
+def tag(**tags):
+    """Add tags to the job profiled in the current thread, type and id are used in the filename of the profile."""
+    job = _current.get()
+    if job is not None:
+        job.tags.update(tags)
+
+
+def configure(profiler):
+    """Set the profiler of the jobs, None disables profiling."""
+    global _profiler
+    _profiler = profiler
@@ -6,9 +6,11 @@ This module provides simple wrappers around the clowder Datasets API
 import json
 import logging
 import posixpath
-import requests
 
+from pyclowder.utils import with_default_connector
 
+
+@with_default_connector
 def upload(connector, host, key, sectiondata):
     """Upload section to Clowder.
 
@@ -24,8 +26,8 @@ def upload(connector, host, key, sectiondata):
 
     # upload section
     url = posixpath.join(host, 'api/sections?key=%s' % key)
-    result = requests.post(url, headers=headers, data=json.dumps(sectiondata),
-                           verify=connector.ssl_verify if connector else True)
+    result = connector.post(url, headers=headers, data=json.dumps(sectiondata),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
 
     sectionid = result.json()['id']
@@ -34,6 +36,7 @@ def upload(connector, host, key, sectiondata):
     return sectionid
 
 
+@with_default_connector
 def upload_tags(connector, host, key, sectionid, tags):
     """Upload section tag to Clowder.
 
@@ -49,11 +52,12 @@ def upload_tags(connector, host, key, sectionid, tags):
 
     headers = {'Content-Type': 'application/json'}
     url = posixpath.join(host, 'api/sections/%s/tags?key=%s' % (sectionid, key))
-    result = requests.post(url, headers=headers, data=json.dumps(tags),
-                           verify=connector.ssl_verify if connector else True)
+    result = connector.post(url, headers=headers, data=json.dumps(tags),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
 
 
+@with_default_connector
 def upload_description(connector, host, key, sectionid, description):
     """Upload description to a section.
 
@@ -70,6 +74,6 @@ def upload_description(connector, host, key, sectionid, description):
 
     headers = {'Content-Type': 'application/json'}
     url = posixpath.join(host, 'api/sections/%s/description?key=%s' % (sectionid, key))
-    result = requests.post(url, headers=headers, data=json.dumps(description),
-                           verify=connector.ssl_verify if connector else True)
+    result = connector.post(url, headers=headers, data=json.dumps(description),
+                            verify=connector.ssl_verify)
     result.raise_for_status()
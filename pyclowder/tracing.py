@@ -0,0 +1,255 @@
+"""Tracing
+
+This module records spans of the work done for each message: a span for the job, with child spans for each stage
+(parsing the message, check_message, downloads, process_message, email) and for each call made to clowder. The spans
+carry the id of the file or dataset, the bytes moved and the retry count of the message, so it is possible to see if
+a slow job is waiting on clowder, the network or the extractor.
+
+Tracing is disabled unless an exporter is configured, the extractor does this when --trace-file / TRACE_FILE (spans
+are appended as JSON lines) or --trace-endpoint / TRACE_ENDPOINT (spans are send to an OTLP/HTTP collector, for
+example http://localhost:4318) is set.
+
+Example:
+
+    with pyclowder.tracing.span('convert', fileid=resource['id']) as s:
+        ...
+        s.set('bytes', os.path.getsize(output))
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+
+import pyclowder.metrics
+
+# exporter of the finished spans, None disables tracing
+_exporter = None
+
+# the span that is active in the current thread or task
+_current = contextvars.ContextVar('pyclowder_span', default=None)
+
+
+class Span(object):
+    """A timed operation, with the ids of its trace and parent span and attributes describing it."""
+
+    def __init__(self, name, parent=None, attributes=None, start=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = start if start is not None else time.time()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set(self, key, value):
+        """Set an attribute of the span."""
+        self.attributes[key] = value
+
+    def finish(self, end=None):
+        self.end = end if end is not None else time.time()
+        if _exporter:
+            _exporter.export(self)
+
+    def to_dict(self):
+        result = {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.end - self.start if self.end is not None else None,
+            'attributes': self.attributes,
+        }
+        if self.error:
+            result['error'] = self.error
+        return result
+
+
+class _NoSpan(object):
+    """Span used when tracing is disabled, ignores all attributes."""
+
+    def set(self, key, value):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Record a span of the with block, as a child of the current span. Yields the span."""
+    if not _exporter:
+        yield _no_span
+        return
+    current = Span(name, _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.error = "%s: %s" % (type(exc).__name__, exc)
+        raise
+    finally:
+        _current.reset(token)
+        current.finish()
+
+
+def current_span():
+    """Return the active span, or None."""
+    return _current.get()
+
+
+def wrap(func):
+    """Return a function that calls func with the active span of the caller, used to run func in another thread."""
+    if not _exporter:
+        return func
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def observe_response(response, *args, **kwargs):
+    """Response hook of the requests session, records a span for each call to clowder."""
+    if not _exporter:
+        return response
+    try:
+        request = response.request
+        end = time.time()
+        attributes = {
+            'http.method': request.method,
+            'http.endpoint': pyclowder.metrics.endpoint(request.url),
+            'http.host': urlparse(request.url).netloc,
+            'http.status_code': response.status_code,
+        }
+        sent = request.headers.get('Content-Length')
+        if sent:
+            attributes['bytes_sent'] = int(sent)
+        received = response.headers.get('Content-Length')
+        if received:
+            attributes['bytes_received'] = int(received)
+        Span('HTTP %s' % request.method, _current.get(), attributes,
+             start=end - response.elapsed.total_seconds()).finish(end)
+    except Exception:  # pylint: disable=broad-except
+        logging.getLogger(__name__).debug("Could not record span of response.", exc_info=True)
+    return response
+
+
+def configure(exporter):
+    """Set the exporter of the finished spans, None disables tracing."""
+    global _exporter
+    _exporter = exporter
+
+
+class JsonlExporter(object):
+    """Appends each finished span as a line of JSON to a file, the file can be shared by multiple processes."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    def export(self, finished):
+        line = json.dumps(finished.to_dict(), default=str) + "\n"
+        with self.lock:
+            with open(self.filename, 'a') as trace_file:
+                trace_file.write(line)
+
+
+class OtlpExporter(object):
+    """Sends the finished spans to an OpenTelemetry collector using OTLP/HTTP with JSON encoding.
+
+    Spans are send in batches from a background thread, every interval seconds, when max_batch spans are waiting, or
+    when a job span finishes.
+    """
+
+    def __init__(self, endpoint, service_name='pyclowder', interval=5, max_batch=512, headers=None):
+        self.url = endpoint.rstrip('/') + '/v1/traces' if not endpoint.rstrip('/').endswith('/v1/traces') \
+            else endpoint
+        self.service_name = service_name
+        self.interval = float(interval)
+        self.max_batch = int(max_batch)
+        self.headers = dict(headers or {})
+        self.headers['Content-Type'] = 'application/json'
+        self.pid = None
+        self._start()
+
+    def _start(self):
+        # the thread does not survive a fork, worker processes start their own
+        self.pid = os.getpid()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        thread = threading.Thread(target=self._run, name="OtlpExporter")
+        thread.daemon = True
+        thread.start()
+
+    def export(self, finished):
+        if self.pid != os.getpid():
+            self._start()
+        with self.lock:
+            self.spans.append(finished)
+            if finished.parent_id is None or len(self.spans) >= self.max_batch:
+                self.wakeup.set()
+
+    def flush(self):
+        """Send all waiting spans."""
+        with self.lock:
+            (spans, self.spans) = (self.spans, [])
+        if not spans:
+            return
+        try:
+            # a plain request, so the call is not traced itself
+            requests.post(self.url, data=json.dumps(self.encode(spans)), headers=self.headers, timeout=10)
+        except requests.exceptions.RequestException as exc:
+            logging.getLogger(__name__).warning("Could not send %d spans to %s: %s", len(spans), self.url, exc)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def encode(self, spans):
+        """Return the OTLP JSON request of the spans."""
+        return {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': self.service_name})},
+            'scopeSpans': [{
+                'scope': {'name': 'pyclowder'},
+                'spans': [{
+                    'traceId': s.trace_id,
+                    'spanId': s.span_id,
+                    'parentSpanId': s.parent_id or '',
+                    'name': s.name,
+                    'kind': 1,
+                    'startTimeUnixNano': str(int(s.start * 1e9)),
+                    'endTimeUnixNano': str(int(s.end * 1e9)),
+                    'attributes': _otlp_attributes(s.attributes),
+                    'status': {'code': 2, 'message': s.error} if s.error else {'code': 0},
+                } for s in spans],
+            }],
+        }]}
+
+
+def _otlp_attributes(attributes):
+    result = []
+    for (key, value) in attributes.items():
+        if isinstance(value, bool):
+            encoded = {'boolValue': value}
+        elif isinstance(value, int):
+            encoded = {'intValue': str(value)}
+        elif isinstance(value, float):
+            encoded = {'doubleValue': value}
+        else:
+            encoded = {'stringValue': str(value)}
+        result.append({'key': key, 'value': encoded})
+    return result
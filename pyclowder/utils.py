@@ -6,18 +6,26 @@ from either a file or the command line.
 """
 
 import datetime
+import functools
 import json
 import logging
 import logging.config
 import os
+import struct
 import time
 import zipfile
+import zlib
 import tempfile
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
 import yaml
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+import pyclowder.client
+import pyclowder.tracing
 
 
 # this takes advantage of the fact that 0 == False and anything else == True
@@ -52,6 +60,78 @@ class StatusMessage(Enum):
     retry = "RESUBMITTED"
 
 
+class _RequestsConnector(object):
+    """Stand-in for a connector when the API functions are called with connector None.
+
+    The requests are made with requests directly, without the shared session of a connector, and SSL certificates
+    are always verified. Results are not cached and status messages are only logged.
+    """
+
+    ssl_verify = True
+    mounted_paths = {}
+    download_segments = 1
+    download_chunk_size = 1024 * 1024
+    http_max_retries = 3
+
+    def get_client(self, host, key):
+        return pyclowder.client.ClowderClient(host=host, key=key)
+
+    def job_cached(self, endpoint, client, resource_id, fetch):
+        return fetch()
+
+    def invalidate_job_cache(self, resource_id=None):
+        pass
+
+    def status_update(self, status, resource, message):
+        logging.getLogger(__name__).info("[%s] : %s: %s", resource.get("id"), status, message)
+
+    def message_process(self, resource, message):
+        self.status_update(StatusMessage.processing, resource, message)
+
+    def _request(self, method, url, raise_status, **kwargs):
+        response = requests.request(method, url, **kwargs)
+        if raise_status:
+            response.raise_for_status()
+        return response
+
+    def get(self, url, params=None, raise_status=True, **kwargs):
+        return self._request('GET', url, raise_status, params=params, **kwargs)
+
+    def post(self, url, data=None, json_data=None, raise_status=True, **kwargs):
+        return self._request('POST', url, raise_status, data=data, json=json_data, **kwargs)
+
+    def patch(self, url, data=None, json_data=None, raise_status=True, **kwargs):
+        return self._request('PATCH', url, raise_status, data=data, json=json_data, **kwargs)
+
+    def put(self, url, data=None, raise_status=True, **kwargs):
+        return self._request('PUT', url, raise_status, data=data, **kwargs)
+
+    def delete(self, url, raise_status=True, **kwargs):
+        return self._request('DELETE', url, raise_status, **kwargs)
+
+
+def default_connector(connector):
+    """Return connector, or an object making the same requests without a connector if connector is None."""
+    if connector is None:
+        return _RequestsConnector()
+    return connector
+
+
+def with_default_connector(func):
+    """Decorator of the API functions, calls func with default_connector(connector) as the connector argument.
+
+    This allows calling the functions with None as the connector.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if 'connector' in kwargs:
+            kwargs['connector'] = default_connector(kwargs['connector'])
+        elif args:
+            args = (default_connector(args[0]),) + args[1:]
+        return func(*args, **kwargs)
+    return wrapper
+
+
 def iso8601time():
     if time.daylight == 0:
         tz = str.format('{0:+06.2f}', -float(time.timezone) / 3600).replace('.', ':')
@@ -115,6 +195,121 @@ def setup_logging(config_info=None):
         logging.getLogger('requests.packages.urllib3.connectionpool').setLevel(logging.WARN)
 
 
+@with_default_connector
+def upload_file(connector, url, filepath, field='file', mimetype=None, headers=None):
+    """Upload a file as multipart form data, the file is streamed from disk while it is uploaded.
+
+    Returns the response of the POST request.
+
+    Keyword arguments:
+    connector -- connector information, used to make the request
+    url -- the url to post the file to
+    filepath -- the file to upload
+    field -- name of the form field of the file
+    mimetype -- (optional) MIME type of the file
+    headers -- (optional) additional headers to send with the request
+    """
+    filename = os.path.basename(filepath)
+    with open(filepath, 'rb') as filedata:
+        if mimetype is not None:
+            m = MultipartEncoder(fields={field: (filename, filedata, mimetype)})
+        else:
+            m = MultipartEncoder(fields={field: (filename, filedata)})
+        all_headers = dict(headers or {})
+        all_headers['Content-Type'] = m.content_type
+        return connector.post(url, data=m, headers=all_headers, verify=connector.ssl_verify)
+
+
+@with_default_connector
+def download_file(connector, url, filename, headers=None, segments=1, chunk_size=1024 * 1024,
+                  min_segment_size=16 * 1024 * 1024, max_retries=3):
+    """Download url into an existing file, using multiple HTTP range requests if the server supports it.
+
+    If the server accepts range requests, files larger than segments * min_segment_size are downloaded using segments
+    concurrent requests, each writing its own part of the preallocated file, the first segment is read from the
+    response of the initial request. If a connection fails during the download, the download resumes from the last
+    byte written, up to max_retries times. Downloads are only resumed within a single call, a failed download is
+    started from the beginning the next time.
+
+    Keyword arguments:
+    connector -- connector information, used to make the requests
+    url -- the url to download
+    filename -- the file to write the download into
+    headers -- (optional) additional headers to send with the requests
+    segments -- maximum number of concurrent range requests
+    chunk_size -- number of bytes to read and write at a time
+    min_segment_size -- minimum number of bytes downloaded by a single range request
+    max_retries -- number of times a failed range is resumed
+    """
+    headers = dict(headers or {})
+    verify = connector.ssl_verify
+
+    result = connector.get(url, stream=True, headers=headers, verify=verify)
+    size = -1
+    if 'Content-Length' in result.headers and 'Content-Encoding' not in result.headers:
+        size = int(result.headers['Content-Length'])
+    resumable = size > 0 and result.headers.get('Accept-Ranges', '').lower() == 'bytes'
+
+    if resumable and segments > 1 and size >= 2 * min_segment_size:
+        segments = min(segments, size // min_segment_size)
+        segment_size = -(-size // segments)
+        with open(filename, 'r+b') as outputfile:
+            outputfile.truncate(size)
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            download_range = pyclowder.tracing.wrap(_download_range)
+            # the initial request starts at byte 0, it is used for the first segment
+            futures = [executor.submit(download_range, connector, url, headers, verify, filename,
+                                       start, min(start + segment_size, size) - 1, chunk_size, max_retries,
+                                       result if start == 0 else None)
+                       for start in range(0, size, segment_size)]
+            for future in futures:
+                future.result()
+    else:
+        end = size - 1 if size >= 0 else None
+        _download_range(connector, url, headers, verify, filename, 0, end, chunk_size,
+                        max_retries if resumable else 0, result)
+
+
+def _download_range(connector, url, headers, verify, filename, start, end, chunk_size, max_retries, result=None):
+    """Download bytes start to end (inclusive, None for all) of url into the same location of filename."""
+    logger = logging.getLogger(__name__)
+    position = start
+    retries = 0
+    with open(filename, 'r+b') as outputfile:
+        while end is None or position <= end:
+            try:
+                if result is None:
+                    range_headers = dict(headers)
+                    range_headers['Range'] = 'bytes=%d-%s' % (position, '' if end is None else end)
+                    result = connector.get(url, stream=True, headers=range_headers, verify=verify)
+                    if result.status_code != 206:
+                        raise IOError("Server did not return requested range of %s" % url)
+                outputfile.seek(position)
+                for chunk in result.iter_content(chunk_size=chunk_size):
+                    if end is not None and position + len(chunk) > end + 1:
+                        # the response continues past the range, e.g. the whole file for the first segment
+                        chunk = chunk[:end + 1 - position]
+                    outputfile.write(chunk)
+                    position += len(chunk)
+                    if end is not None and position > end:
+                        break
+                if end is None:
+                    break
+                if position <= end:
+                    raise requests.exceptions.ChunkedEncodingError("Connection closed after %d bytes" % position)
+            except requests.exceptions.RequestException:
+                if retries >= max_retries:
+                    raise
+                retries += 1
+                logger.warning("Error downloading %s, resuming download at byte %d (#%d).", url, position, retries)
+            finally:
+                if result is not None:
+                    result.close()
+                    result = None
+    if result is not None:
+        result.close()
+
+
 def extract_zip_contents(zipfilepath):
     """Extract contents of a zipfile and return contents as list of file paths
 
@@ -132,3 +327,142 @@ def extract_zip_contents(zipfilepath):
             file_list.append(os.path.join(root, currfile))
 
     return file_list
+
+
+def extract_zip_stream(stream, output_folder, chunk_size=1024 * 1024):
+    """Extract a zipfile while it is read from a stream and return contents as list of file paths
+
+    The zipfile is read front to back using the local file headers, so it never has to be stored on disk. This works
+    for the stored and deflated members Clowder creates. A zipfile.BadZipFile is raised if a member can not be
+    extracted this way (e.g. encrypted, other compression, or stored with the size only known after the data), in
+    which case the zipfile needs to be downloaded and extracted using extract_zip_contents.
+
+    Keyword arguments:
+    stream -- file like object to read the zipfile from, for example the raw body of a HTTP response
+    output_folder -- folder to extract the contents into
+    chunk_size -- number of bytes read from the stream at a time
+    """
+
+    reader = _ZipStreamReader(stream)
+    file_list = []
+    while True:
+        signature = reader.read(4)
+        if signature != b'PK\x03\x04':
+            # central directory (or end of archive) follows after the last member
+            if signature in (b'', b'PK\x01\x02', b'PK\x05\x06', b'PK\x06\x06'):
+                break
+            raise zipfile.BadZipFile("Bad local file header in zipfile stream")
+
+        (_, flags, method, _, _, crc, compressed_size, size, name_length, extra_length) = \
+            struct.unpack('<HHHHHIIIHH', reader.read(26))
+        name = reader.read(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = reader.read(extra_length)
+        zip64 = False
+        while len(extra) >= 4:
+            (header_id, data_length) = struct.unpack('<HH', extra[:4])
+            if header_id == 0x0001:
+                zip64 = True
+                values = list(struct.unpack('<%dQ' % (data_length // 8), extra[4:4 + (data_length // 8) * 8]))
+                if size == 0xFFFFFFFF and values:
+                    size = values.pop(0)
+                if compressed_size == 0xFFFFFFFF and values:
+                    compressed_size = values.pop(0)
+            extra = extra[4 + data_length:]
+
+        if flags & 0x1:
+            raise zipfile.BadZipFile("Encrypted member %s in zipfile stream" % name)
+        is_dir = name.endswith('/')
+        has_descriptor = flags & 0x8
+        if method == zipfile.ZIP_STORED and has_descriptor and compressed_size == 0 and not is_dir:
+            raise zipfile.BadZipFile("Stored member %s without size in zipfile stream" % name)
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise zipfile.BadZipFile("Unsupported compression %d for %s in zipfile stream" % (method, name))
+
+        # same sanitizing of the name as ZipFile.extract, making sure nothing is written outside output_folder
+        parts = [x for x in name.replace('\\', '/').split('/') if x not in ('', '.', '..')]
+        target = os.path.join(output_folder, *parts) if parts else output_folder
+        if is_dir:
+            os.makedirs(target, exist_ok=True)
+            outputfile = open(os.devnull, 'wb')
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            outputfile = open(target, 'wb')
+
+        checksum = 0
+        written = 0
+        with outputfile:
+            if method == zipfile.ZIP_STORED:
+                remaining = compressed_size
+                while remaining > 0:
+                    data = reader.read_some(min(remaining, chunk_size))
+                    if not data:
+                        raise zipfile.BadZipFile("Truncated member %s in zipfile stream" % name)
+                    remaining -= len(data)
+                    checksum = zlib.crc32(data, checksum)
+                    written += len(data)
+                    outputfile.write(data)
+                consumed = compressed_size
+            else:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                remaining = None if has_descriptor else compressed_size
+                consumed = 0
+                while not decompressor.eof:
+                    data = reader.read_some(chunk_size if remaining is None else min(remaining, chunk_size))
+                    if not data:
+                        raise zipfile.BadZipFile("Truncated member %s in zipfile stream" % name)
+                    if remaining is not None:
+                        remaining -= len(data)
+                    consumed += len(data)
+                    data = decompressor.decompress(data)
+                    checksum = zlib.crc32(data, checksum)
+                    written += len(data)
+                    outputfile.write(data)
+                consumed -= len(decompressor.unused_data)
+                reader.unread(decompressor.unused_data)
+
+        if has_descriptor:
+            descriptor = reader.read(4)
+            if descriptor == b'PK\x07\x08':
+                descriptor = reader.read(4)
+            crc = struct.unpack('<I', descriptor)[0]
+            # sizes in the data descriptor are 8 bytes for zip64 members, which is also used by some writers
+            # (e.g. java) for large members without zip64 extra field in the local header
+            if zip64 or consumed >= 0xFFFFFFFF or written >= 0xFFFFFFFF:
+                (compressed_size, size) = struct.unpack('<QQ', reader.read(16))
+            else:
+                (compressed_size, size) = struct.unpack('<II', reader.read(8))
+        if checksum != crc or written != size or consumed != compressed_size:
+            raise zipfile.BadZipFile("Bad CRC-32 or size for %s in zipfile stream" % name)
+        if not is_dir:
+            file_list.append(target)
+
+    return file_list
+
+
+class _ZipStreamReader(object):
+    """Small buffered reader on top of a stream that allows data read too far to be pushed back."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+
+    def read_some(self, size):
+        if self.buffer:
+            data = self.buffer[:size]
+            self.buffer = self.buffer[size:]
+            return data
+        return self.stream.read(size)
+
+    def read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.read_some(size - len(data))
+            if not chunk:
+                if data:
+                    raise zipfile.BadZipFile("Unexpected end of zipfile stream")
+                break
+            data += chunk
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
@@ -34,7 +34,7 @@ setup(
     ],
     keywords=['clowder', 'data management system'],
 
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
 
     python_requires='>=3.6, <4',
 
@@ -0,0 +1,25 @@
+import unittest
+
+from benchmarks.run import run_benchmark, _percentile
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run(self):
+        results = run_benchmark(messages=5, file_size=10000, upload_size=1000, workers=2, timeout=60)
+        self.assertTrue(results['complete'])
+        self.assertEqual(results['messages'], 5)
+        self.assertEqual(results['errors'], 0)
+        self.assertGreater(results['messages_per_second'], 0)
+        self.assertGreaterEqual(results['latency_p99'], results['latency_p50'])
+        self.assertGreater(results['download_bytes_per_second'], 0)
+        self.assertGreater(results['upload_bytes_per_second'], 0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(_percentile(values, 50), 50)
+        self.assertEqual(_percentile(values, 99), 99)
+        self.assertEqual(_percentile([], 50), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
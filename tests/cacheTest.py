@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pyclowder.api.v1.files
+from pyclowder.cache import DownloadCache
+from pyclowder.connectors import Connector
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.downloads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _downloader(self, data):
+        def download():
+            self.downloads.append(data)
+            (fd, filename) = tempfile.mkstemp(suffix='.txt')
+            with os.fdopen(fd, 'wb') as outputfile:
+                outputfile.write(data)
+            return filename
+        return download
+
+    def _fetch(self, cache, fileid, data, signature=None):
+        if signature is None:
+            signature = DownloadCache.signature({'size': len(data)})
+        filename = cache.fetch(fileid, signature, self._downloader(data), '.txt')
+        with open(filename, 'rb') as inputfile:
+            contents = inputfile.read()
+        self.assertTrue(filename.endswith('.txt'))
+        os.remove(filename)
+        return contents
+
+    def test_cached(self):
+        cache = DownloadCache(self.folder, 1000)
+        self.assertEqual(self._fetch(cache, 'a', b'hello'), b'hello')
+        self.assertEqual(self._fetch(cache, 'a', b'hello'), b'hello')
+        self.assertEqual(self.downloads, [b'hello'])
+
+    def test_changed_file(self):
+        cache = DownloadCache(self.folder, 1000)
+        self._fetch(cache, 'a', b'hello')
+        self.assertEqual(self._fetch(cache, 'a', b'hello!'), b'hello!')
+        self.assertEqual(len(self.downloads), 2)
+
+    def test_least_recently_used_evicted(self):
+        cache = DownloadCache(self.folder, 25)
+        self._fetch(cache, 'a', b'a' * 10)
+        self._fetch(cache, 'b', b'b' * 10)
+        os.utime(os.path.join(self.folder, 'b'), (0, 0))
+        self._fetch(cache, 'c', b'c' * 10)
+        self.assertTrue(os.path.exists(os.path.join(self.folder, 'a')))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'b')))
+        self.assertTrue(os.path.exists(os.path.join(self.folder, 'c')))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'b.lock')))
+
+    def test_too_large(self):
+        cache = DownloadCache(self.folder, 4)
+        self.assertEqual(self._fetch(cache, 'a', b'hello'), b'hello')
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'a')))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'a.lock')))
+
+    def test_no_signature(self):
+        cache = DownloadCache(self.folder, 1000)
+        self.assertEqual(self._fetch(cache, 'a', b'hello', DownloadCache.signature({'id': 'a'})), b'hello')
+        self.assertEqual(self._fetch(cache, 'a', b'hello', DownloadCache.signature(None)), b'hello')
+        self.assertEqual(len(self.downloads), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'a')))
+
+
+
+class TestConnectorDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def _download(self, connector, host, key, fileid, intermediatefileid=None, ext="", tracking=True):
+        (fd, filename) = tempfile.mkstemp(suffix=ext)
+        with os.fdopen(fd, 'w') as outputfile:
+            outputfile.write(fileid)
+        return filename
+
+    def test_summary_v1(self):
+        # without a signature in the file information the summary of the file is used
+        connector = Connector('test', {'name': 'test'}, download_cache=DownloadCache(self.folder, 1000))
+        with mock.patch('pyclowder.files.files', pyclowder.api.v1.files), \
+                mock.patch('pyclowder.api.v1.files.download_info') as download_info, \
+                mock.patch('pyclowder.files.download', side_effect=self._download) as download:
+            download_info.return_value.json.return_value = {'id': 'a', 'size': 1}
+            for _ in range(2):
+                filename = connector._download_file('http://localhost/', 'key', 'a', 'a', '.txt', {'id': 'a'})
+                with open(filename) as inputfile:
+                    self.assertEqual(inputfile.read(), 'a')
+                os.remove(filename)
+        self.assertEqual(download.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pyclowder.datasets
+from pyclowder.collections import for_each_dataset
+from pyclowder.connectors import Connector
+
+# collection tree with a cycle (c3 -> c1), and dataset d2 in two collections
+_CHILDREN = {'c1': ['c2', 'c3'], 'c2': ['c4'], 'c3': ['c1', 'c4'], 'c4': []}
+_DATASETS = {'c1': ['d1', 'd2'], 'c2': ['d2', 'd3'], 'c3': ['d4'], 'c4': ['d5', 'bad']}
+
+
+def _get_child_collections(connector, host, key, collectionid):
+    return [{'id': c} for c in _CHILDREN[collectionid]]
+
+
+def _get_datasets(connector, host, key, collectionid):
+    return [{'id': d, 'name': d} for d in _DATASETS[collectionid]]
+
+
+class _CollectionTestCase(unittest.TestCase):
+    def setUp(self):
+        patchers = [mock.patch('pyclowder.collections.get_child_collections', side_effect=_get_child_collections),
+                    mock.patch('pyclowder.collections.get_datasets', side_effect=_get_datasets)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.connector = Connector('test', {'name': 'test'})
+
+
+class TestForEachDataset(_CollectionTestCase):
+    def test_walk(self):
+        visited = []
+        lock = threading.Lock()
+
+        def action(ds):
+            if ds['id'] == 'bad':
+                raise ValueError('bad dataset')
+            with lock:
+                visited.append(ds['id'])
+
+        progress = mock.Mock()
+        stats = for_each_dataset(self.connector, 'http://localhost/', 'key', 'c1', action, progress=progress)
+        self.assertEqual(sorted(visited), ['d1', 'd2', 'd3', 'd4', 'd5'])
+        self.assertEqual((stats['collections'], stats['datasets'], stats['processed'], stats['failed']),
+                         (4, 6, 5, 1))
+        self.assertIsInstance(stats['errors']['bad'], ValueError)
+        progress.assert_called_with(stats)
+
+    def test_submit_filtered(self):
+        with mock.patch('pyclowder.datasets.datasets.submit_extraction') as submit_extraction:
+            stats = pyclowder.datasets.submit_extractions_by_collection(
+                self.connector, 'http://localhost/', 'key', 'c1', 'extractor', recursive=False,
+                dataset_filter=lambda ds: ds['name'] != 'd1')
+        self.assertEqual([c[0][2] for c in submit_extraction.call_args_list], ['d2'])
+        self.assertEqual(stats['collections'], 1)
+
+
+class TestDeleteByCollection(_CollectionTestCase):
+    def _delete(self, **kwargs):
+        with mock.patch('pyclowder.datasets.delete') as delete, \
+                mock.patch('pyclowder.datasets.delete_collection') as delete_collection:
+            stats = pyclowder.datasets.delete_by_collection(self.connector, 'http://localhost/', 'key', 'c1',
+                                                            **kwargs)
+        return stats, [c[0][3] for c in delete.call_args_list], [c[0][3] for c in delete_collection.call_args_list]
+
+    def test_dry_run(self):
+        (stats, deleted, deleted_colls) = self._delete(delete_colls=True, dry_run=True)
+        self.assertEqual((deleted, deleted_colls), ([], []))
+        self.assertEqual(sorted(stats['deleted_datasets']), ['bad', 'd1', 'd2', 'd3', 'd4', 'd5'])
+        self.assertEqual(stats['deleted_collections'][-1], 'c1')
+
+    def test_checkpoint(self):
+        (fd, checkpoint) = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as checkpoint_file:
+            checkpoint_file.write('d1\nd2\n')
+        try:
+            started = time.time()
+            (stats, deleted, deleted_colls) = self._delete(delete_colls=True, checkpoint=checkpoint, rate_limit=20)
+            self.assertGreaterEqual(time.time() - started, 0.15)
+            self.assertEqual(sorted(deleted), ['bad', 'd3', 'd4', 'd5'])
+            self.assertEqual(deleted_colls[-1], 'c1')
+            self.assertEqual(len(deleted_colls), 4)
+            with open(checkpoint) as checkpoint_file:
+                self.assertEqual(len(checkpoint_file.read().split()), 10)
+
+            # resuming skips everything in the checkpoint
+            (stats, deleted, deleted_colls) = self._delete(delete_colls=True, checkpoint=checkpoint)
+            self.assertEqual((deleted, deleted_colls), ([], []))
+        finally:
+            os.remove(checkpoint)
+
+
+if __name__ == '__main__':
+    unittest.main()
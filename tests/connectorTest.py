@@ -0,0 +1,461 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+import pika
+
+import pyclowder.collections
+import pyclowder.datasets
+import pyclowder.metrics
+from benchmarks.fake_broker import FakeBroker
+from pyclowder.connectors import AsyncRabbitMQConnector, AsyncRabbitMQHandler, Connector, RabbitMQConnector, \
+    RabbitMQHandler
+from pyclowder.utils import CheckMessage, StatusMessage
+from testserver import Handler, start_server
+
+
+class _ClowderHandler(Handler):
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        self.reply({"path": self.path})
+
+
+class TestConnectorSession(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server(self, _ClowderHandler, clients=set())
+        self.host = self.server.url
+
+    def test_connection_reused(self):
+        connector = Connector('test', {'name': 'test'})
+        for i in range(5):
+            result = connector.get(self.host + 'api/files/%d' % i)
+            self.assertEqual(result.json()['path'], '/api/files/%d' % i)
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_client_reused(self):
+        connector = Connector('test', {'name': 'test'})
+        client = connector.get_client(self.host, 'key')
+        self.assertIs(connector.get_client(self.host, 'key'), client)
+        self.assertIsNot(connector.get_client(self.host, 'other'), client)
+        self.assertIs(client.session, connector.session)
+        self.assertEqual(client.headers, {'X-API-KEY': 'key'})
+        self.assertEqual(client.get('/status')['path'], '/api/status')
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_handler_shares_session(self):
+        connector = Connector('test', {'name': 'test'}, http_pool_size=4)
+        handler = RabbitMQHandler('test', {'name': 'test'}, None, session=connector.session)
+        self.assertIs(handler.session, connector.session)
+        self.assertEqual(connector.session.get_adapter(self.host)._pool_maxsize, 4)
+
+    def test_session_per_thread(self):
+        connector = Connector('test', {'name': 'test'})
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(connector.session._session())) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertIsNot(sessions[0], sessions[1])
+        self.assertIs(sessions[0].get_adapter(self.host), sessions[1].get_adapter(self.host))
+
+    def test_without_connector(self):
+        result = pyclowder.collections.get_child_collections(None, self.host, 'key', 'c1')
+        self.assertEqual(result['path'], '/api/collections/c1/getChildCollections?key=key')
+        self.assertEqual(pyclowder.datasets.get_info(None, self.host, 'key', 'd1')['path'],
+                         '/api/datasets/d1?key=key')
+
+
+class TestPrepareDataset(unittest.TestCase):
+    def _download(self, connector, host, key, fileid, intermediatefileid=None, ext="", tracking=True):
+        (fd, filename) = tempfile.mkstemp(suffix=ext)
+        with os.fdopen(fd, "w") as outputfile:
+            outputfile.write(fileid)
+        return filename
+
+    def test_missing_files_downloaded(self):
+        local = tempfile.NamedTemporaryFile(suffix='local.txt', delete=False)
+        local.close()
+        file_list = [{'id': 'f0', 'filename': os.path.basename(local.name), 'filepath': local.name,
+                      'file_ext': '.txt'}]
+        file_list += [{'id': 'f%d' % i, 'filename': 'f%d.txt' % i, 'filepath': '/remote/f%d.txt' % i,
+                       'file_ext': '.txt'} for i in range(1, 10)]
+
+        connector = Connector('test', {'name': 'test'}, parallel_downloads=3)
+        with mock.patch('pyclowder.datasets.get_file_list', return_value=file_list), \
+                mock.patch('pyclowder.datasets.download_metadata', return_value={}), \
+                mock.patch('pyclowder.files.download_metadata', return_value=[]), \
+                mock.patch('pyclowder.files.download', side_effect=self._download):
+            (file_paths, tmp_files, tmp_dirs) = connector._prepare_dataset('http://localhost/', 'key', {'id': 'ds'})
+
+        try:
+            self.assertEqual(file_paths[0], local.name)
+            downloaded = [open(f).read() for f in file_paths[2:-1:2]]
+            self.assertEqual(downloaded, ['f%d' % i for i in range(1, 10)])
+            self.assertTrue(file_paths[-1].endswith('ds_dataset_metadata.json'))
+            self.assertNotIn(local.name, tmp_files)
+        finally:
+            connector._remove_temporary(tmp_files, tmp_dirs)
+            os.remove(local.name)
+        self.assertFalse(any(os.path.exists(f) for f in tmp_files))
+
+
+class TestStatusCoalescing(unittest.TestCase):
+    def _published(self, handler):
+        channel = mock.Mock()
+        handler.process_messages(channel, 'test')
+        return [json.loads(c[1]['body'])['status'] for c in channel.basic_publish.call_args_list]
+
+    def test_processing_coalesced(self):
+        header = mock.Mock(reply_to='reply', correlation_id='1')
+        handler = RabbitMQHandler('test', {'name': 'test'}, 'job', header=header, method=mock.Mock(),
+                                  status_interval=3600)
+        resource = {'id': 'f1'}
+        handler.status_update(StatusMessage.start, resource, 'start')
+        for i in range(100):
+            handler.message_process(resource, 'step %d' % i)
+        self.assertEqual(len(self._published(handler)), 2)
+        for i in range(100, 200):
+            handler.message_process(resource, 'step %d' % i)
+        self.assertEqual(self._published(handler), [])
+        handler.message_ok(resource)
+        self.assertEqual(self._published(handler), ['StatusMessage.processing: step 199',
+                                                    'StatusMessage.done: Done processing.'])
+
+    def test_notify(self):
+        notify = mock.Mock()
+        handler = RabbitMQHandler('test', {'name': 'test'}, 'job', status_interval=3600, notify=notify)
+        handler.message_process({'id': 'f1'}, 'step')
+        notify.assert_not_called()
+        handler.message_ok({'id': 'f1'})
+        notify.assert_called_with()
+
+
+class TestAsyncRabbitMQHandler(unittest.TestCase):
+    def test_coroutine_process_message(self):
+        processed = []
+
+        async def process_message(connector, host, secret_key, resource, parameters):
+            processed.append(open(resource['local_paths'][0]).read())
+            await asyncio.sleep(0)
+
+        loop = asyncio.new_event_loop()
+        header = mock.Mock(reply_to='reply', correlation_id='1')
+        handler = AsyncRabbitMQHandler('test', {'name': 'test'}, 'job', process_message=process_message,
+                                       header=header, method=mock.Mock(delivery_tag=7), loop=loop)
+        body = {'id': 'f1', 'host': 'http://localhost', 'secretKey': 'key', 'routing_key': 'clowder.file.text'}
+        with mock.patch('pyclowder.files.download_info', return_value={'filename': 'f1.txt'}), \
+                mock.patch('pyclowder.files.download', side_effect=TestPrepareDataset()._download):
+            handler.start_thread(body)
+            loop.run_until_complete(handler.task)
+        loop.close()
+
+        channel = mock.Mock()
+        handler.process_messages(channel, 'test')
+        self.assertEqual(processed, ['f1'])
+        channel.basic_ack.assert_called_once_with(7)
+        self.assertTrue(handler.is_finished())
+
+    def test_await_aio_with_one_worker(self):
+        import pyclowder.aio.files
+
+        async def process_message(connector, host, secret_key, resource, parameters):
+            await pyclowder.aio.files.upload_metadata(connector, host, secret_key, resource['id'], {'a': 1})
+
+        # the steps of the job and the aio calls share one thread, the job must not hold it while it awaits
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        handler = AsyncRabbitMQHandler('test', {'name': 'test'}, 'job', process_message=process_message,
+                                       header=mock.Mock(reply_to='reply', correlation_id='1'),
+                                       method=mock.Mock(delivery_tag=7), loop=loop, executor=executor,
+                                       io_executor=executor)
+        body = {'id': 'f1', 'host': 'http://localhost', 'secretKey': 'key', 'routing_key': 'clowder.file.text'}
+        with mock.patch('pyclowder.files.download_info', return_value={'filename': 'f1.txt'}), \
+                mock.patch('pyclowder.files.download', side_effect=TestPrepareDataset()._download), \
+                mock.patch('pyclowder.files.upload_metadata') as upload_metadata:
+            handler.start_thread(body)
+            loop.run_until_complete(asyncio.wait_for(handler.task, 5))
+        upload_metadata.assert_called_once_with(handler, 'http://localhost/', 'key', 'f1', {'a': 1})
+
+        channel = mock.Mock()
+        handler.process_messages(channel, 'test')
+        channel.basic_ack.assert_called_once_with(7)
+
+
+class TestJobCache(unittest.TestCase):
+    def test_file_list_memoized(self):
+        import pyclowder.datasets
+
+        connector = Connector('test', {'name': 'test'})
+        file_list = [{'id': 'f1', 'filename': 'a.txt'}]
+        with mock.patch('pyclowder.datasets.datasets.get_file_list', return_value=file_list) as get_file_list, \
+                mock.patch('pyclowder.datasets.datasets.upload_metadata'):
+            for _ in range(3):
+                self.assertEqual(pyclowder.datasets.get_file_list(connector, 'http://localhost/', 'key', 'ds'),
+                                 file_list)
+            self.assertEqual(get_file_list.call_count, 1)
+
+            # writing to the dataset invalidates the cached file list
+            pyclowder.datasets.upload_metadata(connector, 'http://localhost/', 'key', 'ds', {})
+            pyclowder.datasets.get_file_list(connector, 'http://localhost/', 'key', 'ds')
+            self.assertEqual(get_file_list.call_count, 2)
+
+            # a new message starts with an empty cache
+            connector._process_message({})
+            pyclowder.datasets.get_file_list(connector, 'http://localhost/', 'key', 'ds')
+            self.assertEqual(get_file_list.call_count, 3)
+
+    def test_copies_returned(self):
+        connector = Connector('test', {'name': 'test'})
+        with mock.patch('pyclowder.datasets.datasets.get_file_list', return_value=[{'id': 'f1'}]):
+            pyclowder.datasets.get_file_list(connector, 'http://localhost/', 'key', 'ds').append({'id': 'f2'})
+            pyclowder.datasets.get_file_list(connector, 'http://localhost/', 'key', 'ds')[0]['id'] = 'f3'
+            self.assertEqual(pyclowder.datasets.get_file_list(connector, 'http://localhost/', 'key', 'ds'),
+                             [{'id': 'f1'}])
+
+    def test_cleared_after_message(self):
+        def process_message(connector, host, secret_key, resource, parameters):
+            pyclowder.datasets.get_file_list(connector, host, secret_key, 'ds')
+
+        connector = Connector('test', {'name': 'test'}, check_message=_check_message,
+                              process_message=process_message)
+        body = {'id': 'f1', 'host': 'http://localhost', 'secretKey': 'key', 'routing_key': 'clowder.file.text'}
+        with mock.patch('pyclowder.datasets.datasets.get_file_list', return_value=[]):
+            connector._process_message(body)
+        self.assertEqual(connector.job_cache, {})
+
+    def test_concurrent_fetch_once(self):
+        connector = Connector('test', {'name': 'test'})
+        client = connector.get_client('http://localhost/', 'key')
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return ['result']
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(connector.job_cached('test', client, 'r', fetch)))
+                   for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['result']] * 4)
+
+
+def _check_message(connector, host, secret_key, resource, parameters):
+    return CheckMessage.bypass
+
+
+def _process_message(connector, host, secret_key, resource, parameters):
+    if parameters.get('crash'):
+        os._exit(1)
+    connector.message_process(resource, 'pid %d' % os.getpid())
+
+
+class TestProcessPool(unittest.TestCase):
+    def _run(self, connector, body):
+        handler = connector._create_handler('job', mock.Mock(delivery_tag=1), mock.Mock(reply_to='reply'),
+                                            json.dumps(body))
+        handler.start_thread(body)
+        for _ in range(100):
+            if handler.done:
+                break
+            time.sleep(0.1)
+        channel = mock.Mock()
+        handler.process_messages(channel, 'test')
+        self.assertTrue(handler.is_finished())
+        return channel
+
+    def test_process_pool(self):
+        connector = RabbitMQConnector('test', {'name': 'test'}, 'amqp://', check_message=_check_message,
+                                      process_message=_process_message, processes=2)
+        body = {'id': 'f1', 'host': 'http://localhost', 'secretKey': 'key', 'routing_key': 'clowder.file.text'}
+        processed = pyclowder.metrics.PROCESS_MESSAGE_SECONDS.get(extractor='test')[0]
+        try:
+            channel = self._run(connector, body)
+            # metrics of the worker processes are send to the main process
+            self.assertEqual(pyclowder.metrics.PROCESS_MESSAGE_SECONDS.get(extractor='test')[0], processed + 1)
+            statuses = [json.loads(c[1]['body'])['message_type'] for c in channel.basic_publish.call_args_list]
+            self.assertEqual(statuses, ['StatusMessage.start', 'StatusMessage.processing', 'StatusMessage.done'])
+            self.assertNotIn('pid %d' % os.getpid(), channel.basic_publish.call_args_list[1][1]['body'])
+            channel.basic_ack.assert_called_once_with(1)
+
+            # a crashed worker process resubmits the message, and a new pool is used for the next message
+            pool = connector.process_pool
+            channel = self._run(connector, dict(body, crash=True))
+            self.assertEqual(json.loads(channel.basic_publish.call_args_list[-1][1]['body'])['retry_count'], 1)
+            channel.basic_ack.assert_called_once_with(1)
+            self.assertIsNot(connector.process_pool, pool)
+            self.assertTrue(pool._shutdown_thread)
+            self._run(connector, body).basic_ack.assert_called_once_with(1)
+        finally:
+            if connector.process_pool:
+                connector.process_pool.shutdown()
+
+    def test_broken_pool_on_submit(self):
+        connector = RabbitMQConnector('test', {'name': 'test'}, 'amqp://', processes=2)
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool('worker died')
+        pool = mock.Mock()
+        pool.submit.return_value = Future()
+        connector.process_pool = broken
+        handler = mock.Mock()
+        with mock.patch.object(connector, '_create_process_pool', return_value=pool):
+            self.assertIs(connector._submit_process(handler, {}), pool.submit.return_value)
+        broken.shutdown.assert_called_once_with(wait=False)
+        self.assertIs(connector.process_pool, pool)
+        self.assertEqual(list(connector.process_handlers.values()), [handler])
+
+    def test_broken_pool_requeued(self):
+        connector = RabbitMQConnector('test', {'name': 'test'}, 'amqp://', processes=2)
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool('worker died')
+        channel = mock.Mock()
+        body = {'id': 'f1', 'host': 'http://localhost', 'secretKey': 'key', 'routing_key': 'clowder.file.text'}
+        with mock.patch.object(connector, '_create_process_pool', return_value=broken):
+            connector.on_message(channel, mock.Mock(delivery_tag=3, redelivered=False),
+                                 mock.Mock(reply_to='reply', timestamp=None), json.dumps(body).encode('utf-8'))
+        channel.basic_nack.assert_called_once_with(3, requeue=True)
+        self.assertEqual(connector.handlers, [])
+        self.assertEqual(connector.process_handlers, {})
+
+    def test_crashed_dataset(self):
+        connector = RabbitMQConnector('test', {'name': 'test'}, 'amqp://', processes=2)
+        handler = connector._create_handler('job', mock.Mock(delivery_tag=1), mock.Mock(reply_to='reply'), '{}')
+        body = {'id': 'f1', 'datasetId': 'd1', 'routing_key': 'clowder.dataset.file.added'}
+        with mock.patch.object(handler, 'message_error') as message_error:
+            handler.process_crashed(0, body, 'killed')
+        message_error.assert_called_once_with({'type': 'dataset', 'id': 'd1'}, 'Worker process died: killed')
+
+
+class TestHeartbeat(unittest.TestCase):
+    def test_heartbeat_on_consumer_connection(self):
+        broker = FakeBroker()
+        connector = RabbitMQConnector('test', {'name': 'test'}, 'amqp://', heartbeat=0.2, heartbeat_load=True)
+        with mock.patch('pika.BlockingConnection', side_effect=broker.connect) as connect:
+            connector.connect()
+            thread = threading.Thread(target=connector.listen)
+            thread.start()
+            for _ in range(50):
+                if broker.exchanges['extractors'] >= 2:
+                    break
+                time.sleep(0.1)
+            connector.stop()
+            thread.join(5)
+        self.assertEqual(connect.call_count, 1)
+        self.assertGreaterEqual(broker.exchanges['extractors'], 2)
+        message = connector.announcer.message()
+        self.assertEqual((message['queue'], message['extractor_info']), ('test', {'name': 'test'}))
+        self.assertEqual((message['load']['workers'], message['load']['active']), (1, 0))
+
+
+class TestReconnect(unittest.TestCase):
+    def test_reconnect(self):
+        started = threading.Event()
+        release = threading.Event()
+        processed = []
+
+        def process_message(connector, host, secret_key, resource, parameters):
+            started.set()
+            release.wait(10)
+            processed.append(resource['id'])
+
+        broker = FakeBroker()
+        connector = RabbitMQConnector('test', {'name': 'test'}, 'amqp://', process_message=process_message,
+                                      reconnect_max_delay=0.5)
+        body = {'id': 'f1', 'host': 'http://localhost', 'secretKey': 'key', 'routing_key': 'clowder.file.text',
+                'jobid': 'job1'}
+        with mock.patch('pika.BlockingConnection', side_effect=broker.connect) as connect, \
+                mock.patch.object(connector, 'check_message', return_value=CheckMessage.bypass):
+            connector.connect()
+            thread = threading.Thread(target=connector.listen)
+            thread.daemon = True
+            thread.start()
+            try:
+                broker.publish('test', json.dumps(body).encode('utf-8'))
+                self.assertTrue(started.wait(5))
+
+                # the message that is being processed is delivered again on the new connection
+                broker.disconnect()
+                for _ in range(50):
+                    if connect.call_count == 2 and not broker.queues['test'] and connector.handlers \
+                            and not connector.handlers[0].stale:
+                        break
+                    time.sleep(0.1)
+                self.assertTrue(connector.alive())
+                release.set()
+                self.assertTrue(broker.wait_acked(1, 5))
+            finally:
+                release.set()
+                connector.stop()
+                thread.join(5)
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(processed, ['f1'])
+        self.assertFalse(connector.alive())
+
+    def test_backoff_while_down(self):
+        connector = RabbitMQConnector('test', {'name': 'test'}, 'amqp://', reconnect_max_delay=8)
+        delays = []
+
+        def wait(delay):
+            delays.append(delay)
+            if len(delays) == 6:
+                connector.stopping.set()
+
+        with mock.patch('pika.BlockingConnection', side_effect=pika.exceptions.AMQPConnectionError('down')), \
+                mock.patch('random.uniform', side_effect=lambda low, high: high), \
+                mock.patch.object(connector.stopping, 'wait', side_effect=wait):
+            connector.listen()
+        self.assertEqual(delays, [1, 2, 4, 8, 8, 8])
+
+    def test_async_reconnect(self):
+        connector = AsyncRabbitMQConnector('test', {'name': 'test'}, 'amqp://', reconnect_max_delay=8)
+        connections = []
+        delays = []
+
+        def connection(parameters, on_open_callback, on_open_error_callback, on_close_callback, custom_ioloop):
+            connections.append(mock.Mock(is_closing=False, is_closed=False))
+            if len(connections) == 3:
+                connector.stop()
+            custom_ioloop.call_soon(on_open_error_callback, connections[-1], 'down')
+            return connections[-1]
+
+        with mock.patch('pyclowder.connectors.AsyncioConnection', side_effect=connection), \
+                mock.patch('random.uniform', side_effect=lambda low, high: delays.append(high) or 0):
+            connector.listen()
+        self.assertEqual(len(connections), 3)
+        self.assertEqual(delays, [1, 2])
+        self.assertFalse(connector.alive())
+        connector.loop.close()
+
+    def test_stale_handler_by_id(self):
+        connector = RabbitMQConnector('test', {'name': 'test'}, 'amqp://')
+        body = json.dumps({'id': 'f1'}).encode('utf-8')
+        handlers = [mock.Mock(stale=1, message_id=message_id) for message_id in ('m1', 'm2')]
+        connector.handlers = handlers
+        # messages with the same body are matched on their message id
+        self.assertIs(connector._stale_handler(mock.Mock(message_id='m2'), body), handlers[1])
+        self.assertIs(connector._stale_handler(mock.Mock(message_id=None, correlation_id='m1'), body), handlers[0])
+        self.assertIsNone(connector._stale_handler(mock.Mock(message_id=None, correlation_id=None), body))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pyclowder.files
+from pyclowder.connectors import Connector
+from testserver import Handler, start_server
+
+
+class _UploadHandler(Handler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.reply([{'id': 'existing', 'filename': 'a.txt'}])
+
+    def do_POST(self):
+        body = self.read_body()
+        filename = body.split(b'filename="')[1].split(b'"')[0].decode('utf-8')
+        self.server.requests.append(self.path.split('?')[0] + '/' + filename)
+        if filename == 'fail.txt':
+            self.reply(b'', status=500)
+        else:
+            self.reply({'id': 'id-' + filename})
+
+
+class TestUploadMany(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server(self, _UploadHandler, requests=[])
+        self.host = self.server.url
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _file(self, name):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write(name)
+        return path
+
+    def test_upload_many(self):
+        connector = Connector('test', {'name': 'test'}, http_max_retries=0)
+        paths = [self._file('a.txt'), self._file('fail.txt'), os.path.join(self.folder, 'missing.txt')]
+        paths += [self._file('f%d.txt' % i) for i in range(10)]
+        results = pyclowder.files.upload_many_to_dataset(connector, self.host, 'key', 'ds', paths + paths[-2:],
+                                                         check_duplicate=True)
+
+        self.assertIsNone(results[paths[0]])
+        self.assertIsInstance(results[paths[1]], Exception)
+        self.assertIsInstance(results[paths[2]], IOError)
+        for i in range(10):
+            self.assertEqual(results[paths[i + 3]], 'id-f%d.txt' % i)
+        self.assertEqual(self.server.requests.count('/api/datasets/ds/files?key=key'), 1)
+        # paths given twice are uploaded once
+        self.assertEqual(len(self.server.requests), 12)
+
+    def test_same_path_without_check(self):
+        connector = Connector('test', {'name': 'test'})
+        path = self._file('a.txt')
+        results = pyclowder.files.upload_many_to_dataset(connector, self.host, 'key', 'ds', [path, path])
+        self.assertEqual(results, {path: 'id-a.txt'})
+        self.assertEqual(self.server.requests, ['/api/uploadToDataset/ds/a.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from pyclowder.connectors import Connector
+import pyclowder.geostreams
+from pyclowder.geostreams import DatapointBatcher, GeostreamsIndex, SpatialIndex
+from testserver import Handler, start_server
+
+
+class _GeostreamsHandler(Handler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path.split('?')[0])
+        self.reply([{'id': 1, 'name': 'other'}, {'id': 2, 'name': 'sensor'}])
+
+    def do_POST(self):
+        body = json.loads(self.read_body())
+        path = self.path.split('?')[0]
+        with self.server.lock:
+            self.server.requests.append(path)
+            if path.endswith('/bulk') and not self.server.bulk:
+                return self.reply({}, status=404)
+            if path.endswith('/bulk') and self.server.bulk_status:
+                return self.reply({}, status=self.server.bulk_status)
+            if path.endswith('/bulk') and any(b['properties'].get('bad') for b in body):
+                return self.reply({}, status=400)
+            if not path.endswith('/bulk') and body['properties'].get('bad'):
+                return self.reply({}, status=400)
+            if not path.endswith('/bulk') and self.server.fail_next > 0:
+                self.server.fail_next -= 1
+                return self.reply({}, status=500)
+            self.server.datapoints.extend(body if isinstance(body, list) else [body])
+        self.reply({'id': len(self.server.datapoints)})
+
+
+class _GeostreamsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server(self, _GeostreamsHandler, requests=[], datapoints=[], bulk=True, bulk_status=None,
+                                   fail_next=0)
+        self.host = self.server.url
+        self.connector = Connector('test', {'name': 'test'})
+
+
+class TestDatapointBatcher(_GeostreamsTestCase):
+    def _add(self, batcher, count, streams=2, bad=()):
+        for i in range(count):
+            batcher.add('s%d' % (i % streams), {'type': 'Point', 'coordinates': [0, 0, 0]},
+                        '2017-01-25T09:33:02-06:00', '2017-01-25T09:33:02-06:00', {'value': i, 'bad': i in bad})
+
+    def test_bulk(self):
+        with DatapointBatcher(self.connector, self.host, 'key', batch_size=10, max_workers=2,
+                              backoff_factor=0) as batcher:
+            self._add(batcher, 95, bad=[7])
+        stats = batcher.stats()
+        self.assertEqual((stats['submitted'], stats['created'], stats['failed']), (95, 94, 1))
+        self.assertEqual(batcher.failed[0][0]['properties']['value'], 7)
+        self.assertEqual(sorted(d['properties']['value'] for d in self.server.datapoints),
+                         [i for i in range(95) if i != 7])
+        # 10 bulk requests, and the batch with the bad datapoint is send one at a time
+        self.assertEqual(self.server.requests.count('/api/geostreams/datapoints/bulk'), 10)
+        self.assertEqual(self.server.requests.count('/api/geostreams/datapoints'), 10)
+
+    def test_fallback_single(self):
+        self.server.bulk = False
+        self.server.fail_next = 2
+        with DatapointBatcher(self.connector, self.host, 'key', batch_size=10, max_workers=4,
+                              backoff_factor=0) as batcher:
+            self._add(batcher, 50)
+        self.assertFalse(batcher.bulk)
+        self.assertEqual(batcher.stats()['created'], 50)
+        self.assertEqual(len(self.server.datapoints), 50)
+        self.assertLessEqual(self.server.requests.count('/api/geostreams/datapoints/bulk'), 6)
+
+    def test_bulk_client_errors(self):
+        self.server.bulk_status = 400
+        with DatapointBatcher(self.connector, self.host, 'key', batch_size=10, max_workers=1,
+                              backoff_factor=0) as batcher:
+            self._add(batcher, 60)
+        # bulk is not used after 3 rejected requests, the datapoints are created one at a time
+        self.assertFalse(batcher.bulk)
+        self.assertEqual(self.server.requests.count('/api/geostreams/datapoints/bulk'), 3)
+        self.assertEqual(self.server.requests.count('/api/geostreams/datapoints'), 60)
+        self.assertEqual(batcher.stats()['created'], 60)
+
+    def test_flush_interval(self):
+        with DatapointBatcher(self.connector, self.host, 'key', batch_size=10, flush_interval=0.2) as batcher:
+            self._add(batcher, 3)
+            for _ in range(50):
+                if len(self.server.datapoints) == 3:
+                    break
+                time.sleep(0.1)
+            # the datapoints are send without adding more datapoints or closing the batcher
+            self.assertEqual(len(self.server.datapoints), 3)
+        self.assertEqual(batcher.stats()['created'], 3)
+
+    def test_other_errors_failed(self):
+        with unittest.mock.patch.object(self.connector, 'post', side_effect=ValueError('bad json')):
+            with DatapointBatcher(self.connector, self.host, 'key', bulk=False, backoff_factor=0) as batcher:
+                self._add(batcher, 2)
+        self.assertEqual(batcher.stats()['failed'], 2)
+        self.assertIsInstance(batcher.failed[0][1], ValueError)
+
+
+class TestGeostreamsIndex(_GeostreamsTestCase):
+    def test_sensor_cached(self):
+        (fd, filename) = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(filename)
+        try:
+            with unittest.mock.patch('pyclowder.geostreams.index', GeostreamsIndex(ttl=60, filename=filename)):
+                for _ in range(3):
+                    sensor = pyclowder.geostreams.get_sensor_by_name(self.connector, self.host, 'key', 'sensor')
+                    self.assertEqual(sensor['id'], 2)
+                self.assertIsNone(pyclowder.geostreams.get_sensor_by_name(self.connector, self.host, 'key', 'x'))
+                self.assertEqual(len(self.server.requests), 2)
+
+                # the index is loaded from disk
+                self.assertEqual(GeostreamsIndex(ttl=60, filename=filename).get('sensor', self.host, 'sensor'),
+                                 sensor)
+
+                # creating a sensor removes it from the index
+                pyclowder.geostreams.create_sensor(self.connector, self.host, 'key', 'sensor', {}, {}, 'region')
+                pyclowder.geostreams.get_sensor_by_name(self.connector, self.host, 'key', 'sensor')
+                self.assertEqual(self.server.requests.count('/api/geostreams/sensors'), 4)
+        finally:
+            os.remove(filename)
+            os.remove(filename + '.lock')
+
+    def test_shared_file(self):
+        (fd, filename) = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(filename)
+        try:
+            (first, second) = (GeostreamsIndex(ttl=60, filename=filename), GeostreamsIndex(ttl=60, filename=filename))
+            first.put('sensor', self.host, 'a', {'id': 1})
+            second.put('sensor', self.host, 'b', {'id': 2})
+            self.assertEqual(first.get('sensor', self.host, 'b'), {'id': 2})
+            self.assertEqual(second.get('sensor', self.host, 'a'), {'id': 1})
+
+            # adding the same value again, or removing a missing name, does not write the file
+            mtime = os.stat(filename).st_mtime_ns
+            first.put('sensor', self.host, 'b', {'id': 2})
+            first.invalidate('sensor', self.host, 'c')
+            self.assertEqual(os.stat(filename).st_mtime_ns, mtime)
+
+            second.invalidate('sensor', self.host, 'a')
+            self.assertIsNone(first.get('sensor', self.host, 'a'))
+        finally:
+            for path in (filename, filename + '.lock'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_expired(self):
+        index = GeostreamsIndex(ttl=60)
+        index.put('stream', self.host, 's', {'id': 1})
+        self.assertEqual(index.get('stream', self.host.rstrip('/'), 's'), {'id': 1})
+        index.entries[('stream', self.host.rstrip('/'), 's')][0] = 0
+        self.assertIsNone(index.get('stream', self.host, 's'))
+
+
+class TestSharedSpatialIndex(_GeostreamsTestCase):
+    def test_index_per_key(self):
+        index = pyclowder.geostreams.get_sensor_index(self.connector, self.host, 'key1')
+        self.assertIs(pyclowder.geostreams.get_sensor_index(self.connector, self.host.rstrip('/'), 'key1'), index)
+        self.assertIsNot(pyclowder.geostreams.get_sensor_index(self.connector, self.host, 'key2'), index)
+
+        # a later call refreshes the index with its own connector and refresh interval
+        other = Connector('other', {'name': 'other'})
+        index = pyclowder.geostreams.get_sensor_index(other, self.host, 'key1', refresh_interval=10)
+        self.assertEqual(index.refresh_interval, 10)
+        with unittest.mock.patch.object(other, 'get', wraps=other.get) as get:
+            index.refresh()
+        get.assert_called_once()
+
+    def test_polygon_index(self):
+        features = [{'id': 1, 'geometry': {'type': 'Point', 'coordinates': [1, 1, 0]}},
+                    {'id': 2, 'geometry': {'type': 'Point', 'coordinates': [5, 5, 0]}}]
+        with unittest.mock.patch('pyclowder.geostreams.get_streams', return_value=features):
+            found = pyclowder.geostreams.get_streams_by_polygon(self.connector, self.host, 'polygon',
+                                                                [(0, 0), (2, 0), (2, 2), (0, 2)], use_index=True)
+        self.assertEqual([f['id'] for f in found], [1])
+        self.assertEqual(self.server.requests, [])
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(42)
+        self.loads = 0
+        self.sensors = [{'id': i, 'geometry': {'type': 'Point',
+                                               'coordinates': [rnd.uniform(-180, 180), rnd.uniform(-89, 89), 0]}}
+                        for i in range(2000)]
+        self.sensors.append({'id': 'nogeom', 'geometry': None})
+
+    def _load(self):
+        self.loads += 1
+        return self.sensors
+
+    def _brute(self, lon, lat, radius):
+        found = [s for s in self.sensors[:-1] if SpatialIndex.distance(lon, lat, *s['geometry']['coordinates'][:2])
+                 <= radius]
+        return sorted(s['id'] for s in found)
+
+    def test_queries(self):
+        index = SpatialIndex(self._load, cell_size=5)
+        rnd = random.Random(1)
+        for _ in range(100):
+            (lon, lat) = (rnd.uniform(-180, 180), rnd.uniform(-90, 90))
+            nearest = index.nearest(lon, lat)
+            expected = min(self.sensors[:-1],
+                           key=lambda s: SpatialIndex.distance(lon, lat, *s['geometry']['coordinates'][:2]))
+            self.assertEqual(nearest['id'], expected['id'])
+            found = index.circle(lon, lat, 500000) or []
+            self.assertEqual(sorted(s['id'] for s in found), self._brute(lon, lat, 500000))
+        self.assertEqual(self.loads, 1)
+
+        inside = index.polygon([(0, 0), (20, 0), (20, 20), (0, 20)])
+        expected = [s['id'] for s in self.sensors[:-1] if 0 <= s['geometry']['coordinates'][0] <= 20 and
+                    0 <= s['geometry']['coordinates'][1] <= 20]
+        self.assertEqual(sorted(s['id'] for s in inside), sorted(expected))
+
+    def test_refresh(self):
+        index = SpatialIndex(self._load, refresh_interval=60)
+        self.assertIsNotNone(index.nearest(0, 0))
+        index.loaded -= 120
+        index.nearest(0, 0)
+        self.assertEqual(self.loads, 2)
+        self.assertIsNone(SpatialIndex(lambda: []).nearest(0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import urllib.request
+
+import pyclowder.metrics
+from pyclowder.connectors import Connector
+from pyclowder.metrics import Counter, Histogram, Registry
+from testserver import Handler, start_server
+
+
+class _ClowderHandler(Handler):
+    def do_GET(self):
+        self.reply(b'x' * 100)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        counter = Counter('test_total', 'Test counter.', ['status'], registry=registry)
+        histogram = Histogram('test_seconds', 'Test histogram.', buckets=(1, 5), registry=registry)
+        counter.inc(status='ok')
+        counter.inc(2, status='ok')
+        histogram.observe(0.5)
+        histogram.observe(3)
+        histogram.observe(10)
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP test_total Test counter.',
+            '# TYPE test_total counter',
+            'test_total{status="ok"} 3',
+            '# HELP test_seconds Test histogram.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="1"} 1',
+            'test_seconds_bucket{le="5"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 13.5',
+            'test_seconds_count 3',
+        ])
+        self.assertRaises(ValueError, counter.inc, state='ok')
+
+    def test_endpoint(self):
+        self.assertEqual(pyclowder.metrics.endpoint('http://localhost/api/files/5f0c8a2e9b1e4a3d2c1b0a99/blob?key=k'),
+                         '/api/files/{id}/blob')
+        self.assertEqual(pyclowder.metrics.endpoint('http://localhost/api/v2/datasets/'
+                                                    '1b4e28ba-2fa1-11d2-883f-0016d3cca427/files'),
+                         '/api/v2/datasets/{id}/files')
+
+    def test_http_metrics(self):
+        server = start_server(self, _ClowderHandler)
+        metrics_server = pyclowder.metrics.start_http_server(0, '127.0.0.1')
+        try:
+            connector = Connector('test', {'name': 'test'})
+            labels = {'direction': 'download', 'endpoint': '/api/files/{id}'}
+            before = pyclowder.metrics.HTTP_BYTES.get(**labels)
+            for i in range(3):
+                connector.get(server.url + 'api/files/%d' % i)
+            self.assertEqual(pyclowder.metrics.HTTP_BYTES.get(**labels) - before, 300)
+
+            url = 'http://127.0.0.1:%d/metrics' % metrics_server.server_port
+            text = urllib.request.urlopen(url).read().decode('utf-8')
+            self.assertIn('pyclowder_http_request_seconds_count{method="GET",endpoint="/api/files/{id}",'
+                          'status="200"}', text)
+        finally:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import pyclowder.profiler
+from pyclowder.connectors import Connector
+
+
+def slow_function():
+    time.sleep(0.3)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        pyclowder.profiler.configure(None)
+        shutil.rmtree(self.directory)
+
+    def _process(self, process_message):
+        connector = Connector('test', {'name': 'test'}, process_message=process_message)
+        body = {'id': 'f1', 'host': 'http://localhost', 'secretKey': 'key', 'routing_key': 'clowder.file.text'}
+        with mock.patch('pyclowder.files.download_info', return_value={'filename': 'f1.txt'}), \
+                mock.patch.object(connector, '_download_file', return_value=None):
+            connector._process_message(body)
+
+    def test_slow_job(self):
+        pyclowder.profiler.configure(pyclowder.profiler.Profiler(self.directory, threshold=0.2))
+        self._process(lambda connector, host, key, resource, parameters: slow_function())
+        self._process(lambda connector, host, key, resource, parameters: None)
+
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+        self.assertRegex(files[0], r'^\d{8}T\d{6}-test-file-f1-0\.\ds\.folded$')
+        with open(os.path.join(self.directory, files[0])) as profile_file:
+            lines = profile_file.read().splitlines()
+        samples = sum(int(line.rsplit(' ', 1)[1]) for line in lines if 'slow_function' in line)
+        self.assertGreater(samples, 5)
+        self.assertTrue(all('_process_message' in line for line in lines))
+
+    def test_sample_rate(self):
+        pyclowder.profiler.configure(pyclowder.profiler.Profiler(self.directory, threshold=60, sample_rate=1))
+        self._process(lambda connector, host, key, resource, parameters: None)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_disabled(self):
+        with pyclowder.profiler.profile('test') as job:
+            pyclowder.profiler.tag(id='f1')
+        self.assertIsNone(job)
+
+
+if __name__ == '__main__':
+    unittest.main()
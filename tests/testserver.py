@@ -0,0 +1,61 @@
+"""HTTP server used by the tests in place of clowder and other services."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Base class of the request handlers of the tests, with helpers to read and send bodies."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def reply(self, data, status=200, headers=None):
+        """Send data, encoded as JSON unless it is bytes."""
+        body = data if isinstance(data, bytes) else json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        if not isinstance(data, bytes):
+            self.send_header('Content-Type', 'application/json')
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    """Server on a free port of localhost, handling each connection in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, handler):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.lock = threading.Lock()
+        self.url = 'http://127.0.0.1:%d/' % self.server_port
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_server(testcase, handler, **attributes):
+    """Start a server for testcase, the attributes are set on the server, it is stopped when the test is done."""
+    server = Server(handler)
+    for (name, value) in attributes.items():
+        setattr(server, name, value)
+    server.start()
+    testcase.addCleanup(server.stop)
+    return server
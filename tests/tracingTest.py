@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import pyclowder.tracing
+from pyclowder.connectors import Connector
+from testserver import Handler, start_server
+
+
+class _CollectorHandler(Handler):
+    def do_GET(self):
+        self.reply(b'{}')
+
+    def do_POST(self):
+        self.server.posts.append((self.path, json.loads(self.read_body())))
+        self.reply(b'{}')
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        (fd, self.filename) = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        pyclowder.tracing.configure(pyclowder.tracing.JsonlExporter(self.filename))
+        self.server = start_server(self, _CollectorHandler, posts=[])
+        self.host = self.server.url
+
+    def tearDown(self):
+        pyclowder.tracing.configure(None)
+        os.remove(self.filename)
+
+    def _spans(self):
+        with open(self.filename) as trace_file:
+            return {s['name']: s for s in (json.loads(line) for line in trace_file)}
+
+    def _download(self, connector, host, key, fileid, intermediatefileid=None, ext="", tracking=True):
+        connector.get(self.host + 'api/files/%s/blob' % fileid)
+        (fd, filename) = tempfile.mkstemp(suffix=ext)
+        with os.fdopen(fd, "w") as outputfile:
+            outputfile.write('0123456789')
+        return filename
+
+    def test_job_spans(self):
+        def process_message(connector, host, secret_key, resource, parameters):
+            with pyclowder.tracing.span('convert', fileid=resource['id']):
+                pass
+
+        connector = Connector('test', {'name': 'test'}, process_message=process_message)
+        body = {'id': 'f1', 'host': 'http://localhost', 'secretKey': 'key', 'routing_key': 'clowder.file.text',
+                'retry_count': 2}
+        with mock.patch('pyclowder.files.download_info', return_value={'filename': 'f1.txt'}), \
+                mock.patch('pyclowder.files.download', side_effect=self._download):
+            connector._process_message(body)
+
+        spans = self._spans()
+        job = spans['job']
+        self.assertIsNone(job['parent_id'])
+        self.assertEqual((job['attributes']['resource.id'], job['attributes']['retry_count']), ('f1', 2))
+        for name in ['parse_message', 'download_info', 'download', 'process_message']:
+            self.assertEqual(spans[name]['parent_id'], job['span_id'])
+            self.assertEqual(spans[name]['trace_id'], job['trace_id'])
+        self.assertEqual(spans['download']['attributes']['bytes'], 10)
+        self.assertEqual(spans['HTTP GET']['parent_id'], spans['download']['span_id'])
+        self.assertEqual(spans['HTTP GET']['attributes']['http.endpoint'], '/api/files/f1/blob')
+        self.assertEqual(spans['convert']['parent_id'], spans['process_message']['span_id'])
+
+    def test_otlp(self):
+        exporter = pyclowder.tracing.OtlpExporter(self.host, interval=60)
+        pyclowder.tracing.configure(exporter)
+        with pyclowder.tracing.span('job', retry_count=1):
+            with self.assertRaises(ValueError):
+                with pyclowder.tracing.span('stage'):
+                    raise ValueError('failed')
+        for _ in range(50):
+            if self.server.posts:
+                break
+            time.sleep(0.1)
+        (path, request) = self.server.posts[0]
+        self.assertEqual(path, '/v1/traces')
+        spans = request['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual([s['name'] for s in spans], ['stage', 'job'])
+        self.assertEqual(spans[0]['parentSpanId'], spans[1]['spanId'])
+        self.assertEqual(spans[0]['status']['code'], 2)
+        self.assertEqual(spans[1]['attributes'], [{'key': 'retry_count', 'value': {'intValue': '1'}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import pyclowder.utils
+from pyclowder.connectors import Connector
+from testserver import Handler, start_server
+
+
+class _Stream(io.RawIOBase):
+    """Non seekable stream returning small chunks, like the body of a HTTP response."""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        size = min(size, 1000)
+        data = self.data[self.position:self.position + size]
+        self.position += len(data)
+        return bytes(data)
+
+
+class _Sink(io.RawIOBase):
+    """Non seekable output, forcing zipfile to write data descriptors."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+class TestExtractZipStream(unittest.TestCase):
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.contents = {
+            'a/b.txt': b'hello' * 1000,
+            'random.bin': os.urandom(300000),
+            'empty.txt': b'',
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def _zip(self, output, compression):
+        with zipfile.ZipFile(output, 'w', compression=compression) as zipobj:
+            zipobj.writestr('a/', b'')
+            for name, data in self.contents.items():
+                zipobj.writestr(name, data)
+
+    def _check(self, data):
+        file_list = pyclowder.utils.extract_zip_stream(_Stream(data), self.output_folder, chunk_size=4096)
+        extracted = {}
+        for filename in file_list:
+            with open(filename, 'rb') as extracted_file:
+                extracted[os.path.relpath(filename, self.output_folder)] = extracted_file.read()
+        self.assertEqual(extracted, self.contents)
+
+    def test_deflated(self):
+        output = io.BytesIO()
+        self._zip(output, zipfile.ZIP_DEFLATED)
+        self._check(output.getvalue())
+
+    def test_deflated_data_descriptor(self):
+        output = _Sink()
+        self._zip(output, zipfile.ZIP_DEFLATED)
+        self._check(output.data)
+
+    def test_stored(self):
+        output = io.BytesIO()
+        self._zip(output, zipfile.ZIP_STORED)
+        self._check(output.getvalue())
+
+    def test_stored_data_descriptor(self):
+        output = _Sink()
+        self._zip(output, zipfile.ZIP_STORED)
+        with self.assertRaises(zipfile.BadZipFile):
+            self._check(output.data)
+
+    def test_no_path_traversal(self):
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w') as zipobj:
+            zipobj.writestr('../../evil.txt', b'evil')
+        file_list = pyclowder.utils.extract_zip_stream(_Stream(output.getvalue()), self.output_folder)
+        self.assertEqual(file_list, [os.path.join(self.output_folder, 'evil.txt')])
+
+
+class _RangeHandler(Handler):
+    def do_GET(self):
+        data = self.server.data
+        start, end = 0, len(data) - 1
+        if 'Range' in self.headers:
+            (first, last) = self.headers['Range'].split('=')[1].split('-')
+            start, end = int(first), int(last) if last else len(data) - 1
+            self.server.ranges.append((start, end))
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        body = data[start:end + 1]
+        if self.server.drop_after:
+            # simulate a broken connection, sending only part of the body
+            body = body[:self.server.drop_after]
+            self.server.drop_after = 0
+            self.close_connection = True
+        self.wfile.write(body)
+
+
+class TestDownloadFile(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server(self, _RangeHandler, data=os.urandom(100000), ranges=[], drop_after=0)
+        self.url = self.server.url + 'api/files/1'
+        (fd, self.filename) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def _read(self):
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    def test_segments(self):
+        pyclowder.utils.download_file(Connector('test', {'name': 'test'}), self.url, self.filename, segments=4,
+                                      chunk_size=1000, min_segment_size=20000)
+        self.assertEqual(self._read(), self.server.data)
+        # the first segment is read from the initial request
+        self.assertEqual(sorted(self.server.ranges), [(25000, 49999), (50000, 74999), (75000, 99999)])
+
+    def test_resume(self):
+        self.server.drop_after = 30000
+        pyclowder.utils.download_file(Connector('test', {'name': 'test'}), self.url, self.filename, chunk_size=1000)
+        self.assertEqual(self._read(), self.server.data)
+        self.assertEqual(self.server.ranges, [(30000, 99999)])
+
+
+class TestUploadFile(unittest.TestCase):
+    def test_streamed(self):
+        (fd, filename) = tempfile.mkstemp(suffix='.png')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'x' * 100000)
+        uploads = []
+
+        def post(url, data=None, headers=None, verify=True):
+            uploads.append((data.fields['File'][1], headers, data.read(1000), data.read()))
+            return mock.Mock(status_code=200)
+
+        connector = mock.Mock(post=post, ssl_verify=True)
+        try:
+            pyclowder.utils.upload_file(connector, 'http://localhost/api/previews', filename, field='File',
+                                        mimetype='image/png', headers={'X-API-KEY': 'key'})
+        finally:
+            os.remove(filename)
+        (filedata, headers, first, rest) = uploads[0]
+        self.assertTrue(filedata.closed)
+        self.assertEqual(headers['X-API-KEY'], 'key')
+        self.assertTrue(headers['Content-Type'].startswith('multipart/form-data'))
+        self.assertIn(b'Content-Type: image/png', first)
+        self.assertIn(b'x' * 100000, first + rest)
+
+
+if __name__ == '__main__':
+    unittest.main()